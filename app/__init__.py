@@ -20,6 +20,12 @@ def create_app(config_class=Config):
     login_manager.init_app(app)
     migrate.init_app(app, db)
 
+    from . import database
+    database.init_app(app)
+
+    from . import metrics
+    metrics.init_app(app)
+
     # Register blueprints here
     from .main import bp as main_bp
     app.register_blueprint(main_bp)
@@ -0,0 +1,42 @@
+from functools import wraps
+from flask import session
+from flask_login import current_user
+from app import login_manager
+from .signing import has_valid_signature
+
+
+def session_login_required(view):
+    """
+    Like flask_login.login_required, but trusts a logged-in session cookie without loading the user.
+
+    Flask-Login's login_required resolves current_user, which runs load_user and
+    hits the database on every request. For high-volume, content-addressed
+    resources such as thumbnails the signed session cookie is proof enough.
+    Requests without a session user (e.g. remember-me cookie only) fall back to
+    the regular current_user check.
+    """
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        if session.get('_user_id') is None and not current_user.is_authenticated:
+            return login_manager.unauthorized()
+        return view(*args, **kwargs)
+    return decorated_view
+
+
+def signed_url_or(login_check):
+    """
+    Lets requests with a valid signed URL (see app.auth.signing) through without a login check.
+
+    Any other request goes through `login_check` (e.g. login_required). Views
+    can check g.signed_url to skip their own per-request lookups.
+    """
+    def decorator(view):
+        checked_view = login_check(view)
+
+        @wraps(view)
+        def decorated_view(*args, **kwargs):
+            if has_valid_signature():
+                return view(*args, **kwargs)
+            return checked_view(*args, **kwargs)
+        return decorated_view
+    return decorator
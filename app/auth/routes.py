@@ -1,7 +1,7 @@
 from flask import render_template, redirect, url_for, flash, request
 from urllib.parse import urlparse, urljoin
 from . import bp
-from app.models import User
+from app.models import User, invalidate_cached_user
 from .forms import LoginForm, RegistrationForm
 from flask_login import current_user, login_user, logout_user # login_required can be added later if needed
 from app import db
@@ -46,6 +46,8 @@ def login():
 
 @bp.route('/logout')
 def logout():
+    if current_user.is_authenticated:
+        invalidate_cached_user(current_user.id)
     logout_user()
     flash('You have been logged out.')
     return redirect(url_for('main.index'))
@@ -8,11 +8,20 @@ load_dotenv(os.path.join(basedir, '..', '.env')) # Look for .env in the project
 class Config:
     """Base configuration settings."""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess' # Change this in production!
+    # Pages link thumbnails and images with URLs signed with SECRET_KEY, valid for 1-2x this many seconds (0: off)
+    SIGNED_URL_TTL = int(os.environ.get('SIGNED_URL_TTL', 3600))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60)) # Seconds a logged-in user is cached per process (0: off)
 
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, '..', 'ohmyphoto.db') # DB in project root
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite tuning (ignored for other databases); WAL lets web requests read while a scan writes
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL' # In WAL mode only an OS crash can lose the last commits
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 30000) # Milliseconds to wait for the write lock
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or 65536) # Page cache per connection, in KiB
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 268435456) # Bytes of the database file read through mmap
 
     # Paths for data storage (customize these)
     # Ensure these directories exist or are created by the app
@@ -21,6 +30,64 @@ class Config:
     THUMBNAIL_DIR = os.path.join(DATA_STORAGE_PATH, 'thumbnails')
     METADATA_DB_PATH = os.path.join(DATA_STORAGE_PATH, 'metadata.db') # Example path for metadata DB
 
+    # Thumbnail renditions: the base size is generated during scans, other sizes on first request
+    THUMBNAIL_BASE_SIZE = 400
+    THUMBNAIL_SIZES = [int(s) for s in (os.environ.get('THUMBNAIL_SIZES') or '128,400,1024,2048').split(',')]
+    # Preferred output formats in order; JPEG is always added as the fallback. Unsupported ones are skipped.
+    THUMBNAIL_FORMATS = (os.environ.get('THUMBNAIL_FORMATS') or 'webp').split(',')
+    THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY') or 85) # Encoder quality, 1-100
+    # Downscaling filter: nearest, box, bilinear, hamming, bicubic or lanczos (the vips backend always uses lanczos3)
+    THUMBNAIL_RESAMPLE = os.environ.get('THUMBNAIL_RESAMPLE') or 'bicubic'
+    # 'pillow', 'vips' (needs pyvips and libvips) or 'auto': vips when installed, Pillow otherwise
+    THUMBNAIL_BACKEND = os.environ.get('THUMBNAIL_BACKEND') or 'auto'
+    # 'hashdir': one file per rendition; 'packed': append-only pack files under THUMBNAIL_DIR/packs
+    THUMBNAIL_STORE = os.environ.get('THUMBNAIL_STORE') or 'hashdir'
+
+    # Library scanner settings
+    SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS') or 0) or None # Worker processes, defaults to CPU count
+    SCAN_MAX_IN_FLIGHT = int(os.environ.get('SCAN_MAX_IN_FLIGHT') or 0) or None # Files queued between stages, defaults to 4x workers
+    SCAN_BATCH_SIZE = int(os.environ.get('SCAN_BATCH_SIZE') or 500) # Photo rows written per transaction
+    SCAN_PROGRESS_INTERVAL = float(os.environ.get('SCAN_PROGRESS_INTERVAL') or 1.0) # Seconds between progress reports
+    SCAN_METRICS_FILE = os.environ.get('SCAN_METRICS_FILE') or None # Defaults to DATA_STORAGE_PATH/scan_metrics.prom
+    # Comma separated globs; without a '/' they match file/directory names, otherwise paths relative to the library
+    SCAN_INCLUDE = [p for p in (os.environ.get('SCAN_INCLUDE') or '').split(',') if p] # Only files matching one of these
+    SCAN_EXCLUDE = [p for p in (os.environ.get('SCAN_EXCLUDE') or '').split(',') if p] # Skipped files and directories, e.g. @eaDir,.*
+
+    # Library watcher (flask watch-library)
+    WATCH_DEBOUNCE = float(os.environ.get('WATCH_DEBOUNCE') or 2.0) # Seconds of quiet before changes are applied
+    WATCH_MAX_DELAY = 30.0 # Apply pending changes after this long even if events keep arriving
+    WATCH_POLL_INTERVAL = int(os.environ.get('WATCH_POLL_INTERVAL') or 60) # Polling fallback interval in seconds
+    WATCH_WORKERS = int(os.environ.get('WATCH_WORKERS') or 2)
+
+    # Background jobs (flask run-jobs)
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL') or 1.0) # Seconds between polls of an empty queue
+    JOB_HEARTBEAT_INTERVAL = 5 # Seconds between heartbeats (and scan progress updates) of a running job
+    JOB_STALE_AFTER = 300 # Running jobs without a heartbeat for this long are requeued
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS') or 3)
+    JOB_RETRY_DELAY = 30 # Seconds before the first retry of a failed job, doubled for each further attempt
+
+    # Timeline / photo API settings
+    TIMELINE_PAGE_SIZE = int(os.environ.get('TIMELINE_PAGE_SIZE') or 100) # Photos per page
+    TIMELINE_MAX_PAGE_SIZE = 500 # Upper bound for the `limit` query parameter
+    DUPLICATE_CLUSTERS_TTL = int(os.environ.get('DUPLICATE_CLUSTERS_TTL') or 300) # Seconds /api/duplicates reuses its clusters
+
+    # HTTP delivery of photos and thumbnails
+    THUMBNAIL_CACHE_MAX_AGE = 31536000 # Thumbnails are content-addressed, so cache them for a year
+    IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE') or 3600) # Originals can change on disk
+    # Let the front proxy send files: None, 'x-sendfile' (Apache/lighttpd) or 'x-accel' (nginx)
+    SENDFILE_MODE = os.environ.get('SENDFILE_MODE') or None
+    USE_X_SENDFILE = SENDFILE_MODE == 'x-sendfile' # Flask's built-in X-Sendfile support
+    # nginx `internal` locations aliased to PHOTO_LIBRARY_PATH and THUMBNAIL_DIR (x-accel mode only)
+    X_ACCEL_LIBRARY_PREFIX = os.environ.get('X_ACCEL_LIBRARY_PREFIX') or '/protected/library/'
+    X_ACCEL_THUMBNAIL_PREFIX = os.environ.get('X_ACCEL_THUMBNAIL_PREFIX') or '/protected/thumbnails/'
+
+    # ZIP export (/export and flask export)
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE') or 1048576) # Bytes read and sent at a time
+    EXPORT_READ_AHEAD = int(os.environ.get('EXPORT_READ_AHEAD') or 33554432) # Bytes of upcoming files read while sending
+
+    # Prometheus metrics at /metrics; if a token is set, scrapers must send "Authorization: Bearer <token>"
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
     # Add other configuration variables as needed
     # e.g., settings for extensions, API keys, etc.
 
@@ -0,0 +1,67 @@
+"""
+Database engine setup: SQLite tuning and a separate engine for scan writes.
+
+With SQLite's default rollback journal, a scan committing batches locks the
+whole file, so web requests (the timeline, get_image, Flask-Login's
+load_user) fail with "database is locked" or stall. In WAL mode readers
+never wait for the writer and the writer never waits for readers; only
+writers queue up behind each other, for at most SQLITE_BUSY_TIMEOUT.
+
+The scan writer also gets its own engine (writer_engine), so a long scan
+never holds connections from the pool that serves web requests.
+"""
+import os
+from flask import current_app
+from sqlalchemy import create_engine, event
+from app import db
+
+
+def sqlite_pragmas(config):
+    """Returns the PRAGMAs set on every new SQLite connection, from the SQLITE_* settings."""
+    return {
+        'journal_mode': config.get('SQLITE_JOURNAL_MODE') or 'WAL',
+        'synchronous': config.get('SQLITE_SYNCHRONOUS') or 'NORMAL',
+        'busy_timeout': int(config.get('SQLITE_BUSY_TIMEOUT') or 30000),
+        'cache_size': -int(config.get('SQLITE_CACHE_SIZE') or 65536), # Negative: KiB rather than pages
+        'mmap_size': int(config.get('SQLITE_MMAP_SIZE') or 0),
+    }
+
+
+def apply_pragmas(engine, pragmas):
+    """Sets `pragmas` on each new connection of an SQLite engine; engines of other databases are left alone."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return engine
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+    event.listen(engine, 'connect', set_pragmas)
+    return engine
+
+
+def writer_engine():
+    """
+    Returns this process's engine for scan writes (PhotoBatchWriter).
+
+    It has a single pooled connection: SQLite allows one writer at a time
+    anyway, and the web readers keep the whole default pool to themselves.
+    """
+    app = current_app._get_current_object()
+    pid, engine = app.extensions.get('ohmyphoto_writer_engine', (None, None))
+    if engine is None or pid != os.getpid(): # Forked job workers must not share the parent's connection
+        engine = create_engine(db.engine.url, pool_size=1, max_overflow=0)
+        apply_pragmas(engine, sqlite_pragmas(app.config))
+        app.extensions['ohmyphoto_writer_engine'] = (os.getpid(), engine)
+    return engine
+
+
+def init_app(app):
+    """Applies the SQLite PRAGMAs to the Flask-SQLAlchemy engines."""
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_pragmas(engine, sqlite_pragmas(app.config))
@@ -0,0 +1,207 @@
+import time
+import logging
+import threading
+from itertools import combinations
+from sqlalchemy import func, or_, select
+from app.models import Photo
+
+log = logging.getLogger(__name__)
+
+HASH_BITS = 64
+BANDS = 4 # 16-bit bands; by pigeonhole, hashes within distance BANDS - 1 share a band
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+HASH_MASK = (1 << HASH_BITS) - 1
+MAX_BUCKET_SIZE = 500 # Band values shared by more photos (e.g. blank images) are compared with a BK-tree
+# Within distance k, some band differs in at most k // BANDS bits, so a query looks up every band value within
+# that radius; up to radius 2 that is 137 indexed values per band (distances below BANDS * 3)
+MAX_BAND_RADIUS = 2
+
+BAND_COLUMNS = tuple(getattr(Photo, f'dhash_band{i}') for i in range(BANDS))
+
+
+def dhash_bands(dhash):
+    """Returns the dhash_band0..3 column values for a (signed) dHash; all None if there is no hash."""
+    if dhash is None:
+        return {f'dhash_band{i}': None for i in range(BANDS)}
+    unsigned = dhash & HASH_MASK
+    return {f'dhash_band{i}': (unsigned >> (i * BAND_BITS)) & BAND_MASK for i in range(BANDS)}
+
+
+def band_neighbours(value, radius):
+    """All band values that differ from `value` in at most `radius` bits."""
+    return [value ^ sum(1 << bit for bit in bits)
+            for r in range(radius + 1) for bits in combinations(range(BAND_BITS), r)]
+
+
+def hamming(a, b):
+    """Number of differing bits between two (signed or unsigned) 64-bit hashes."""
+    return bin((a ^ b) & HASH_MASK).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance.
+
+    A range query only descends into children whose edge distance lies within
+    [d - k, d + k] of the query's distance to the node (triangle inequality),
+    so "all hashes within k" visits a small part of the tree for small k.
+    """
+
+    def __init__(self):
+        self.root = None # [hash, items, {distance: child}]
+
+    def add(self, dhash, item):
+        if self.root is None:
+            self.root = [dhash, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(dhash, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [dhash, [item], {}]
+                return
+            node = child
+
+    def search(self, dhash, max_distance):
+        """Returns [(distance, item)] for every item whose hash is within max_distance."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(dhash, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return found
+
+
+def find_similar(conn, dhash, max_distance, exclude_id=None, limit=100):
+    """
+    Returns [(distance, photo_id)] of photos whose dHash is within max_distance, nearest first.
+
+    Candidates come from indexed lookups on the band columns (multi-index
+    hashing): by pigeonhole, a hash within max_distance matches one of the
+    query's bands to within max_distance // BANDS bits, so each band column
+    is searched for those neighbouring values. Beyond MAX_BAND_RADIUS (where
+    most of a library matches anyway) every hash is compared.
+    """
+    query = select(Photo.id, Photo.dhash).where(Photo.dhash.isnot(None))
+    radius = max_distance // BANDS
+    if radius <= MAX_BAND_RADIUS:
+        bands = dhash_bands(dhash)
+        query = query.where(or_(*(column.in_(band_neighbours(bands[f'dhash_band{i}'], radius))
+                                  for i, column in enumerate(BAND_COLUMNS))))
+    matches = [
+        (distance, photo_id)
+        for photo_id, other in conn.execute(query)
+        if photo_id != exclude_id and (distance := hamming(dhash, other)) <= max_distance
+    ]
+    return sorted(matches)[:limit]
+
+
+class _DisjointSet:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        root = self.parent.setdefault(x, x)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while x != root: # Path compression
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+
+def find_duplicate_clusters(conn, max_distance=3, batch_size=10000):
+    """
+    Groups photos whose dHashes are within max_distance of each other (transitively).
+
+    Returns a list of photo id lists, largest cluster first. For distances
+    below BANDS, photos are bucketed by each 16-bit band and only photos that
+    share a bucket are compared, which avoids the n^2 pairwise comparison;
+    oversized buckets and larger distances fall back to BK-tree queries.
+    """
+    hashes = {}
+    last_id = 0
+    while True: # Stream (id, dhash) in id order instead of loading ORM rows
+        rows = conn.execute(
+            select(Photo.id, Photo.dhash).where(Photo.dhash.isnot(None), Photo.id > last_id)
+            .order_by(Photo.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        hashes.update(rows)
+        last_id = rows[-1][0]
+    log.info(f"Looking for near-duplicates among {len(hashes)} photos (distance <= {max_distance})")
+
+    clusters = _DisjointSet()
+
+    def compare_with_tree(photo_ids):
+        tree = BKTree()
+        for photo_id in photo_ids:
+            for _, other_id in tree.search(hashes[photo_id], max_distance):
+                clusters.union(photo_id, other_id)
+            tree.add(hashes[photo_id], photo_id)
+
+    if max_distance >= BANDS:
+        compare_with_tree(list(hashes))
+    else:
+        for band in range(BANDS):
+            buckets = {}
+            for photo_id, dhash in hashes.items():
+                buckets.setdefault(((dhash & HASH_MASK) >> (band * BAND_BITS)) & BAND_MASK, []).append(photo_id)
+            for bucket in buckets.values():
+                if len(bucket) < 2:
+                    continue
+                if len(bucket) > MAX_BUCKET_SIZE:
+                    compare_with_tree(bucket)
+                    continue
+                for i, photo_id in enumerate(bucket):
+                    for other_id in bucket[i + 1:]:
+                        if hamming(hashes[photo_id], hashes[other_id]) <= max_distance:
+                            clusters.union(photo_id, other_id)
+
+    groups = {}
+    for photo_id in clusters.parent:
+        groups.setdefault(clusters.find(photo_id), []).append(photo_id)
+    return sorted((sorted(ids) for ids in groups.values() if len(ids) > 1), key=lambda ids: (-len(ids), ids[0]))
+
+
+_clusters_cache = {} # (database URL, max_distance) -> (signature, expiry, clusters)
+_clusters_lock = threading.Lock()
+
+
+def _hashes_signature(conn):
+    """Changes when photos are added, removed or re-hashed; read from the band index alone."""
+    return tuple(conn.execute(
+        select(func.count(Photo.dhash_band0), func.sum(Photo.dhash_band0), func.max(Photo.id))
+    ).one())
+
+
+def cached_duplicate_clusters(conn, max_distance=3, ttl=300):
+    """
+    find_duplicate_clusters, cached per process so paging through clusters doesn't recompute them.
+
+    A cached result is reused for up to `ttl` seconds while the hashes are
+    unchanged (see _hashes_signature).
+    """
+    key = (str(conn.engine.url), max_distance)
+    signature = _hashes_signature(conn)
+    with _clusters_lock:
+        cached = _clusters_cache.get(key)
+    if cached is not None and cached[0] == signature and cached[1] > time.monotonic():
+        return cached[2]
+    clusters = find_duplicate_clusters(conn, max_distance)
+    with _clusters_lock:
+        _clusters_cache[key] = (signature, time.monotonic() + ttl, clusters)
+    return clusters
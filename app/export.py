@@ -0,0 +1,181 @@
+"""
+Streaming ZIP export of original photos.
+
+The archive is built while it is sent: zipfile writes into a sink that the
+generator drains after every chunk, so nothing is staged on disk and memory
+stays at the read-ahead buffer however large the export. Entries are stored
+uncompressed (JPEG, HEIC and most RAW files don't compress), with their CRC
+and sizes in data descriptors, and ZIP64 records for files and archives
+over 4 GiB.
+
+A reader thread reads the next files into a bounded queue of chunks
+(EXPORT_READ_AHEAD bytes) while earlier chunks are written out, so the disk
+keeps reading while the client or the output file catches up.
+"""
+import os
+import time
+import queue
+import logging
+import zipfile
+import threading
+from sqlalchemy import select, tuple_
+from app import db
+from app.models import Photo
+
+log = logging.getLogger(__name__)
+
+# ZIP stores local times from 1980 to 2107
+ZIP_MIN_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_MAX_DATE_TIME = (2107, 12, 31, 23, 59, 58)
+
+
+def parse_photo_ids(values):
+    """Parses `ids` values (each an id or a comma separated list) into photo ids; None if there are none."""
+    ids = [int(i) for value in values for i in str(value).split(',') if i.strip()]
+    return ids or None
+
+
+def export_paths(clauses=(), photo_ids=None, batch_size=1000):
+    """
+    Iterates over the library-relative paths of the photos matching the filter clauses (and ids), oldest first.
+
+    Paths are read in keyset batches on (timestamp, id), each over its own
+    short-lived connection, so memory doesn't grow with the size of the
+    export and the iterator can be consumed without an app context (by
+    zip_stream's reader thread). Photos without a timestamp come first.
+    """
+    engine = db.engine # Resolved while there is an app context
+    query = select(Photo.relative_path, Photo.timestamp, Photo.id).where(*clauses)
+    if photo_ids is not None:
+        query = query.where(Photo.id.in_(photo_ids))
+
+    def batches(query, after, order_by):
+        last = None
+        while True:
+            batch = query if last is None else query.where(after(last))
+            with engine.connect() as conn:
+                rows = conn.execute(batch.order_by(*order_by).limit(batch_size)).all()
+            for row in rows:
+                yield row.relative_path
+            if len(rows) < batch_size:
+                return
+            last = rows[-1]
+
+    def paths():
+        yield from batches(query.where(Photo.timestamp.is_(None)), lambda row: Photo.id > row.id, (Photo.id,))
+        yield from batches(query.where(Photo.timestamp.isnot(None)),
+                           lambda row: tuple_(Photo.timestamp, Photo.id) > (row.timestamp, row.id),
+                           (Photo.timestamp, Photo.id))
+    return paths()
+
+
+def _zip_info(arcname, st):
+    """A stored ZipInfo with the file's mtime, permissions and expected size."""
+    date_time = min(max(time.localtime(st.st_mtime)[:6], ZIP_MIN_DATE_TIME), ZIP_MAX_DATE_TIME)
+    info = zipfile.ZipInfo(arcname, date_time)
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = (st.st_mode & 0xFFFF) << 16
+    info.file_size = st.st_size # Lets zipfile pick ZIP64 for this entry before writing its header
+    return info
+
+
+class _Sink:
+    """Unseekable output for zipfile: keeps what it writes until the generator takes it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _read_files(library_path, relative_paths, chunks, stop, chunk_size):
+    """
+    Reader thread: queues a ZipInfo before each file's chunks and None after the last file.
+
+    Files that can't be opened are skipped; a read error (or a failure of
+    the `relative_paths` iterator, e.g. its database query) is queued for the
+    writer to raise. Gives up once `stop` is set (the download was aborted).
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.5) # Blocks while the read-ahead buffer is full
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for relative_path in relative_paths:
+            try:
+                f = open(os.path.join(library_path, relative_path), 'rb')
+            except OSError as e:
+                log.warning(f"Skipping {relative_path} in export: {e}")
+                continue
+            with f:
+                st = os.fstat(f.fileno())
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL) # Larger kernel read-ahead
+                if not put(_zip_info(relative_path, st)):
+                    return
+                while chunk := f.read(chunk_size):
+                    if not put(chunk):
+                        return
+    except Exception as e:
+        put(e)
+        return
+    put(None)
+
+
+def zip_stream(library_path, relative_paths, chunk_size=1048576, read_ahead=33554432):
+    """
+    Yields a stored ZIP archive of the given library files, in order, as chunks of bytes.
+
+    Memory use is bounded by `read_ahead` plus one chunk. Closing the
+    generator early (client disconnect) stops the reader thread.
+    """
+    chunks = queue.Queue(maxsize=max(1, read_ahead // chunk_size))
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_files, args=(library_path, relative_paths, chunks, stop, chunk_size),
+                              name='export-reader', daemon=True)
+    reader.start()
+    sink = _Sink()
+    archive = entry = None
+    complete = False
+    try:
+        archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        while (item := chunks.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+            if isinstance(item, zipfile.ZipInfo):
+                if entry is not None:
+                    entry.close() # Writes the previous file's data descriptor
+                entry = archive.open(item, 'w')
+            else:
+                entry.write(item)
+            data = sink.take()
+            if data:
+                yield data
+        if entry is not None:
+            entry.close()
+        archive.close() # Central directory (and ZIP64 end records if needed)
+        complete = True
+        yield sink.take()
+    finally:
+        stop.set()
+        if archive is not None and not complete:
+            # Released here rather than by ZipFile.__del__, which fails with an entry open. The
+            # central directory only reaches the sink, so the client keeps a truncated archive
+            if entry is not None:
+                entry.close()
+            archive.close()
@@ -0,0 +1,167 @@
+import re
+import logging
+from sqlalchemy import column, func, literal, literal_column, select, table, text
+from app.models import Photo
+
+log = logging.getLogger(__name__)
+
+photo_table = Photo.__table__
+
+# SQLite: FTS5 table keyed by rowid = photo.id (created by migration 1ac82ee75334)
+photo_fts = table('photo_fts', column('rowid'), column('filename'), column('path'), column('camera'), column('notes'))
+FTS_WEIGHTS = (10.0, 4.0, 2.0, 1.0) # bm25 weights for filename, path, camera, notes
+
+# PostgreSQL: tsvector per photo with a GIN index, weighted A (filename) to D (notes)
+photo_search = table('photo_search', column('photo_id'), column('document'))
+
+# Free-text EXIF tags indexed as notes. The description/OCR columns go here once they exist.
+NOTE_TAGS = (
+    'Image ImageDescription', 'Image Artist', 'Image Copyright', 'Image XPTitle',
+    'Image XPComment', 'Image XPKeywords', 'Image XPSubject', 'EXIF UserComment',
+)
+MAX_QUERY_TERMS = 8
+TERM_RE = re.compile(r'\w+')
+
+
+def _join_text(*parts):
+    """Concatenates nullable text expressions with spaces."""
+    expr = func.coalesce(parts[0], '')
+    for part in parts[1:]:
+        expr = expr + ' ' + func.coalesce(part, '')
+    return expr
+
+
+def _camera_text():
+    return _join_text(photo_table.c.camera_make, photo_table.c.camera_model, photo_table.c.lens_model)
+
+
+def _notes_text():
+    return _join_text(*(photo_table.c.exif_data[tag].as_string() for tag in NOTE_TAGS))
+
+
+def _sqlite_documents(clause):
+    # rtrim(path, <path without slashes>) strips the filename and leaves the directory part;
+    # the unicode61 tokenizer splits it into folder names
+    directory = func.rtrim(photo_table.c.relative_path, func.replace(photo_table.c.relative_path, '/', ''))
+    return photo_fts.insert().from_select(
+        ['rowid', 'filename', 'path', 'camera', 'notes'],
+        select(photo_table.c.id, photo_table.c.filename, directory, _camera_text(), _notes_text()).where(clause),
+    )
+
+
+def _tsvector(expr, weight):
+    # The default parser keeps "a/b/IMG_1.jpg" as one file-path token; split it into words first
+    words = func.translate(expr, '/._-', '    ')
+    return func.setweight(func.to_tsvector(literal_column("'simple'"), words), weight)
+
+
+def _postgresql_documents(clause):
+    document = _tsvector(photo_table.c.filename, 'A') \
+        .op('||')(_tsvector(photo_table.c.relative_path, 'B')) \
+        .op('||')(_tsvector(_camera_text(), 'C')) \
+        .op('||')(_tsvector(_notes_text(), 'D'))
+    return photo_search.insert().from_select(
+        ['photo_id', 'document'], select(photo_table.c.id, document).where(clause),
+    )
+
+
+def unindex_photos(conn, clause):
+    """Removes the search documents of the photos matching `clause`; call before deleting or rewriting them."""
+    ids = select(photo_table.c.id).where(clause)
+    if conn.dialect.name == 'sqlite':
+        conn.execute(photo_fts.delete().where(photo_fts.c.rowid.in_(ids)))
+    elif conn.dialect.name == 'postgresql':
+        conn.execute(photo_search.delete().where(photo_search.c.photo_id.in_(ids)))
+
+
+def index_photos(conn, clause):
+    """
+    (Re)builds the search documents of the photos matching `clause` inside the caller's transaction.
+
+    Documents are computed in SQL with INSERT ... SELECT, so a batch of rows
+    costs two statements. Other dialects have no full-text index.
+    """
+    if conn.dialect.name == 'sqlite':
+        unindex_photos(conn, clause)
+        conn.execute(_sqlite_documents(clause))
+    elif conn.dialect.name == 'postgresql':
+        unindex_photos(conn, clause)
+        conn.execute(_postgresql_documents(clause))
+
+
+def rebuild_index(conn, batch_size=10000):
+    """Rebuilds the whole search index in id ranges; returns the number of photos indexed."""
+    if conn.dialect.name == 'sqlite':
+        conn.execute(photo_fts.delete())
+    elif conn.dialect.name == 'postgresql':
+        conn.execute(text('TRUNCATE photo_search'))
+    else:
+        return 0
+    indexed = 0
+    last_id = 0
+    while True:
+        ids = conn.execute(
+            select(photo_table.c.id).where(photo_table.c.id > last_id).order_by(photo_table.c.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return indexed
+        clause = photo_table.c.id.between(ids[0], ids[-1])
+        conn.execute(_sqlite_documents(clause) if conn.dialect.name == 'sqlite' else _postgresql_documents(clause))
+        indexed += len(ids)
+        last_id = ids[-1]
+
+
+def query_terms(query):
+    """Splits a user query into at most MAX_QUERY_TERMS lower-case word terms."""
+    return TERM_RE.findall(query.lower())[:MAX_QUERY_TERMS]
+
+
+def _match_query(dialect_name, terms):
+    """Builds a prefix query that requires every term: FTS5 '"a"* "b"*' or tsquery 'a:* & b:*'."""
+    if dialect_name == 'sqlite':
+        return ' '.join(f'"{t}"*' for t in terms)
+    return ' & '.join(f'{t}:*' for t in terms)
+
+
+def match_clause(dialect_name, query):
+    """
+    Returns a Photo.id filter clause for photos matching every term of `query` as a prefix.
+
+    Raises ValueError if the query has no searchable terms or the database has no full-text index.
+    """
+    terms = query_terms(query)
+    if not terms:
+        raise ValueError("query has no searchable words")
+    match = _match_query(dialect_name, terms)
+    if dialect_name == 'sqlite':
+        return Photo.id.in_(select(photo_fts.c.rowid).where(literal_column('photo_fts').op('MATCH')(match)))
+    if dialect_name == 'postgresql':
+        return Photo.id.in_(select(photo_search.c.photo_id).where(
+            photo_search.c.document.op('@@')(func.to_tsquery(literal_column("'simple'"), match))))
+    raise ValueError(f"full-text search is not supported on {dialect_name}")
+
+
+def ranked_matches(conn, query, limit, offset=0):
+    """
+    Returns [(photo_id, rank)] for `query`, best matches first.
+
+    Every term is matched as a prefix ("bea" finds "beach"). FTS5 ranks with
+    bm25 (filename matches weigh most), PostgreSQL with ts_rank_cd over the
+    A-D weights. Raises ValueError as match_clause does.
+    """
+    terms = query_terms(query)
+    if not terms:
+        raise ValueError("query has no searchable words")
+    match = _match_query(conn.dialect.name, terms)
+    if conn.dialect.name == 'sqlite':
+        rank = func.bm25(literal_column('photo_fts'), *(literal(w) for w in FTS_WEIGHTS))
+        stmt = select(photo_fts.c.rowid, rank.label('rank')) \
+            .where(literal_column('photo_fts').op('MATCH')(match)).order_by(rank)
+    elif conn.dialect.name == 'postgresql':
+        tsquery = func.to_tsquery(literal_column("'simple'"), match)
+        rank = func.ts_rank_cd(photo_search.c.document, tsquery)
+        stmt = select(photo_search.c.photo_id, rank.label('rank')) \
+            .where(photo_search.c.document.op('@@')(tsquery)).order_by(rank.desc())
+    else:
+        raise ValueError(f"full-text search is not supported on {conn.dialect.name}")
+    return [tuple(row) for row in conn.execute(stmt.limit(limit).offset(offset))]
@@ -0,0 +1,522 @@
+"""
+Header-only metadata reader for JPEG, PNG, TIFF (including TIFF-based RAW), RAF and HEIF.
+
+Reads dimensions and EXIF straight from the bytes of the file header (JPEG
+APP1/SOF segments, PNG IHDR/eXIf chunks, TIFF IFDs, HEIF item boxes) with
+struct, without decoding pixels or re-reading the file through a file
+handle. On an mmap only the header pages are touched, so a large photo
+costs a few KB of I/O. raw_previews() finds the JPEG previews that cameras
+embed in RAW files, so they can be thumbnailed without demosaicing.
+
+Tags are named and formatted with exifread's tag tables, so the result is a
+drop-in replacement for exifread.process_file(details=False) as far as the
+scanner is concerned (see photolib.normalize_exif). The one addition is
+EXIF UserComment, which exifread skips but which is decoded here as text
+for the full-text notes.
+"""
+import struct
+from exifread.tags import IGNORE_TAGS
+from exifread.tags.exif import EXIF_TAGS
+from exifread.tags.fields import FieldType, FIELD_DEFINITIONS, SIGNED_FIELD_TYPES, RATIO_FIELD_TYPES
+from exifread.utils import Ratio
+
+JPEG_SOI = b'\xff\xd8'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TIFF_SIGNATURES = (b'II*\x00', b'MM\x00*')
+# Start-of-frame markers carrying the frame size (not DHT 0xC4, JPG 0xC8 or DAC 0xCC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)} # TEM and RST0-7 have no length
+JPEG_SOS, JPEG_EOI = 0xDA, 0xD9
+# Frames Pillow and libvips decode: 8-bit Huffman baseline, extended and progressive (DNG raw data is lossless 0xC3)
+JPEG_PREVIEW_SOF_MARKERS = {0xC0, 0xC1, 0xC2}
+MAX_TAG_VALUES = 1000 # Like exifread, larger non-text arrays are left empty
+RAF_SIGNATURE = b'FUJIFILMCCD-RAW '
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1'} # ftyp major brands
+
+# TIFF tags read by number (see _tiff_ifds)
+TAG_NEW_SUBFILE_TYPE = 0x00FE # Bit 0 set: reduced-resolution copy (thumbnail or preview)
+TAG_IMAGE_WIDTH, TAG_IMAGE_LENGTH, TAG_COMPRESSION = 0x0100, 0x0101, 0x0103
+TAG_STRIP_OFFSETS, TAG_STRIP_BYTE_COUNTS = 0x0111, 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET, TAG_JPEG_LENGTH = 0x0201, 0x0202 # JPEGInterchangeFormat(Length)
+TAG_ORIENTATION = 0x0112
+TAG_DNG_VERSION = 0xC612
+TAG_USER_COMMENT = 0x9286
+MAX_USER_COMMENT_LENGTH = 65536
+# UserComment starts with an 8-byte character code; undefined (zeros) is read like ASCII
+USER_COMMENT_ENCODINGS = {b'ASCII\x00\x00\x00': 'utf-8', b'\x00' * 8: 'utf-8', b'JIS\x00\x00\x00\x00\x00': 'shift_jis'}
+_IFD_NUMBER_TAGS = {
+    TAG_NEW_SUBFILE_TYPE, TAG_IMAGE_WIDTH, TAG_IMAGE_LENGTH, TAG_COMPRESSION, TAG_STRIP_OFFSETS,
+    TAG_STRIP_BYTE_COUNTS, TAG_SUB_IFDS, TAG_JPEG_OFFSET, TAG_JPEG_LENGTH, TAG_ORIENTATION, TAG_DNG_VERSION,
+}
+_NUMBER_FORMATS = {1: 'B', 3: 'H', 4: 'I', 13: 'I'} # BYTE, SHORT, LONG, IFD
+MAX_IFDS = 32
+
+_INT_FORMATS = {(1, False): 'B', (1, True): 'b', (2, False): 'H', (2, True): 'h', (4, False): 'I', (4, True): 'i'}
+
+
+class ExifTag:
+    """A parsed EXIF field; like exifread's IfdTag it has `values` and `printable`, and str() is the printable."""
+    __slots__ = ('tag', 'values', 'printable')
+
+    def __init__(self, tag, values, printable):
+        self.tag = tag
+        self.values = values
+        self.printable = printable
+
+    def __str__(self):
+        return self.printable
+
+    def __repr__(self):
+        return f'<ExifTag 0x{self.tag:04X}={self.printable}>'
+
+
+def _read_values(data, endian, field_type, count, offset):
+    if field_type == FieldType.ASCII:
+        raw = bytes(data[offset:offset + count]).split(b'\x00', 1)[0]
+        try:
+            return raw.decode('utf-8')
+        except UnicodeDecodeError:
+            return raw
+    if count >= MAX_TAG_VALUES:
+        return []
+    if field_type in RATIO_FIELD_TYPES:
+        fmt = 'i' if field_type in SIGNED_FIELD_TYPES else 'I'
+        pairs = struct.unpack_from(f'{endian}{2 * count}{fmt}', data, offset)
+        return [Ratio(pairs[i], pairs[i + 1]) for i in range(0, len(pairs), 2)]
+    if field_type == FieldType.FLOAT_32:
+        return list(struct.unpack_from(f'{endian}{count}f', data, offset))
+    if field_type == FieldType.FLOAT_64:
+        return list(struct.unpack_from(f'{endian}{count}d', data, offset))
+    size = FIELD_DEFINITIONS[field_type][0]
+    fmt = _INT_FORMATS[(size, field_type in SIGNED_FIELD_TYPES)]
+    return list(struct.unpack_from(f'{endian}{count}{fmt}', data, offset))
+
+
+def _user_comment(raw, endian):
+    """Decodes an EXIF UserComment (character code header plus text) to a string."""
+    code, text = raw[:8], raw[8:]
+    if code == b'UNICODE\x00':
+        if text[:2] in (b'\xff\xfe', b'\xfe\xff'):
+            encoding = 'utf-16' # Byte order mark
+        else:
+            encoding = 'utf-16-le' if endian == '<' else 'utf-16-be' # UCS-2 in the file's byte order
+    else:
+        encoding = USER_COMMENT_ENCODINGS.get(code)
+        if encoding is None:
+            return '' # Unknown code
+    return text.decode(encoding, errors='replace').strip('\x00 \t\r\n')
+
+
+def _printable(values, field_type, count, tag_entry):
+    """Formats values the way exifread does (truncated arrays, enum lookups, formatter functions)."""
+    if count == 1 and field_type != FieldType.ASCII and values:
+        printable = str(values[0])
+    elif count > 50 and len(values) > 20 and not isinstance(values, (str, bytes)):
+        printable = str(values[0:20])[0:-1] + ', ... ]'
+    else:
+        printable = str(values)
+    mapping = tag_entry[1] if tag_entry else None
+    if callable(mapping):
+        try:
+            printable = mapping(values)
+        except Exception:
+            pass # Keep the raw rendering of malformed values
+    elif isinstance(mapping, dict):
+        printable = ''.join(mapping.get(v, repr(v)) for v in values)
+    return printable
+
+
+def _read_ifd(data, tiff_start, tiff_end, endian, ifd_offset, ifd_name, tag_dict, tags, depth=0):
+    """Reads one IFD into `tags` ("<ifd name> <tag name>" -> ExifTag), following EXIF/GPS/Interop pointers."""
+    start = tiff_start + ifd_offset
+    if depth > 4 or ifd_offset < 8 or start + 2 > tiff_end:
+        return
+    (entries,) = struct.unpack_from(f'{endian}H', data, start)
+    for i in range(min(entries, (tiff_end - start - 2) // 12)):
+        entry = start + 2 + 12 * i
+        tag, type_id, count = struct.unpack_from(f'{endian}HHI', data, entry)
+        if (tag in IGNORE_TAGS and tag != TAG_USER_COMMENT) or not 1 <= type_id <= 13:
+            continue # MakerNote, XMP blobs (skipped like exifread's details=False); bad types
+        field_type = FieldType(type_id)
+        length = count * FIELD_DEFINITIONS[field_type][0]
+        if length <= 4:
+            value_offset = entry + 8
+        else:
+            value_offset = tiff_start + struct.unpack_from(f'{endian}I', data, entry + 8)[0]
+            if value_offset + length > tiff_end:
+                continue # Points outside the EXIF block (truncated or corrupt file)
+        if tag == TAG_USER_COMMENT:
+            if length <= MAX_USER_COMMENT_LENGTH:
+                comment = _user_comment(bytes(data[value_offset:value_offset + length]), endian)
+                if comment:
+                    tags[f'{ifd_name} UserComment'] = ExifTag(tag, comment, comment)
+            continue
+        tag_entry = tag_dict.get(tag)
+        name = tag_entry[0] if tag_entry else f'Tag 0x{tag:04X}'
+        values = _read_values(data, endian, field_type, count, value_offset)
+        if tag_entry and isinstance(tag_entry[1], tuple): # Sub-IFD, e.g. GPSInfo -> "GPS ..." tags
+            tags[f'{ifd_name} {name}'] = ExifTag(tag, values, str(values[0] if count == 1 and values else values))
+            if values:
+                sub_name, sub_dict = tag_entry[1]
+                _read_ifd(data, tiff_start, tiff_end, endian, values[0], sub_name, sub_dict, tags, depth + 1)
+            continue
+        tags[f'{ifd_name} {name}'] = ExifTag(tag, values, _printable(values, field_type, count, tag_entry))
+
+
+def read_tiff_tags(data, start=0, end=None):
+    """
+    Parses the TIFF structure at data[start:end] (a TIFF file or an EXIF block).
+
+    Returns exifread-style tags for IFD0 ("Image ..."), the EXIF sub-IFD
+    ("EXIF ...") and GPS ("GPS ..."); the thumbnail IFD is not read.
+    """
+    end = len(data) if end is None else end
+    order = bytes(data[start:start + 2])
+    if order not in (b'II', b'MM') or end - start < 8:
+        return {}
+    endian = '<' if order == b'II' else '>'
+    magic, ifd0 = struct.unpack_from(f'{endian}HI', data, start + 2)
+    if magic != 42:
+        return {}
+    tags = {}
+    _read_ifd(data, start, end, endian, ifd0, 'Image', EXIF_TAGS, tags)
+    exif_pointer = tags.get('Image ExifOffset')
+    if exif_pointer is not None and exif_pointer.values:
+        _read_ifd(data, start, end, endian, exif_pointer.values[0], 'EXIF', EXIF_TAGS, tags, 1)
+    return tags
+
+
+def _read_jpeg(data, start=0, end=None):
+    """Returns (width, height, tags, (SOF marker, sample precision)) of the JPEG at data[start:end]."""
+    width = height = frame = None
+    tags = {}
+    pos = start + 2
+    size = len(data) if end is None else end
+    while pos + 4 <= size:
+        if data[pos] != 0xFF:
+            break # Lost sync: corrupt header
+        marker = data[pos + 1]
+        if marker == 0xFF: # Fill byte
+            pos += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            pos += 2
+            continue
+        if marker in (JPEG_SOS, JPEG_EOI):
+            break # Entropy-coded data follows; everything we need comes before it
+        (length,) = struct.unpack_from('>H', data, pos + 2)
+        segment = pos + 4
+        if marker == 0xE1 and not tags and bytes(data[segment:segment + 6]) == b'Exif\x00\x00':
+            tags = read_tiff_tags(data, segment + 6, min(pos + 2 + length, size))
+        elif marker in JPEG_SOF_MARKERS and segment + 5 <= size:
+            precision, height, width = struct.unpack_from('>BHH', data, segment)
+            frame = (marker, precision)
+            break # EXIF (APP1) always precedes the frame header
+        pos += 2 + length
+    return width, height, tags, frame
+
+
+def _read_png(data):
+    width = height = None
+    tags = {}
+    pos = len(PNG_SIGNATURE)
+    size = len(data)
+    while pos + 8 <= size:
+        length, chunk_type = struct.unpack_from('>I4s', data, pos)
+        chunk = pos + 8
+        if chunk_type == b'IHDR' and chunk + 8 <= size:
+            width, height = struct.unpack_from('>II', data, chunk)
+        elif chunk_type == b'eXIf':
+            tags = read_tiff_tags(data, chunk, min(chunk + length, size))
+        elif chunk_type in (b'IDAT', b'IEND'):
+            break # eXIf must precede the image data
+        pos = chunk + length + 4 # Skip the data and CRC
+    return width, height, tags
+
+
+def _tiff_ifds(data):
+    """
+    Returns the integer tags in _IFD_NUMBER_TAGS of every image in a TIFF file, IFD0 first.
+
+    Follows the chain of IFDs after IFD0 and their SubIFDs, where RAW files
+    keep their previews and raw data.
+    """
+    endian = '<' if bytes(data[:2]) == b'II' else '>'
+    end = len(data)
+    pending = [struct.unpack_from(f'{endian}I', data, 4)[0]]
+    seen = set()
+    ifds = []
+    while pending and len(ifds) < MAX_IFDS:
+        offset = pending.pop(0)
+        if offset in seen or offset < 8 or offset + 2 > end:
+            continue
+        seen.add(offset)
+        (entries,) = struct.unpack_from(f'{endian}H', data, offset)
+        values = {}
+        for i in range(min(entries, (end - offset - 2) // 12)):
+            entry = offset + 2 + 12 * i
+            tag, type_id, count = struct.unpack_from(f'{endian}HHI', data, entry)
+            fmt = _NUMBER_FORMATS.get(type_id)
+            if tag not in _IFD_NUMBER_TAGS or fmt is None or count > MAX_TAG_VALUES:
+                continue
+            length = count * struct.calcsize(fmt)
+            value_offset = entry + 8 if length <= 4 else struct.unpack_from(f'{endian}I', data, entry + 8)[0]
+            if value_offset + length <= end:
+                values[tag] = struct.unpack_from(f'{endian}{count}{fmt}', data, value_offset)
+        ifds.append(values)
+        pending.extend(values.get(TAG_SUB_IFDS, ()))
+        next_pointer = offset + 2 + 12 * entries
+        if next_pointer + 4 <= end:
+            pending.append(struct.unpack_from(f'{endian}I', data, next_pointer)[0])
+    return ifds
+
+
+def _first(ifd, tag, default=None):
+    values = ifd.get(tag)
+    return values[0] if values else default
+
+
+def _is_raw(data, ifds):
+    """Tells TIFF-based RAW files (DNG, CR2, NEF, ARW, ...) from plain TIFFs."""
+    ifd0 = ifds[0] if ifds else {}
+    return (TAG_DNG_VERSION in ifd0 or bytes(data[8:10]) == b'CR' # Canon CR2 marker after the header
+            or (_first(ifd0, TAG_NEW_SUBFILE_TYPE, 0) & 1 and TAG_SUB_IFDS in ifd0)) # Thumbnail first, raw in a SubIFD
+
+
+def _read_tiff(data):
+    tags = read_tiff_tags(data)
+
+    def first(name):
+        tag = tags.get(name)
+        return tag.values[0] if tag is not None and tag.values else None
+    width, height = first('Image ImageWidth'), first('Image ImageLength')
+    ifds = _tiff_ifds(data)
+    if _is_raw(data, ifds):
+        # Sensor size, unrotated like a JPEG's. If IFD0 is only a thumbnail, the raw data is the largest full-resolution image
+        if _first(ifds[0], TAG_NEW_SUBFILE_TYPE, 0) & 1:
+            full = [(_first(ifd, TAG_IMAGE_WIDTH), _first(ifd, TAG_IMAGE_LENGTH)) for ifd in ifds[1:]
+                    if not _first(ifd, TAG_NEW_SUBFILE_TYPE, 0) & 1 and TAG_IMAGE_WIDTH in ifd and TAG_IMAGE_LENGTH in ifd]
+            if full:
+                width, height = max(full, key=lambda size: size[0] * size[1])
+    elif first('Image Orientation') in (5, 6, 7, 8):
+        width, height = height, width # Like Pillow (11+), which opens TIFFs already transposed
+    return width, height, tags
+
+
+def _raf_jpeg(data):
+    """Returns (offset, length) of the JPEG that Fujifilm RAF files start with."""
+    return struct.unpack_from('>II', data, 84)
+
+
+def raw_previews(data):
+    """
+    Returns the decodable JPEG previews embedded in a RAW file as (offset, length, width, height), smallest first.
+
+    Returns None if `data` is not a TIFF-based RAW (DNG, CR2, NEF, ARW, ...)
+    or RAF file. Previews are stored unrotated: apply raw_orientation().
+    """
+    head = bytes(data[:16])
+    if head == RAF_SIGNATURE:
+        candidates = [_raf_jpeg(data)]
+    elif head[:4] in TIFF_SIGNATURES:
+        ifds = _tiff_ifds(data)
+        if not _is_raw(data, ifds):
+            return None
+        candidates = []
+        for ifd in ifds:
+            if TAG_JPEG_OFFSET in ifd and TAG_JPEG_LENGTH in ifd:
+                candidates.append((_first(ifd, TAG_JPEG_OFFSET), _first(ifd, TAG_JPEG_LENGTH)))
+            if (_first(ifd, TAG_COMPRESSION) in (6, 7) and len(ifd.get(TAG_STRIP_OFFSETS, ())) == 1
+                    and TAG_STRIP_BYTE_COUNTS in ifd): # A JPEG stored as the image's only strip (CR2, DNG previews)
+                candidates.append((_first(ifd, TAG_STRIP_OFFSETS), _first(ifd, TAG_STRIP_BYTE_COUNTS)))
+    else:
+        return None
+    previews = set()
+    for offset, length in candidates:
+        end = offset + length
+        if length < 4 or end > len(data) or bytes(data[offset:offset + 2]) != JPEG_SOI:
+            continue
+        try:
+            width, height, _, frame = _read_jpeg(data, offset, end)
+        except (struct.error, ValueError):
+            continue
+        if width and height and frame is not None and frame[0] in JPEG_PREVIEW_SOF_MARKERS and frame[1] == 8:
+            previews.add((offset, length, width, height))
+    return sorted(previews, key=lambda preview: preview[2] * preview[3])
+
+
+def raw_orientation(data):
+    """The EXIF orientation of a RAW file (1 if unknown), which also applies to its previews."""
+    if bytes(data[:16]) == RAF_SIGNATURE:
+        offset, length = _raf_jpeg(data)
+        tag = _read_jpeg(data, offset, offset + length)[2].get('Image Orientation')
+        return tag.values[0] if tag is not None and tag.values else 1
+    ifds = _tiff_ifds(data)
+    return _first(ifds[0], TAG_ORIENTATION, 1) if ifds else 1
+
+
+def _boxes(data, start, end):
+    """Yields (type, payload start, end) of the ISO base media boxes in data[start:end]."""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1: # 64-bit size
+            (size,) = struct.unpack_from('>Q', data, pos + 8)
+            header = 16
+        elif size == 0: # Extends to the end
+            size = end - pos
+        if size < header or pos + size > end:
+            raise ValueError(f"Malformed {box_type!r} box")
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _uint(data, pos, size):
+    """Reads a big-endian unsigned integer of 0, 4 or 8 bytes (HEIF iloc fields)."""
+    if size == 0:
+        return 0
+    return struct.unpack_from('>I' if size == 4 else '>Q', data, pos)[0]
+
+
+def _read_heif(data):
+    """
+    Reads the primary image's size (ispe, turned by irot like decoders do) and its Exif item.
+
+    Only the meta box is parsed; the coded image data (mdat) is never touched.
+    """
+    end = len(data)
+    meta = next(((start, box_end) for box_type, start, box_end in _boxes(data, 0, end) if box_type == b'meta'), None)
+    if meta is None:
+        return None, None, {}
+    primary = None
+    item_types = {}
+    references = [] # (type, from item, to items)
+    locations = {} # item -> (construction method, base offset, [(offset, length)])
+    properties = []
+    associations = {}
+    idat = None
+    for box_type, start, box_end in _boxes(data, meta[0] + 4, meta[1]): # meta is a full box
+        version = data[start]
+        if box_type == b'pitm':
+            primary = struct.unpack_from('>H' if version == 0 else '>I', data, start + 4)[0]
+        elif box_type == b'iinf':
+            entries_start = start + 4 + (2 if version == 0 else 4)
+            for infe_type, infe, _ in _boxes(data, entries_start, box_end):
+                infe_version = data[infe]
+                if infe_type == b'infe' and infe_version >= 2:
+                    id_format = '>H' if infe_version == 2 else '>I'
+                    item_id = struct.unpack_from(id_format, data, infe + 4)[0]
+                    type_at = infe + 4 + struct.calcsize(id_format) + 2 # After item_protection_index
+                    item_types[item_id] = bytes(data[type_at:type_at + 4])
+        elif box_type == b'iref':
+            id_format = '>H' if version == 0 else '>I'
+            id_size = struct.calcsize(id_format)
+            for ref_type, ref, ref_end in _boxes(data, start + 4, box_end):
+                (from_id,) = struct.unpack_from(id_format, data, ref)
+                (count,) = struct.unpack_from('>H', data, ref + id_size)
+                to_ids = struct.unpack_from(f'>{count}{id_format[1]}', data, ref + id_size + 2)
+                references.append((ref_type, from_id, to_ids))
+        elif box_type == b'iprp':
+            for child_type, child, child_end in _boxes(data, start, box_end):
+                if child_type == b'ipco':
+                    properties = list(_boxes(data, child, child_end))
+                elif child_type == b'ipma':
+                    ipma_version, flags = data[child], data[child + 3]
+                    (count,) = struct.unpack_from('>I', data, child + 4)
+                    pos = child + 8
+                    for _ in range(count):
+                        id_format = '>H' if ipma_version < 1 else '>I'
+                        (item_id,) = struct.unpack_from(id_format, data, pos)
+                        pos += struct.calcsize(id_format)
+                        n = data[pos]
+                        pos += 1
+                        indexes = []
+                        for _ in range(n):
+                            if flags & 1:
+                                indexes.append(struct.unpack_from('>H', data, pos)[0] & 0x7FFF)
+                                pos += 2
+                            else:
+                                indexes.append(data[pos] & 0x7F)
+                                pos += 1
+                        associations[item_id] = indexes
+        elif box_type == b'iloc':
+            offset_size, length_size = data[start + 4] >> 4, data[start + 4] & 0xF
+            base_offset_size, index_size = data[start + 5] >> 4, data[start + 5] & 0xF
+            id_format = '>H' if version < 2 else '>I'
+            (count,) = struct.unpack_from(id_format, data, start + 6)
+            pos = start + 6 + struct.calcsize(id_format)
+            for _ in range(count):
+                (item_id,) = struct.unpack_from(id_format, data, pos)
+                pos += struct.calcsize(id_format)
+                method = 0
+                if version in (1, 2):
+                    method = struct.unpack_from('>H', data, pos)[0] & 0xF
+                    pos += 2
+                pos += 2 # data_reference_index
+                base = _uint(data, pos, base_offset_size)
+                pos += base_offset_size
+                (extent_count,) = struct.unpack_from('>H', data, pos)
+                pos += 2
+                extents = []
+                for _ in range(extent_count):
+                    if version in (1, 2):
+                        pos += index_size
+                    extents.append((_uint(data, pos, offset_size), _uint(data, pos + offset_size, length_size)))
+                    pos += offset_size + length_size
+                locations[item_id] = (method, base, extents)
+        elif box_type == b'idat':
+            idat = start
+
+    width = height = None
+    rotation = 0
+    for index in associations.get(primary, ()):
+        if not 1 <= index <= len(properties):
+            continue
+        prop_type, prop, _ = properties[index - 1]
+        if prop_type == b'ispe':
+            width, height = struct.unpack_from('>II', data, prop + 4)
+        elif prop_type == b'irot':
+            rotation = data[prop] & 3
+    if rotation in (1, 3):
+        width, height = height, width
+
+    tags = {}
+    exif_items = [item for item, item_type in item_types.items() if item_type == b'Exif']
+    described = {from_id for ref_type, from_id, to_ids in references if ref_type == b'cdsc' and primary in to_ids}
+    exif_items.sort(key=lambda item: item not in described) # The primary image's Exif first
+    if exif_items and exif_items[0] in locations:
+        method, base, extents = locations[exif_items[0]]
+        if len(extents) == 1 and method in (0, 1) and (method == 0 or idat is not None):
+            offset, length = extents[0]
+            item_start = base + offset + (idat if method == 1 else 0)
+            item_end = min(item_start + length if length else end, end)
+            (tiff_offset,) = struct.unpack_from('>I', data, item_start) # Skips any APP1-style "Exif\0\0" prefix
+            tags = read_tiff_tags(data, item_start + 4 + tiff_offset, item_end)
+    return width, height, tags
+
+
+def read_image_header(data):
+    """
+    Returns (format, width, height, tags) for a JPEG, PNG, TIFF, RAF or HEIF file, or None for other formats.
+
+    `data` is the file's bytes (bytes, memoryview or mmap). `tags` maps
+    exifread-style names ("EXIF DateTimeOriginal") to ExifTag. Width or
+    height is None if the header is truncated before the frame size.
+    TIFF-based RAW files report the size of the raw image, RAF files that
+    of their embedded JPEG. Malformed headers raise struct.error or ValueError.
+    """
+    head = bytes(data[:16])
+    if head.startswith(JPEG_SOI):
+        return ('jpeg',) + _read_jpeg(data)[:3]
+    if head[:8] == PNG_SIGNATURE:
+        return ('png',) + _read_png(data)
+    if head[:4] in TIFF_SIGNATURES:
+        return ('tiff',) + _read_tiff(data)
+    if head == RAF_SIGNATURE:
+        offset, length = _raf_jpeg(data)
+        return ('raf',) + _read_jpeg(data, offset, offset + length)[:3]
+    if head[4:8] == b'ftyp' and head[8:12] in HEIF_BRANDS:
+        return ('heif',) + _read_heif(data)
+    return None
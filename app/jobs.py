@@ -0,0 +1,363 @@
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import exists, select
+from sqlalchemy.orm import aliased
+from app import db
+from app.models import Job, Photo, PhotoContent
+from app.photolib import scan_photo_library, process_photo_file, generate_thumbnail, ScanStats
+from app.photodb import PhotoBatchWriter
+from app.database import writer_engine
+from app.thumbnails import thumbnail_settings, generate_rendition, THUMBNAIL_FORMATS
+from app.duplicates import dhash_bands
+
+log = logging.getLogger(__name__)
+
+JOB_KINDS = ('scan', 'thumbnail', 'metadata')
+# Priorities (higher runs first): thumbnails on the page a user is looking at jump ahead of
+# API/CLI requests, which run ahead of retries found by sweeps
+PRIORITY_VIEWING = 100
+PRIORITY_DEFAULT = 0
+PRIORITY_BACKGROUND = -100
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class JobError(Exception):
+    """A job that cannot succeed, e.g. bad payload; it fails without retries."""
+
+
+def thumbnail_job_key(photo_hash):
+    return f'thumbnail:{photo_hash}'
+
+
+def enqueue(kind, payload=None, priority=PRIORITY_DEFAULT, dedupe_key=None, max_attempts=None):
+    """
+    Queues a job and returns it.
+
+    If a job with the same `dedupe_key` is already queued or running, that
+    job is returned instead; a queued one is raised to `priority` if that is
+    higher, so a repeated request can make pending work jump the queue.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"unknown job kind: {kind}")
+    if dedupe_key:
+        job = Job.query.filter(Job.dedupe_key == dedupe_key, Job.status.in_(ACTIVE_STATUSES)) \
+            .order_by(Job.id).first()
+        if job is not None:
+            if job.status == 'queued' and job.priority < priority:
+                job.priority = priority
+                db.session.commit()
+            return job
+    job = Job(kind=kind, payload=payload or {}, priority=priority, dedupe_key=dedupe_key,
+              max_attempts=max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS') or 3)
+    db.session.add(job)
+    db.session.commit()
+    log.info(f"Queued {kind} job {job.id} (priority {priority})")
+    return job
+
+
+def prioritize_thumbnails(photo_hashes, priority=PRIORITY_VIEWING):
+    """
+    Moves queued thumbnail jobs for these photos (e.g. the page being viewed) to the front of the queue.
+
+    Called while serving pages, so it only writes when there is a job to
+    bump: an UPDATE takes SQLite's write lock even if it matches no rows.
+    """
+    keys = [thumbnail_job_key(h) for h in set(photo_hashes) if h]
+    if not keys:
+        return 0
+    bumpable = Job.query.with_entities(Job.id) \
+        .filter(Job.dedupe_key.in_(keys), Job.status == 'queued', Job.priority < priority)
+    job_ids = [job_id for (job_id,) in bumpable] # Read-only; uses the dedupe_key index
+    if not job_ids:
+        return 0
+    bumped = Job.query.filter(Job.id.in_(job_ids), Job.status == 'queued', Job.priority < priority) \
+        .update({'priority': priority}, synchronize_session=False)
+    db.session.commit()
+    return bumped
+
+
+def enqueue_missing_thumbnails(priority=PRIORITY_BACKGROUND):
+    """
+    Queues a thumbnail job for every photo content whose thumbnail generation failed.
+
+    Contents that already have a job (in any state, including permanently
+    failed ones) are left alone, so repeated sweeps don't retry broken files
+    forever. Returns the number of jobs queued.
+    """
+    other = aliased(Job)
+    hashes = db.session.execute(
+        select(PhotoContent.file_hash).where(
+            PhotoContent.thumbnail_generated.isnot(True),
+            ~exists().where(other.dedupe_key == 'thumbnail:' + PhotoContent.file_hash),
+        )
+    ).scalars().all()
+    max_attempts = current_app.config.get('JOB_MAX_ATTEMPTS') or 3
+    db.session.add_all(
+        Job(kind='thumbnail', payload={'hash': h}, priority=priority, dedupe_key=thumbnail_job_key(h),
+            max_attempts=max_attempts)
+        for h in hashes
+    )
+    db.session.commit()
+    if hashes:
+        log.info(f"Queued {len(hashes)} thumbnail jobs for photos without thumbnails")
+    return len(hashes)
+
+
+def job_to_dict(job):
+    """Serializes a job for the JSON API."""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'payload': job.payload,
+        'priority': job.priority,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'progress': job.progress,
+        'result': job.result,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# --- Claiming and running (worker side) ---
+
+def _requeue_stale_jobs(now):
+    """
+    Returns running jobs whose worker stopped sending heartbeats (crashed or killed) to the queue.
+
+    Runs on every poll of every worker, so it only writes when a job is
+    stale: an UPDATE takes SQLite's write lock even if it matches no rows.
+    """
+    stale_before = now - timedelta(seconds=current_app.config.get('JOB_STALE_AFTER') or 300)
+    stale_ids = [job_id for (job_id,) in Job.query.with_entities(Job.id).filter(
+        Job.status == 'running', Job.heartbeat_at < stale_before)] # Read-only; uses ix_job_status_priority_id
+    if not stale_ids:
+        return
+    # Conditions re-checked in the UPDATE, in case a heartbeat arrived in between
+    stale = Job.query.filter(Job.id.in_(stale_ids), Job.status == 'running', Job.heartbeat_at < stale_before)
+    # A job that keeps killing its worker (e.g. out of memory) must not loop forever
+    failed = stale.filter(Job.attempts >= Job.max_attempts).update(
+        {'status': 'failed', 'worker': None, 'finished_at': now, 'error': 'worker stopped responding'},
+        synchronize_session=False)
+    requeued = stale.update({'status': 'queued', 'worker': None, 'error': 'worker stopped responding'},
+                            synchronize_session=False)
+    db.session.commit()
+    if failed or requeued:
+        log.warning(f"Jobs of unresponsive workers: {requeued} requeued, {failed} failed")
+
+
+def claim_job(worker_name):
+    """
+    Atomically takes the next runnable job for this worker, or returns None.
+
+    The conditional UPDATE only succeeds for one worker if several pick the
+    same job. Scans are exclusive: none is claimed while another is running.
+    """
+    now = datetime.utcnow()
+    _requeue_stale_jobs(now)
+    running_scan = aliased(Job)
+    while True:
+        job_id = db.session.execute(
+            select(Job.id).where(
+                Job.status == 'queued', Job.run_after <= now,
+                (Job.kind != 'scan') | ~exists().where(running_scan.kind == 'scan', running_scan.status == 'running'),
+            ).order_by(Job.priority.desc(), Job.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            return None
+        claimed = Job.query.filter_by(id=job_id, status='queued').update({
+            'status': 'running', 'worker': worker_name, 'started_at': now, 'heartbeat_at': now,
+            'attempts': Job.attempts + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+
+
+def _library_path(relative_path):
+    """Resolves a path relative to the library, refusing anything outside it."""
+    library = os.path.realpath(current_app.config['PHOTO_LIBRARY_PATH'])
+    full_path = os.path.realpath(os.path.join(library, relative_path))
+    if full_path != library and not full_path.startswith(library + os.sep):
+        raise JobError(f"path is outside the photo library: {relative_path}")
+    return full_path
+
+
+def _run_scan(job, report_progress):
+    """Scans the whole library, or only the files under payload['path']."""
+    payload = job.payload
+    directory = (payload.get('path') or '').replace('\\', '/').strip('/')
+    if directory and not os.path.isdir(_library_path(directory)):
+        raise JobError(f"not a directory in the photo library: {directory}")
+    stats = scan_photo_library(verify=bool(payload.get('verify')), workers=payload.get('workers'),
+                               progress=report_progress, path=directory)
+    if stats is None:
+        raise JobError("the photo library is not configured")
+    queued = enqueue_missing_thumbnails()
+    return {'added': stats.added, 'updated': stats.updated, 'skipped': stats.skipped, 'errors': stats.errors,
+            'duplicates': stats.duplicates, 'thumbnail_jobs': queued}
+
+
+def _run_thumbnail(job, report_progress):
+    """Generates the base renditions of payload['hash'] (or one `size`/`format` rendition) from the original."""
+    photo_hash = job.payload.get('hash')
+    photo = Photo.query.with_entities(Photo.relative_path).filter_by(file_hash=photo_hash).first()
+    if photo is None:
+        return {'skipped': 'no photo with this hash'} # Deleted since the job was queued
+    source_path = _library_path(photo.relative_path)
+    settings = thumbnail_settings(current_app.config)
+
+    size = job.payload.get('size')
+    if size:
+        fmt = job.payload.get('format') or settings['formats'][0]
+        if fmt not in THUMBNAIL_FORMATS:
+            raise JobError(f"unknown thumbnail format: {fmt}")
+        generate_rendition(source_path, photo_hash, int(size), fmt, settings)
+        return {'size': int(size), 'format': fmt}
+
+    dhash = generate_thumbnail(source_path, photo_hash, settings)
+    if dhash is None:
+        raise RuntimeError(f"thumbnail generation failed for {photo.relative_path}") # Logged by generate_thumbnail
+    Photo.query.filter_by(file_hash=photo_hash).update(
+        dict(thumbnail_generated=True, dhash=dhash, **dhash_bands(dhash)), synchronize_session=False)
+    PhotoContent.query.filter_by(file_hash=photo_hash).update(
+        {'thumbnail_generated': True, 'dhash': dhash}, synchronize_session=False)
+    db.session.commit()
+    return {'size': settings['base_size'], 'formats': settings['formats']}
+
+
+def _run_metadata(job, report_progress):
+    """Re-extracts metadata (and thumbnails) of payload['path'], or of every path with payload['hash']."""
+    payload = job.payload
+    query = Photo.query.with_entities(Photo.relative_path, Photo.file_hash)
+    if payload.get('path'):
+        photos = query.filter_by(relative_path=payload['path'].replace('\\', '/').strip('/')).all()
+    elif payload.get('hash'):
+        photos = query.filter_by(file_hash=payload['hash']).all()
+    else:
+        raise JobError("a metadata job needs a 'path' or 'hash'")
+    settings = thumbnail_settings(current_app.config)
+    stats = ScanStats()
+    writer = PhotoBatchWriter(writer_engine(), stats)
+    for photo in photos:
+        result = process_photo_file(_library_path(photo.relative_path), photo.relative_path, settings,
+                                    existing_hash=photo.file_hash, refresh_metadata=True)
+        result.pop('timings', None)
+        if result['status'] == 'error':
+            stats.errors += 1
+            continue
+        writer.add(result)
+    writer.flush()
+    if stats.errors and not (stats.added or stats.updated):
+        raise RuntimeError(f"could not read {stats.errors} of {len(photos)} files")
+    return {'updated': stats.added + stats.updated, 'errors': stats.errors}
+
+
+JOB_HANDLERS = {
+    'scan': _run_scan,
+    'thumbnail': _run_thumbnail,
+    'metadata': _run_metadata,
+}
+
+
+class _Heartbeat:
+    """Refreshes a running job's heartbeat_at (and scan progress) from a background thread."""
+
+    def __init__(self, engine, job_id, interval):
+        self.engine = engine
+        self.job_id = job_id
+        self.interval = interval
+        self.progress = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'job-{job_id}-heartbeat', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            values = {'heartbeat_at': datetime.utcnow()}
+            if self.progress is not None:
+                values['progress'] = self.progress
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(Job.__table__.update().where(Job.__table__.c.id == self.job_id).values(**values))
+            except Exception as e:
+                log.warning(f"Could not update heartbeat of job {self.job_id}: {e}")
+
+    def report_progress(self, snapshot):
+        """Progress callback for scans; written with the next heartbeat."""
+        self.progress = {k: round(v, 2) if isinstance(v, float) else v for k, v in snapshot.items()}
+
+
+def run_job(job):
+    """Runs a claimed job and records its outcome; failed jobs are retried with exponential backoff."""
+    config = current_app.config
+    # Scans reset the session, which detaches `job`; reload it by id afterwards
+    job_id, kind = job.id, job.kind
+    log.info(f"Running {kind} job {job_id} (attempt {job.attempts}/{job.max_attempts})")
+    try:
+        with _Heartbeat(db.engine, job_id, config.get('JOB_HEARTBEAT_INTERVAL') or 5) as heartbeat:
+            result = JOB_HANDLERS[kind](job, heartbeat.report_progress)
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.error = f"{type(e).__name__}: {e}"
+        job.worker = None
+        if isinstance(e, JobError) or job.attempts >= job.max_attempts:
+            log.error(f"{kind.capitalize()} job {job_id} failed: {e}")
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        else:
+            delay = (config.get('JOB_RETRY_DELAY') or 30) * 2 ** (job.attempts - 1)
+            log.warning(f"{kind.capitalize()} job {job_id} failed, retrying in {delay}s: {e}")
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+        db.session.commit()
+        return False
+    job = db.session.get(Job, job_id)
+    job.status = 'done'
+    job.result = result
+    job.progress = heartbeat.progress
+    job.error = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    log.info(f"{kind.capitalize()} job {job_id} done: {result}")
+    return True
+
+
+def run_worker(name=None, burst=False, max_jobs=None):
+    """
+    Claims and runs jobs until interrupted; returns the number of jobs run.
+
+    Polls every JOB_POLL_INTERVAL seconds while the queue is empty. With
+    `burst`, returns as soon as no job is runnable instead.
+    """
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    poll_interval = current_app.config.get('JOB_POLL_INTERVAL') or 1.0
+    count = 0
+    log.info(f"Job worker {name} started")
+    while max_jobs is None or count < max_jobs:
+        job = claim_job(name)
+        if job is None:
+            db.session.remove() # Don't hold a connection (or a SQLite snapshot) while idle
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        count += 1
+    return count
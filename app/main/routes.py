@@ -1,37 +1,162 @@
 import os
+import re
+import hmac
+import base64
+import itertools
+import binascii
 import logging
+import mimetypes
+from datetime import datetime
+from urllib.parse import quote
 from flask import (
     render_template, jsonify, current_app, send_from_directory,
-    abort, url_for, flash, get_flashed_messages
+    abort, url_for, flash, get_flashed_messages, request, send_file, g
 )
+from markupsafe import escape
+from sqlalchemy import tuple_
 from flask_login import login_required, current_user # Require login for main views
 from . import bp
+from app.auth.decorators import session_login_required, signed_url_or
+from app.auth.signing import signed_url_for
 from app.models import Photo
 from app import db # Might be needed for more complex queries
+from app.thumbnails import (
+    THUMBNAIL_FORMATS, thumbnail_settings, generate_rendition, pick_size, negotiate_format
+)
+from app.thumbstore import get_thumbnail_store, rendition_key
+from app.search import FACETS, parse_search_filters, filter_clauses, get_facets
+from app.fulltext import ranked_matches
+from app.duplicates import find_similar, cached_duplicate_clusters
+from app.export import parse_photo_ids, export_paths, zip_stream
+from app.metrics import render_metrics, THUMBNAIL_REQUESTS
+from app.models import Job
+from app.jobs import (
+    enqueue, prioritize_thumbnails, job_to_dict, thumbnail_job_key, JOB_KINDS, PRIORITY_VIEWING, PRIORITY_DEFAULT
+)
 
 log = logging.getLogger(__name__) # Use app logger
 
+HASH_RE = re.compile(r'[0-9a-f]{64}') # SHA-256 hex digest, as stored in Photo.file_hash
+
+# --- Timeline pagination helpers ---
+
+def encode_cursor(timestamp, photo_id):
+    """Encodes the (timestamp, id) keyset position of a photo as an opaque URL-safe token."""
+    raw = f"{timestamp.isoformat()}|{photo_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decodes a cursor from encode_cursor; raises ValueError if it is malformed."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    timestamp, photo_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(timestamp), int(photo_id)
+
+def get_timeline_page(cursor=None, limit=None, clauses=()):
+    """
+    Returns (rows, next_cursor) for one page of the timeline, newest first.
+
+    Uses keyset pagination on (timestamp, id), served by ix_photo_timestamp_desc_id,
+    so every page costs the same regardless of how deep the user has scrolled.
+    Only the columns the grid needs are selected. `clauses` are extra search
+    filters (see app.search). Queued thumbnail jobs for photos on the page
+    that have no thumbnail yet are moved to the front of the job queue.
+    """
+    limit = limit or current_app.config.get('TIMELINE_PAGE_SIZE', 100)
+    query = db.session.query(
+        Photo.id, Photo.filename, Photo.relative_path, Photo.file_hash,
+        Photo.timestamp, Photo.width, Photo.height, Photo.thumbnail_generated,
+    ).filter(Photo.timestamp.isnot(None), *clauses) # The scanner always sets a timestamp (EXIF, mtime or now)
+    if cursor:
+        timestamp, photo_id = decode_cursor(cursor)
+        query = query.filter(tuple_(Photo.timestamp, Photo.id) < (timestamp, photo_id))
+    rows = query.order_by(Photo.timestamp.desc(), Photo.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    prioritize_thumbnails(row.file_hash for row in rows if not row.thumbnail_generated)
+    return rows, next_cursor
+
+def photo_to_dict(row):
+    """Serializes a timeline row for the JSON API. The URLs are signed, so fetching them needs no login lookup."""
+    has_thumb = bool(row.thumbnail_generated and row.file_hash)
+    return {
+        'id': row.id,
+        'filename': row.filename,
+        'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+        'width': row.width,
+        'height': row.height,
+        'thumbnail_url': signed_url_for('main.get_thumbnail', photo_hash=row.file_hash) if has_thumb else None,
+        # Large rendition for detail views, so they don't have to fetch the original
+        'preview_url': signed_url_for('main.get_thumbnail', photo_hash=row.file_hash,
+                                      size=max(current_app.config['THUMBNAIL_SIZES'])) if has_thumb else None,
+        'image_url': signed_url_for('main.get_image', relative_path=row.relative_path),
+    }
+
+def _timeline_item_html(photo):
+    """Renders one timeline entry; mirrors renderItem() in the index page script."""
+    if photo['thumbnail_url']:
+        img_tag = f'<img src="{escape(photo["thumbnail_url"])}" alt="{escape(photo["filename"])}" loading="lazy" width="200">'
+    else:
+        img_tag = '[No Thumbnail]'
+    return f'<li>{img_tag} {escape(photo["filename"])} ({escape(photo["timestamp"])})</li>'
+
+# Loads further pages from /api/photos when the sentinel below the list scrolls into view
+TIMELINE_SCRIPT = """
+<script>
+(function () {
+  var list = document.getElementById('timeline');
+  var sentinel = document.getElementById('timeline-more');
+  var cursor = sentinel.dataset.cursor;
+  var loading = false;
+  function esc(s) {
+    var d = document.createElement('div');
+    d.textContent = s == null ? '' : String(s);
+    return d.innerHTML;
+  }
+  function renderItem(p) {
+    var img = p.thumbnail_url
+      ? '<img src="' + esc(p.thumbnail_url) + '" alt="' + esc(p.filename) + '" loading="lazy" width="200">'
+      : '[No Thumbnail]';
+    return '<li>' + img + ' ' + esc(p.filename) + ' (' + esc(p.timestamp) + ')</li>';
+  }
+  var observer = new IntersectionObserver(function (entries) {
+    if (!entries[0].isIntersecting || loading || !cursor) return;
+    loading = true;
+    fetch('%(api_url)s?cursor=' + encodeURIComponent(cursor), {credentials: 'same-origin'})
+      .then(function (r) { return r.json(); })
+      .then(function (data) {
+        list.insertAdjacentHTML('beforeend', data.photos.map(renderItem).join(''));
+        cursor = data.next_cursor;
+        if (!cursor) observer.disconnect();
+      })
+      .finally(function () { loading = false; });
+  }, {rootMargin: '1000px'});
+  if (cursor) observer.observe(sentinel);
+})();
+</script>
+"""
+
 @bp.route('/')
 @bp.route('/index')
 @login_required # Protect the main view
 def index():
-    """Displays the main photo timeline."""
-    # Fetch photos ordered by timestamp (newest first)
-    # Add pagination later for performance
-    photos = Photo.query.order_by(Photo.timestamp.desc()).all()
+    """Displays the main photo timeline (first page; the rest loads on scroll)."""
+    # Fetch the first page of photos ordered by timestamp (newest first)
+    rows, next_cursor = get_timeline_page()
 
     # Temporary HTML response until templates are added
-    photo_html = "<h2>Photo Timeline</h2><ul>"
-    if not photos:
+    photo_html = "<h2>Photo Timeline</h2>"
+    if not rows:
         photo_html += "<p>No photos found. Run 'flask scan-library' to scan your library.</p>"
     else:
-        for p in photos:
-            thumb_url = url_for('main.get_thumbnail', photo_hash=p.file_hash) if p.thumbnail_generated and p.file_hash else '#'
-            # Link to original image (implement later if needed)
-            # img_link_url = url_for('main.get_image', relative_path=p.relative_path)
-            img_tag = f'<img src="{thumb_url}" alt="{p.filename}" loading="lazy" width="200">' if thumb_url != '#' else '[No Thumbnail]'
-            photo_html += f'<li>{img_tag} {p.filename} ({p.timestamp})</li>' # Add link later
-    photo_html += "</ul>"
+        photo_html += '<ul id="timeline">'
+        photo_html += ''.join(_timeline_item_html(photo_to_dict(p)) for p in rows)
+        photo_html += "</ul>"
+        photo_html += f'<div id="timeline-more" data-cursor="{escape(next_cursor or "")}"></div>'
+        photo_html += TIMELINE_SCRIPT % {'api_url': url_for('main.api_photos')}
 
     # Add user info and logout link
     user_info = f"<p>Logged in as: {current_user.username} | <a href='{url_for('auth.logout')}'>Logout</a></p>"
@@ -48,10 +173,213 @@ def index():
     return flashes + user_info + photo_html
 
 
-@bp.route('/image/<path:relative_path>')
+@bp.route('/api/photos')
+@login_required
+def api_photos():
+    """Returns one page of the timeline as JSON. Pass `cursor` from the previous page's next_cursor."""
+    max_limit = current_app.config.get('TIMELINE_MAX_PAGE_SIZE', 500)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and not 1 <= limit <= max_limit:
+        abort(400, description=f"limit must be between 1 and {max_limit}")
+    try:
+        rows, next_cursor = get_timeline_page(request.args.get('cursor'), limit)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        abort(400, description="Invalid cursor")
+    return jsonify(photos=[photo_to_dict(p) for p in rows], next_cursor=next_cursor)
+
+
+@bp.route('/api/search')
 @login_required
+def api_search():
+    """
+    Searches photos by metadata and returns one page of results plus facet counts.
+
+    Filters: start, end, camera_make, camera_model, ext, min_width, max_width,
+    min_height, max_height and path (see app.search.parse_search_filters).
+    Results are paginated like /api/photos. Facets (year, month, camera,
+    extension) are computed for the first page only, unless requested with
+    `facets` (comma separated; empty for none).
+    """
+    max_limit = current_app.config.get('TIMELINE_MAX_PAGE_SIZE', 500)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and not 1 <= limit <= max_limit:
+        abort(400, description=f"limit must be between 1 and {max_limit}")
+    try:
+        filters = parse_search_filters(request.args)
+    except ValueError as e:
+        abort(400, description=f"Invalid search filter: {e}")
+    cursor = request.args.get('cursor')
+    try:
+        rows, next_cursor = get_timeline_page(cursor, limit, filter_clauses(filters))
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        abort(400, description="Invalid cursor")
+
+    if 'facets' in request.args:
+        names = [n for n in request.args['facets'].split(',') if n]
+        unknown = set(names) - set(FACETS)
+        if unknown:
+            abort(400, description=f"Unknown facets: {', '.join(sorted(unknown))}")
+    else:
+        names = () if cursor else FACETS
+    response = {'photos': [photo_to_dict(p) for p in rows], 'next_cursor': next_cursor}
+    if names:
+        response['facets'] = get_facets(filters, names)
+    return jsonify(response)
+
+
+def _photo_rows(photo_ids):
+    """Loads timeline rows for the given ids, keyed by id."""
+    return {
+        row.id: row for row in db.session.query(
+            Photo.id, Photo.filename, Photo.relative_path, Photo.file_hash,
+            Photo.timestamp, Photo.width, Photo.height, Photo.thumbnail_generated,
+        ).filter(Photo.id.in_(photo_ids))
+    }
+
+
+@bp.route('/api/search/text')
+@login_required
+def api_search_text():
+    """
+    Ranked full-text search over filenames, folder names, camera/lens and EXIF text.
+
+    Every word of `q` is matched as a prefix. Results are ordered by relevance
+    and paginated with `limit` and `offset`.
+    """
+    max_limit = current_app.config.get('TIMELINE_MAX_PAGE_SIZE', 500)
+    limit = request.args.get('limit', current_app.config.get('TIMELINE_PAGE_SIZE', 100), type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if not 1 <= limit <= max_limit or offset < 0:
+        abort(400, description=f"limit must be between 1 and {max_limit} and offset not negative")
+    try:
+        matches = ranked_matches(db.session.connection(), request.args.get('q', ''), limit + 1, offset)
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    has_more = len(matches) > limit
+    matches = matches[:limit]
+    rows = _photo_rows([photo_id for photo_id, _ in matches])
+    photos = [dict(photo_to_dict(rows[photo_id]), rank=rank) for photo_id, rank in matches if photo_id in rows]
+    return jsonify(photos=photos, next_offset=offset + limit if has_more else None)
+
+
+@bp.route('/api/photos/<int:photo_id>/similar')
+@login_required
+def api_similar_photos(photo_id):
+    """Returns photos whose perceptual hash is within `distance` bits (default 6) of this photo's."""
+    distance = request.args.get('distance', 6, type=int)
+    if not 0 <= distance <= 64:
+        abort(400, description="distance must be between 0 and 64")
+    photo = Photo.query.with_entities(Photo.dhash).filter_by(id=photo_id).first()
+    if photo is None:
+        abort(404)
+    if photo.dhash is None:
+        return jsonify(photos=[])
+    matches = find_similar(db.session.connection(), photo.dhash, distance, exclude_id=photo_id)
+    rows = _photo_rows([other_id for _, other_id in matches])
+    return jsonify(photos=[dict(photo_to_dict(rows[i]), distance=d) for d, i in matches if i in rows])
+
+
+@bp.route('/api/duplicates')
+@login_required
+def api_duplicates():
+    """
+    Returns clusters of near-duplicate photos, largest first.
+
+    `distance` is the maximum Hamming distance between perceptual hashes
+    (default 3); clusters are paginated with `limit` and `offset`. Clusters
+    are computed once and cached while the photos' hashes are unchanged (up
+    to DUPLICATE_CLUSTERS_TTL seconds).
+    """
+    distance = request.args.get('distance', 3, type=int)
+    limit = request.args.get('limit', 50, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if not 0 <= distance <= 64 or not 1 <= limit <= 500 or offset < 0:
+        abort(400, description="distance must be 0-64, limit 1-500 and offset not negative")
+    clusters = cached_duplicate_clusters(db.session.connection(), distance, current_app.config['DUPLICATE_CLUSTERS_TTL'])
+    page = clusters[offset:offset + limit]
+    rows = _photo_rows([photo_id for ids in page for photo_id in ids])
+    return jsonify(
+        total=len(clusters),
+        clusters=[[photo_to_dict(rows[i]) for i in ids if i in rows] for ids in page],
+        next_offset=offset + limit if offset + limit < len(clusters) else None,
+    )
+
+
+@bp.route('/api/jobs', methods=['POST'])
+@login_required
+def api_create_job():
+    """
+    Queues a background job and returns it with 202; poll /api/jobs/<id> for its status.
+
+    JSON body: {"kind": "scan", "path": optional library subdirectory,
+    "verify": bool}, {"kind": "thumbnail", "hash": ..., "size": optional} or
+    {"kind": "metadata", "hash" or "path": ...}. Jobs are run by
+    `flask run-jobs` workers; a request for work that is already queued
+    returns the existing job.
+    """
+    if not request.is_json: # Also keeps cross-site form posts out
+        abort(415, description="Expected a JSON body")
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or body.get('kind') not in JOB_KINDS:
+        abort(400, description=f"kind must be one of: {', '.join(JOB_KINDS)}")
+    kind = body['kind']
+    if kind == 'scan':
+        payload = {'path': str(body.get('path') or '').strip('/'), 'verify': bool(body.get('verify'))}
+        dedupe_key = f"scan:{payload['path']}"
+    elif kind == 'thumbnail':
+        if not HASH_RE.fullmatch(str(body.get('hash', ''))):
+            abort(400, description="hash must be a photo's SHA-256")
+        payload = {'hash': body['hash']}
+        if body.get('size'):
+            if not isinstance(body['size'], int) or body.get('format') not in (None, *THUMBNAIL_FORMATS):
+                abort(400, description=f"size must be an integer and format one of: {', '.join(THUMBNAIL_FORMATS)}")
+            payload.update(size=body['size'], format=body.get('format'))
+            dedupe_key = f"{thumbnail_job_key(body['hash'])}:{payload['size']}:{payload['format']}"
+        else:
+            dedupe_key = thumbnail_job_key(body['hash'])
+    else:
+        if not body.get('hash') and not body.get('path'):
+            abort(400, description="a metadata job needs a hash or path")
+        payload = {'hash': body['hash']} if body.get('hash') else {'path': str(body['path'])}
+        dedupe_key = f"metadata:{payload.get('hash') or payload['path']}"
+    job = enqueue(kind, payload, dedupe_key=dedupe_key,
+                  priority=PRIORITY_VIEWING if kind == 'thumbnail' else PRIORITY_DEFAULT)
+    response = jsonify(job_to_dict(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('main.api_job', job_id=job.id)
+    return response
+
+
+@bp.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job(job_id):
+    """Returns a job's status, progress (scans) and result."""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job_to_dict(job))
+
+
+@bp.route('/api/jobs')
+@login_required
+def api_jobs():
+    """Lists jobs, newest first, optionally filtered by `status` and `kind`."""
+    limit = request.args.get('limit', 50, type=int)
+    if not 1 <= limit <= 500:
+        abort(400, description="limit must be between 1 and 500")
+    query = Job.query
+    if request.args.get('status'):
+        query = query.filter(Job.status == request.args['status'])
+    if request.args.get('kind'):
+        query = query.filter(Job.kind == request.args['kind'])
+    return jsonify(jobs=[job_to_dict(job) for job in query.order_by(Job.id.desc()).limit(limit)])
+
+
+@bp.route('/image/<path:relative_path>')
+@signed_url_or(login_required)
 def get_image(relative_path):
-    """Serves an original image file."""
+    """Serves an original image file, to logged-in users or through a signed URL."""
     photo_library_path = current_app.config.get('PHOTO_LIBRARY_PATH')
     if not photo_library_path:
         log.error("Photo library path not configured.")
@@ -70,10 +398,10 @@ def get_image(relative_path):
          abort(404) # Path traversal attempt or invalid path
 
     # Check if the photo exists in DB (optional, but good for consistency)
+    # Signed URLs are only issued for photos in the DB, so they skip the lookup
     # Normalize path separators in DB query if needed
     normalized_relative_path = relative_path.replace('\\', '/')
-    photo = Photo.query.filter_by(relative_path=normalized_relative_path).first()
-    if not photo:
+    if not g.get('signed_url') and not Photo.query.filter_by(relative_path=normalized_relative_path).first():
         log.warning(f"Image not found in DB: {normalized_relative_path}")
         abort(404)
 
@@ -86,41 +414,183 @@ def get_image(relative_path):
          log.error(f"Directory mismatch after path processing: {directory} vs {real_library_path}")
          abort(404) # Should not happen if previous checks passed
 
+    offload = _offload_response(real_safe_path, real_library_path, 'X_ACCEL_LIBRARY_PREFIX')
+    if offload is not None:
+        offload.headers['Cache-Control'] = f"private, max-age={current_app.config['IMAGE_CACHE_MAX_AGE']}"
+        return offload
+
     try:
         log.debug(f"Serving image: directory='{directory}', filename='{filename}'")
-        return send_from_directory(directory, filename)
+        # conditional=True (the default) answers Range/If-Range with 206 partial content,
+        # so large TIFFs can be streamed and resumed
+        response = send_from_directory(directory, filename, max_age=current_app.config['IMAGE_CACHE_MAX_AGE'])
+        response.cache_control.public = False # Originals are only for logged-in users
+        response.cache_control.private = True
+        return response
     except FileNotFoundError:
         log.error(f"File not found by send_from_directory: {filename} in {directory}")
         abort(404)
 
 
-@bp.route('/thumbnail/<string:photo_hash>')
+@bp.route('/export', methods=['GET', 'POST'])
 @login_required
+def export_zip():
+    """
+    Streams a ZIP archive of original files, generated while it downloads.
+
+    Select photos with `ids` (comma separated), a date range (`start`/`end`),
+    a directory (`path`) or any other /api/search filter, as query
+    parameters or, for long selections, a JSON body
+    ({"ids": [...], "start": ...}) in a POST. Filters combine with AND.
+    """
+    if request.method == 'POST':
+        if not request.is_json: # Also keeps cross-site form posts out
+            abort(415, description="Expected a JSON body")
+        params = request.get_json(silent=True)
+        if not isinstance(params, dict):
+            abort(400, description="Expected a JSON object")
+        ids = params.get('ids') or []
+        if not isinstance(ids, list):
+            abort(400, description="ids must be a list")
+    else:
+        params = request.args
+        ids = request.args.getlist('ids')
+    try:
+        filters = parse_search_filters(params)
+        photo_ids = parse_photo_ids(ids)
+    except (ValueError, TypeError) as e:
+        abort(400, description=f"Invalid export filter: {e}")
+    if not filters and photo_ids is None:
+        abort(400, description="Select photos to export with ids, start/end, path or another search filter")
+    paths = export_paths(filter_clauses(filters), photo_ids)
+    first = next(paths, None)
+    if first is None:
+        abort(404, description="No photos match the export filters")
+
+    config = current_app.config
+    stream = zip_stream(config['PHOTO_LIBRARY_PATH'], itertools.chain([first], paths),
+                        config['EXPORT_CHUNK_SIZE'], config['EXPORT_READ_AHEAD'])
+    response = current_app.response_class(stream, mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="photos-{datetime.now():%Y%m%d-%H%M%S}.zip"'
+    response.headers['Cache-Control'] = 'private, no-store'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let nginx buffer multi-GB responses
+    log.info(f"Exporting photos for {current_user.username} (filters: {', '.join(sorted(filters)) or 'none'}, "
+             f"{len(photo_ids or ())} ids)")
+    return response
+
+
+@bp.route('/thumbnail/<string:photo_hash>')
+@signed_url_or(session_login_required) # Avoids a user lookup per thumbnail; see the decorators
 def get_thumbnail(photo_hash):
-    """Serves a thumbnail image."""
-    thumbnail_dir = current_app.config.get('THUMBNAIL_DIR')
-    if not thumbnail_dir:
+    """
+    Serves a thumbnail rendition.
+
+    `size` selects the smallest configured rendition at least that large
+    (default: the base size); the format is negotiated from the Accept header.
+    Renditions that don't exist yet are generated on first request.
+
+    Thumbnails are content-addressed, so responses are cacheable forever and
+    revalidations are answered with 304 before touching the disk. Signed URLs
+    (as returned by the photo APIs) are checked without the session or the DB.
+    """
+    if not current_app.config.get('THUMBNAIL_DIR'):
         log.error("Thumbnail directory not configured.")
         abort(500)
+    if not HASH_RE.fullmatch(photo_hash):
+        abort(404)
 
-    # Construct the expected path based on the hash structure
-    hash_prefix = photo_hash[:2]
-    hash_suffix = photo_hash[2:4]
-    thumb_subdir_name = os.path.join(hash_prefix, hash_suffix) # Relative subdir path
-    thumb_filename = f"{photo_hash}.jpg"
-    relative_thumb_path = os.path.join(thumb_subdir_name, thumb_filename)
+    settings = thumbnail_settings(current_app.config)
+    size = pick_size(request.args.get('size', settings['base_size'], type=int), settings)
+    fmt = negotiate_format(request.accept_mimetypes, settings)
+    etag = rendition_key(photo_hash, size, fmt)
 
-    try:
-        log.debug(f"Serving thumbnail: directory='{thumbnail_dir}', path='{relative_thumb_path}'")
-        return send_from_directory(thumbnail_dir, relative_thumb_path)
-    except FileNotFoundError:
-        log.warning(f"Thumbnail not found for hash: {photo_hash} at path {relative_thumb_path}")
-        # Optionally, return a placeholder image
-        # placeholder_path = os.path.join(current_app.static_folder, 'images')
-        # placeholder_file = 'placeholder_thumb.png'
-        # if os.path.exists(os.path.join(placeholder_path, placeholder_file)):
-        #     return send_from_directory(placeholder_path, placeholder_file)
-        abort(404)
+    if request.if_none_match.contains(etag):
+        THUMBNAIL_REQUESTS.inc(result='not_modified')
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return _immutable(response)
+
+    store = get_thumbnail_store(settings)
+    if store.exists(photo_hash, size, fmt):
+        THUMBNAIL_REQUESTS.inc(result='hit')
+    else:
+        # Generate missing renditions lazily from the original
+        photo = Photo.query.with_entities(Photo.relative_path).filter_by(file_hash=photo_hash).first()
+        if not photo:
+            log.warning(f"Thumbnail requested for unknown hash: {photo_hash}")
+            THUMBNAIL_REQUESTS.inc(result='error')
+            abort(404)
+        source_path = os.path.join(current_app.config['PHOTO_LIBRARY_PATH'], photo.relative_path)
+        try:
+            generate_rendition(source_path, photo_hash, size, fmt, settings)
+            THUMBNAIL_REQUESTS.inc(result='miss')
+        except Exception as e:
+            log.error(f"Failed to generate {size}px {fmt} rendition for {photo_hash}: {e}")
+            THUMBNAIL_REQUESTS.inc(result='error')
+            # Optionally, return a placeholder image
+            # placeholder_path = os.path.join(current_app.static_folder, 'images')
+            # placeholder_file = 'placeholder_thumb.png'
+            # if os.path.exists(os.path.join(placeholder_path, placeholder_file)):
+            #     return send_from_directory(placeholder_path, placeholder_file)
+            abort(404)
+
+    mimetype = THUMBNAIL_FORMATS[fmt][2]
+    thumb_path = store.path(photo_hash, size, fmt)
+    if thumb_path is None:
+        # Packed store: serve the bytes straight from the mmapped pack
+        data = store.read(photo_hash, size, fmt)
+        if data is None:
+            abort(404)
+        response = current_app.response_class(data, mimetype=mimetype)
+        response.set_etag(etag)
+        return _immutable(response)
+
+    log.debug(f"Serving thumbnail: {thumb_path}")
+    response = _offload_response(thumb_path, settings['dir'], 'X_ACCEL_THUMBNAIL_PREFIX', mimetype=mimetype)
+    if response is None:
+        response = send_file(thumb_path, mimetype=mimetype, etag=etag)
+    else:
+        response.set_etag(etag)
+    return _immutable(response)
+
+
+def _immutable(response):
+    """Marks a thumbnail response as cacheable forever; the URL changes whenever the content does."""
+    response.headers['Cache-Control'] = f"private, max-age={current_app.config['THUMBNAIL_CACHE_MAX_AGE']}, immutable"
+    response.vary.add('Accept')
+    return response
+
+
+def _offload_response(path, root, prefix_key, mimetype=None):
+    """
+    Hands file delivery to the front proxy when SENDFILE_MODE is 'x-accel' (nginx).
+
+    Returns None when the app should send the file itself. For 'x-sendfile'
+    (Apache, lighttpd) Flask's own USE_X_SENDFILE support in send_file is used.
+    """
+    if current_app.config.get('SENDFILE_MODE') != 'x-accel':
+        return None
+    prefix = current_app.config[prefix_key].rstrip('/')
+    relative = os.path.relpath(path, root).replace(os.sep, '/')
+    response = current_app.response_class(mimetype=mimetype or mimetypes.guess_type(path)[0])
+    # nginx serves the file (including Range requests) from its internal location
+    response.headers['X-Accel-Redirect'] = f"{prefix}/{quote(relative)}"
+    return response
+
+@bp.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics: request counts, latencies, bytes and DB time per route,
+    thumbnail cache hits, and the progress and stage timings of the latest scan.
+
+    Request metrics are per server process. No login is required (scrapers
+    can't log in); set METRICS_TOKEN to require a bearer token instead.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        abort(401)
+    return current_app.response_class(render_metrics(current_app.config),
+                                      content_type='text/plain; version=0.0.4; charset=utf-8')
 
 # Add route for viewing/editing EXIF later
 # @bp.route('/photo/<int:photo_id>/exif', methods=['GET', 'POST'])
@@ -0,0 +1,229 @@
+import os
+import time
+import threading
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {} # label values tuple -> value (or histogram state)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            samples = sorted(self._values.items())
+        for key, value in samples:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    """A value that only goes up (requests served, bytes sent)."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that is set to the current reading (queue depth, files per second)."""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Counts observations (durations in seconds) into cumulative buckets, plus their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0] # bucket counts, sum, count
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """A set of metrics rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# --- Request serving (per web server process) ---
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter(REGISTRY, 'ohmyphoto_http_requests_total', 'HTTP requests by endpoint and status.',
+                        ('endpoint', 'status'))
+HTTP_REQUEST_SECONDS = Histogram(REGISTRY, 'ohmyphoto_http_request_duration_seconds',
+                                 'Time spent handling a request, by endpoint.', ('endpoint',))
+HTTP_RESPONSE_BYTES = Counter(REGISTRY, 'ohmyphoto_http_response_bytes_total',
+                              'Response body bytes sent by the app (not by an X-Sendfile proxy), by endpoint.',
+                              ('endpoint',))
+DB_QUERY_SECONDS = Histogram(REGISTRY, 'ohmyphoto_db_query_duration_seconds',
+                             'Total database time per request, by endpoint.', ('endpoint',))
+DB_QUERIES = Counter(REGISTRY, 'ohmyphoto_db_queries_total', 'Database statements executed, by endpoint.',
+                     ('endpoint',))
+THUMBNAIL_REQUESTS = Counter(REGISTRY, 'ohmyphoto_thumbnail_requests_total',
+                             'Thumbnail requests: hit (stored), miss (generated), not_modified (304) or error.',
+                             ('result',))
+
+# --- Library scans (rendered to SCAN_METRICS_FILE by the scanning process) ---
+
+SCAN_REGISTRY = Registry()
+
+SCAN_STAGE_SECONDS = Histogram(SCAN_REGISTRY, 'ohmyphoto_scan_stage_duration_seconds',
+                               'Per-file time in each scan stage (db_write is per batch).', ('stage',))
+SCAN_FILES = Gauge(SCAN_REGISTRY, 'ohmyphoto_scan_files', 'Files handled by the current or last scan, by result.',
+                   ('result',))
+SCAN_QUEUE_DEPTH = Gauge(SCAN_REGISTRY, 'ohmyphoto_scan_queue_depth',
+                         'Files waiting between scan pipeline stages.', ('queue',))
+SCAN_FILES_PER_SECOND = Gauge(SCAN_REGISTRY, 'ohmyphoto_scan_files_per_second',
+                              'Average throughput of the current or last scan.')
+SCAN_ETA_SECONDS = Gauge(SCAN_REGISTRY, 'ohmyphoto_scan_eta_seconds',
+                         'Estimated time until the current scan finishes (-1 if unknown).')
+SCAN_RUNNING = Gauge(SCAN_REGISTRY, 'ohmyphoto_scan_running', '1 while a scan is running.')
+SCAN_UPDATED = Gauge(SCAN_REGISTRY, 'ohmyphoto_scan_last_update_timestamp_seconds',
+                     'When these scan metrics were written (Unix time).')
+
+
+def scan_metrics_path(config):
+    """Where scanning processes write the scan metrics and /metrics reads them from."""
+    return config.get('SCAN_METRICS_FILE') or os.path.join(config['DATA_STORAGE_PATH'], 'scan_metrics.prom')
+
+
+def render_metrics(config):
+    """
+    Returns the request metrics of this process plus the latest scan metrics.
+
+    Scans run in separate processes (flask scan-library, watch-library), so
+    their metrics are read from the file they keep up to date.
+    """
+    text = REGISTRY.render()
+    try:
+        with open(scan_metrics_path(config)) as f:
+            text += f.read()
+    except OSError:
+        pass # No scan has run yet
+    return text
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.db_seconds = 0.0
+    g.db_queries = 0
+
+
+def _after_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    HTTP_RESPONSE_BYTES.inc(response.content_length or 0, endpoint=endpoint)
+    if g.db_queries:
+        DB_QUERY_SECONDS.observe(g.db_seconds, endpoint=endpoint)
+        DB_QUERIES.inc(g.db_queries, endpoint=endpoint)
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and conn.info.get('query_start'):
+        g.db_seconds = g.get('db_seconds', 0.0) + time.perf_counter() - conn.info['query_start'].pop()
+        g.db_queries = g.get('db_queries', 0) + 1
+
+
+def init_app(app):
+    """Times every request and the database statements it runs."""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
@@ -1,3 +1,10 @@
+import os
+import hmac
+import time
+import hashlib
+import logging
+import posixpath
+from flask import current_app, has_app_context
 from app import db, login_manager
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -17,36 +24,143 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def get_id(self):
+        """
+        The token Flask-Login keeps in the session: the id plus a fingerprint of the password hash.
+
+        Changing the password changes the token, so every existing session
+        (and remember-me cookie) of the user stops loading it.
+        """
+        secret = current_app.config['SECRET_KEY']
+        key = secret if isinstance(secret, bytes) else secret.encode()
+        fingerprint = hmac.new(key, (self.password_hash or '').encode(), hashlib.sha256).hexdigest()[:32]
+        return f"{self.id}:{fingerprint}"
+
     def __repr__(self):
         return f'<User {self.username}>'
 
+log = logging.getLogger(__name__)
+
+_user_cache = {} # user id -> (expiry on the monotonic clock, detached User)
+_user_cache_marker_mtime = [None] # Last seen mtime of the invalidation marker
+
+def _user_cache_marker():
+    """File touched whenever a cached user must be reloaded, so other processes drop their caches too."""
+    return os.path.join(current_app.config['DATA_STORAGE_PATH'], 'user_cache.invalidated')
+
+def _check_user_cache_marker():
+    try:
+        mtime = os.stat(_user_cache_marker()).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime != _user_cache_marker_mtime[0]:
+        _user_cache.clear()
+        _user_cache_marker_mtime[0] = mtime
+
+def invalidate_cached_user(user_id):
+    """Drops a user from the load_user cache of every process (on logout, and when the user changes or is deleted)."""
+    _user_cache.pop(str(user_id), None)
+    if not has_app_context():
+        return
+    marker = _user_cache_marker()
+    try:
+        os.makedirs(os.path.dirname(marker), exist_ok=True)
+        with open(marker, 'a'):
+            pass
+        now = time.time_ns()
+        os.utime(marker, ns=(now, now))
+    except OSError as e:
+        log.warning(f"Could not invalidate cached users in other processes: {e}")
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, user):
+    invalidate_cached_user(user.id)
+
 @login_manager.user_loader
-def load_user(id):
-    """User loader callback used by Flask-Login."""
-    return User.query.get(int(id))
+def load_user(token):
+    """
+    User loader callback used by Flask-Login; `token` is User.get_id().
+
+    Users are cached per process for USER_CACHE_TTL seconds, so authenticated
+    API requests don't each start with a user query. Cached users are
+    detached from the session. Every process drops its cache when a user is
+    changed, deleted or logged out (see invalidate_cached_user), at the cost
+    of a stat() per request. Tokens whose password fingerprint doesn't match
+    (the password changed, or a session from before fingerprints) load no user.
+    """
+    user_id, _, fingerprint = token.partition(':')
+    if not user_id.isdigit() or not fingerprint:
+        return None
+    ttl = current_app.config.get('USER_CACHE_TTL', 0)
+    if ttl:
+        _check_user_cache_marker()
+    cached = _user_cache.get(user_id) if ttl else None
+    if cached and cached[0] > time.monotonic() and hmac.compare_digest(cached[1].get_id(), token):
+        return cached[1]
+    user = db.session.get(User, int(user_id)) # Not cached, or cached with another password
+    if user is None or not hmac.compare_digest(user.get_id(), token):
+        return None
+    if ttl:
+        db.session.expunge(user) # Detached, so commits in later requests don't expire its attributes
+        _user_cache[user_id] = (time.monotonic() + ttl, user)
+    return user
 
 # --- Photo Model ---
 
+def file_extension(path):
+    """Returns the value stored in Photo.extension for a path, e.g. 'jpg' for 'a/IMG_1.JPG'."""
+    return os.path.splitext(path)[1].lower().lstrip('.')[:16] or None
+
+def file_directory(path):
+    """Returns the value stored in Photo.directory for a path, e.g. '2023/trip' for '2023/trip/IMG_1.JPG'."""
+    return posixpath.dirname(path)
+
 class Photo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
+    extension = db.Column(db.String(16)) # Lower-case, without the dot; see file_extension()
     # Store path relative to the configured PHOTO_LIBRARY_PATH
     relative_path = db.Column(db.String(1024), nullable=False, index=True, unique=True)
+    # Parent directory of relative_path ('' at the library root); the scanner loads one directory at a time
+    directory = db.Column(db.String(1024))
     # Extracted timestamp (from EXIF or file system) for timeline sorting
     timestamp = db.Column(db.DateTime, index=True)
     # Store basic metadata extracted during scan
     width = db.Column(db.Integer)
     height = db.Column(db.Integer)
     filesize = db.Column(db.Integer) # In bytes
-    # Store hash to detect duplicates?
-    file_hash = db.Column(db.String(64), index=True, unique=True, nullable=True) # e.g., SHA256
+    # File system stat signature, used to skip re-hashing unchanged files on rescans
+    mtime_ns = db.Column(db.BigInteger)
+    inode = db.Column(db.BigInteger)
+    device = db.Column(db.BigInteger)
+    # SHA-256 of the file; identical files at several paths share one PhotoContent row
+    file_hash = db.Column(db.String(64), db.ForeignKey('photo_content.file_hash'), index=True, nullable=True)
     # Store thumbnail status/path? (or derive from ID/hash)
     thumbnail_generated = db.Column(db.Boolean, default=False)
+    # Perceptual hash (64-bit dHash) for near-duplicate detection, split into 16-bit bands:
+    # hashes within Hamming distance 3 share at least one band (see app.duplicates)
+    dhash = db.Column(db.BigInteger)
+    dhash_band0 = db.Column(db.Integer, index=True)
+    dhash_band1 = db.Column(db.Integer, index=True)
+    dhash_band2 = db.Column(db.Integer, index=True)
+    dhash_band3 = db.Column(db.Integer, index=True)
     # Foreign key to user if photos are user-specific (optional for now)
     # user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     # user = db.relationship('User', backref=db.backref('photos', lazy=True))
-    # Store raw EXIF data (consider JSON type if DB supports it)
-    exif_data = db.Column(db.Text)
+    # Normalized EXIF, extracted at ingest so camera/lens/date filters are indexed queries
+    camera_make = db.Column(db.String(128))
+    camera_model = db.Column(db.String(128))
+    lens_model = db.Column(db.String(128), index=True)
+    focal_length = db.Column(db.Float) # mm
+    iso = db.Column(db.Integer)
+    exposure_time = db.Column(db.Float) # seconds
+    f_number = db.Column(db.Float)
+    gps_latitude = db.Column(db.Float) # Decimal degrees, negative for S/W
+    gps_longitude = db.Column(db.Float)
+    orientation = db.Column(db.SmallInteger) # EXIF orientation 1-8
+    # Remaining EXIF tags as {tag name: printable value}; NULL for rows stored before normalization
+    exif_data = db.Column(db.JSON(none_as_null=True))
     # Fields for search/classification (to be added later)
     # description = db.Column(db.Text)
     # ocr_text = db.Column(db.Text)
@@ -54,7 +168,108 @@ class Photo(db.Model):
 
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Serves the timeline's keyset pagination: ORDER BY timestamp DESC, id DESC
+        db.Index('ix_photo_timestamp_desc_id', timestamp.desc(), id),
+        # "All photos from this camera in 2023"
+        db.Index('ix_photo_camera_timestamp', camera_make, camera_model, timestamp),
+        db.Index('ix_photo_gps', gps_latitude, gps_longitude),
+        db.Index('ix_photo_extension_timestamp', extension, timestamp),
+        db.Index('ix_photo_directory_filename', directory, filename),
+    )
+
     def __repr__(self):
         return f'<Photo {self.filename} ({self.relative_path})>'
 
+class PhotoContent(db.Model):
+    """
+    Metadata extracted once per unique file content, keyed by its SHA-256.
+
+    Photo rows are path references to a content row and carry a copy of these
+    values so the timeline and search indexes stay on one table. When the
+    scanner meets a known hash it copies the values from here instead of
+    parsing EXIF and generating thumbnails again.
+    """
+    __tablename__ = 'photo_content'
+    file_hash = db.Column(db.String(64), primary_key=True)
+    filesize = db.Column(db.BigInteger)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    taken_at = db.Column(db.DateTime) # EXIF capture time; NULL if the file has none
+    camera_make = db.Column(db.String(128))
+    camera_model = db.Column(db.String(128))
+    lens_model = db.Column(db.String(128))
+    focal_length = db.Column(db.Float)
+    iso = db.Column(db.Integer)
+    exposure_time = db.Column(db.Float)
+    f_number = db.Column(db.Float)
+    gps_latitude = db.Column(db.Float)
+    gps_longitude = db.Column(db.Float)
+    orientation = db.Column(db.SmallInteger)
+    exif_data = db.Column(db.JSON(none_as_null=True))
+    dhash = db.Column(db.BigInteger)
+    thumbnail_generated = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PhotoContent {self.file_hash}>'
+
+# --- Scan Checkpoint Models ---
+
+class ScanSession(db.Model):
+    """A library scan; left 'running' if interrupted so the next scan can resume it."""
+    id = db.Column(db.Integer, primary_key=True)
+    library_path = db.Column(db.String(1024), nullable=False)
+    verify = db.Column(db.Boolean, default=False)
+    status = db.Column(db.String(16), nullable=False, default='running', index=True) # 'running' or 'completed'
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<ScanSession {self.id} ({self.status})>'
+
+class ScanDirectory(db.Model):
+    """A directory whose files were all committed during a scan session."""
+    session_id = db.Column(db.Integer, db.ForeignKey('scan_session.id', ondelete='CASCADE'), primary_key=True)
+    # Relative to PHOTO_LIBRARY_PATH, '' for the library root
+    path = db.Column(db.String(1024), primary_key=True)
+
+    def __repr__(self):
+        return f'<ScanDirectory {self.path!r} (session {self.session_id})>'
+
+# --- Background Jobs ---
+
+class Job(db.Model):
+    """
+    A unit of background work, run by `flask run-jobs` worker processes (see app.jobs).
+
+    Workers claim the queued job with the highest priority, then the oldest.
+    At most one job per dedupe_key is queued or running at a time.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False) # 'scan', 'thumbnail' or 'metadata'
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    priority = db.Column(db.Integer, nullable=False, default=0) # Higher runs first
+    status = db.Column(db.String(16), nullable=False, default='queued') # queued, running, done or failed
+    dedupe_key = db.Column(db.String(255), index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Retry backoff
+    worker = db.Column(db.String(64))
+    heartbeat_at = db.Column(db.DateTime) # Refreshed while running; stale jobs are requeued
+    progress = db.Column(db.JSON(none_as_null=True)) # Latest progress snapshot of a running scan
+    result = db.Column(db.JSON(none_as_null=True))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Serves the claim query: WHERE status = 'queued' ORDER BY priority DESC, id
+        db.Index('ix_job_status_priority_id', status, priority.desc(), id),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} ({self.status})>'
+
 # Define other models here later (e.g., Album, Tag, Face)
@@ -0,0 +1,314 @@
+import logging
+import posixpath
+import time
+from sqlalchemy import bindparam, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from app.models import Photo, PhotoContent, ScanDirectory, file_extension, file_directory
+from app.fulltext import index_photos, unindex_photos
+
+log = logging.getLogger(__name__)
+
+photo_table = Photo.__table__
+content_table = PhotoContent.__table__
+
+# Columns written for new/changed photos. id and added_at are left to the insert defaults.
+UPSERT_COLUMNS = (
+    'relative_path', 'filename', 'extension', 'directory', 'file_hash', 'timestamp', 'width', 'height',
+    'filesize', 'mtime_ns', 'inode', 'device', 'exif_data', 'thumbnail_generated',
+    'camera_make', 'camera_model', 'lens_model', 'focal_length', 'iso', 'exposure_time', 'f_number',
+    'gps_latitude', 'gps_longitude', 'orientation',
+    'dhash', 'dhash_band0', 'dhash_band1', 'dhash_band2', 'dhash_band3',
+)
+# Columns refreshed for files whose content is unchanged but whose stat signature moved
+STAT_COLUMNS = ('filesize', 'mtime_ns', 'inode', 'device')
+# Per-content values, written once per unique file_hash
+CONTENT_COLUMNS = tuple(c.name for c in content_table.columns if c.name != 'created_at')
+# Columns re-read by metadata-only scans, on the photo row and on its content row
+METADATA_COLUMNS = (
+    'timestamp', 'width', 'height', 'exif_data',
+    'camera_make', 'camera_model', 'lens_model', 'focal_length', 'iso', 'exposure_time', 'f_number',
+    'gps_latitude', 'gps_longitude', 'orientation',
+)
+CONTENT_METADATA_COLUMNS = tuple(
+    name for name in CONTENT_COLUMNS if name not in ('file_hash', 'filesize', 'dhash', 'thumbnail_generated')
+)
+
+
+def _upsert_statement(dialect_name, table=photo_table, key='relative_path', columns=UPSERT_COLUMNS):
+    """Builds an INSERT ... ON CONFLICT(key) DO UPDATE for the given dialect."""
+    if dialect_name == 'sqlite':
+        stmt = sqlite.insert(table)
+    elif dialect_name == 'postgresql':
+        stmt = postgresql.insert(table)
+    else:
+        return None
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c[key]],
+        set_={name: stmt.excluded[name] for name in columns if name != key},
+    )
+
+
+def _stat_update_statement():
+    """Builds an UPDATE keyed by relative_path; the SET columns come from the parameters."""
+    return photo_table.update().where(photo_table.c.relative_path == bindparam('_relative_path'))
+
+
+def upsert_photos(conn, rows):
+    """Inserts or updates Photo rows (plain dicts with UPSERT_COLUMNS keys) in one executemany."""
+    stmt = _upsert_statement(conn.dialect.name)
+    if stmt is not None:
+        conn.execute(stmt, rows)
+    else:
+        # Dialects without ON CONFLICT support: update first, insert whatever did not exist
+        update_stmt = _stat_update_statement()
+        for row in rows:
+            values = {k: v for k, v in row.items() if k != 'relative_path'}
+            if conn.execute(update_stmt, {'_relative_path': row['relative_path'], **values}).rowcount == 0:
+                conn.execute(photo_table.insert(), row)
+    # Keep the full-text index in step, in the same transaction
+    index_photos(conn, photo_table.c.relative_path.in_([row['relative_path'] for row in rows]))
+
+
+def upsert_contents(conn, rows):
+    """Inserts or refreshes PhotoContent rows (dicts with CONTENT_COLUMNS keys); call before upsert_photos."""
+    rows = list({row['file_hash']: row for row in rows if row['file_hash']}.values()) # One row per hash
+    if not rows:
+        return
+    stmt = _upsert_statement(conn.dialect.name, content_table, 'file_hash', CONTENT_COLUMNS)
+    if stmt is not None:
+        conn.execute(stmt, rows)
+        return
+    update_stmt = content_table.update().where(content_table.c.file_hash == bindparam('_file_hash'))
+    for row in rows:
+        values = {k: v for k, v in row.items() if k != 'file_hash'}
+        if conn.execute(update_stmt, {'_file_hash': row['file_hash'], **values}).rowcount == 0:
+            conn.execute(content_table.insert(), row)
+
+
+def find_content(conn, file_hash):
+    """Returns the PhotoContent row for a hash as a dict, or None if the content is new."""
+    row = conn.execute(content_table.select().where(content_table.c.file_hash == file_hash)).mappings().first()
+    return dict(row) if row else None
+
+
+def update_stat_signatures(conn, rows):
+    """Refreshes size/mtime/inode/device for unchanged photos in one executemany."""
+    params = [{'_relative_path': row['relative_path'], **{k: row[k] for k in STAT_COLUMNS}} for row in rows]
+    conn.execute(_stat_update_statement(), params)
+
+
+def update_metadata(conn, rows):
+    """Rewrites the metadata (and stat signature) of known photos and of their content rows in one executemany each."""
+    conn.execute(_stat_update_statement(), [
+        {'_relative_path': row['relative_path'], **{k: row[k] for k in METADATA_COLUMNS + STAT_COLUMNS}}
+        for row in rows
+    ])
+    contents = {row['file_hash']: row for row in rows if row['file_hash']} # One row per hash
+    if contents:
+        conn.execute(
+            content_table.update().where(content_table.c.file_hash == bindparam('_file_hash')),
+            [{'_file_hash': h, **{k: row[k] for k in CONTENT_METADATA_COLUMNS}} for h, row in contents.items()],
+        )
+    index_photos(conn, photo_table.c.relative_path.in_([row['relative_path'] for row in rows]))
+
+
+class PhotoBatchWriter:
+    """
+    Collects scan results as plain dicts and writes them to the photo table in batches.
+
+    Each batch is written in its own transaction, content rows before the
+    photo rows that reference them. If a batch fails, its rows are retried
+    one by one so a single bad row only costs that row instead of the whole
+    batch. Directories with a row that could not be written are not
+    checkpointed.
+    """
+
+    def __init__(self, engine, stats, batch_size=500, scan_session_id=None):
+        self.engine = engine
+        self.stats = stats
+        self.batch_size = batch_size
+        self.scan_session_id = scan_session_id
+        self._upserts = [] # (status, row, content row or None) for new/changed photos
+        self._stat_updates = [] # rows for unchanged photos
+        self._metadata_updates = [] # rows for unchanged photos whose metadata was re-read
+        self._done_dirs = [] # directories to checkpoint once their last rows are committed
+        self._failed_dirs = set() # directories with rows that could not be written
+
+    def __len__(self):
+        return len(self._upserts) + len(self._stat_updates) + len(self._metadata_updates)
+
+    def directory_done(self, path):
+        """Checkpoints a directory in the same transaction as its last queued photos."""
+        if self.scan_session_id is not None:
+            self._done_dirs.append({'session_id': self.scan_session_id, 'path': path})
+
+    def add(self, result):
+        """Queues one scan result; flushes when the batch is full."""
+        status = result['status']
+        if status == 'unchanged':
+            self._stat_updates.append({k: result[k] for k in ('relative_path',) + STAT_COLUMNS})
+        elif status == 'metadata':
+            columns = ('relative_path', 'file_hash', 'taken_at') + METADATA_COLUMNS + STAT_COLUMNS
+            self._metadata_updates.append({k: result.get(k) for k in columns})
+        else:
+            if result.get('duplicate'):
+                log.info(f"Found copy of known content: {result['relative_path']}")
+                self.stats.count(duplicates=1)
+            elif status == 'new':
+                log.info(f"Found new photo: {result['relative_path']}")
+            else:
+                log.warning(f"File changed, updating metadata for: {result['relative_path']}")
+            # Content already stored for known duplicates; otherwise written alongside the photo. Copies of
+            # content first seen in this scan carry its row, as they may be written before the first copy
+            if result.get('duplicate'):
+                content = result.get('content')
+            else:
+                content = {k: result.get(k) for k in CONTENT_COLUMNS}
+            self._upserts.append((status, {k: result.get(k) for k in UPSERT_COLUMNS}, content))
+        if len(self) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes all queued rows, one transaction per batch."""
+        upserts, stat_updates, done_dirs = self._upserts, self._stat_updates, self._checkpointable(self._done_dirs)
+        metadata_updates = self._metadata_updates
+        self._upserts, self._stat_updates, self._metadata_updates, self._done_dirs = [], [], [], []
+        if not upserts and not stat_updates and not metadata_updates and not done_dirs:
+            return
+        written = len(upserts) + len(stat_updates) + len(metadata_updates)
+        start = time.perf_counter()
+        try:
+            with self.engine.begin() as conn:
+                if upserts:
+                    upsert_contents(conn, [content for _, _, content in upserts if content])
+                    upsert_photos(conn, [row for _, row, _ in upserts])
+                if stat_updates:
+                    update_stat_signatures(conn, stat_updates)
+                if metadata_updates:
+                    update_metadata(conn, metadata_updates)
+                if done_dirs:
+                    conn.execute(ScanDirectory.__table__.insert(), done_dirs)
+        except Exception as e:
+            log.error(f"Batch write of {written} photos failed, retrying row by row: {e}")
+            self._write_rows_individually(upserts, stat_updates, metadata_updates)
+            done_dirs = self._checkpointable(done_dirs)
+            if done_dirs:
+                try:
+                    with self.engine.begin() as conn:
+                        conn.execute(ScanDirectory.__table__.insert(), done_dirs)
+                except Exception as e: # Only costs a rescan of these directories on resume
+                    log.error(f"Failed to checkpoint {len(done_dirs)} scanned directories: {e}")
+            return
+        self.stats.observe_stage('db_write', time.perf_counter() - start)
+        for status, _, _ in upserts:
+            self._count(status)
+        self.stats.count(skipped=len(stat_updates), updated=len(metadata_updates))
+        if written:
+            log.info(f"Committed batch of {written} photos.")
+
+    def _checkpointable(self, done_dirs):
+        return [d for d in done_dirs if d['path'] not in self._failed_dirs]
+
+    def _failed(self, row):
+        self.stats.count(errors=1)
+        self._failed_dirs.add(file_directory(row['relative_path']))
+
+    def _write_rows_individually(self, upserts, stat_updates, metadata_updates=()):
+        for status, row, content in upserts:
+            try:
+                with self.engine.begin() as conn:
+                    if content:
+                        upsert_contents(conn, [content])
+                    upsert_photos(conn, [row])
+                self._count(status)
+            except Exception as e:
+                log.error(f"Failed to write photo {row['relative_path']}: {e}")
+                self._failed(row)
+        for row in stat_updates:
+            try:
+                with self.engine.begin() as conn:
+                    update_stat_signatures(conn, [row])
+                self.stats.count(skipped=1)
+            except Exception as e:
+                log.error(f"Failed to update photo {row['relative_path']}: {e}")
+                self._failed(row)
+        for row in metadata_updates:
+            try:
+                with self.engine.begin() as conn:
+                    update_metadata(conn, [row])
+                self.stats.count(updated=1)
+            except Exception as e:
+                log.error(f"Failed to update metadata of photo {row['relative_path']}: {e}")
+                self._failed(row)
+
+    def _count(self, status):
+        if status == 'new':
+            self.stats.count(added=1)
+        else:
+            self.stats.count(updated=1)
+
+
+def subtree_clause(directory):
+    """Matches rows below a directory with an index-friendly range ('/' + 1 == '0') instead of LIKE."""
+    column = photo_table.c.relative_path
+    return (column > directory + '/') & (column < directory + '0')
+
+
+def move_photos(conn, src, dst, is_directory=False):
+    """
+    Renames Photo rows after a file or directory move, without touching hashes or thumbnails.
+
+    Any rows already stored at the destination are replaced. Returns the number of rows moved.
+    """
+    column = photo_table.c.relative_path
+    if not is_directory:
+        if conn.execute(select(photo_table.c.id).where(column == src)).first() is None:
+            return 0 # Nothing stored at src (e.g. already moved with its parent directory)
+        unindex_photos(conn, column == dst)
+        conn.execute(photo_table.delete().where(column == dst))
+        moved = conn.execute(
+            photo_table.update().where(column == src)
+            .values(relative_path=dst, filename=posixpath.basename(dst), extension=file_extension(dst),
+                    directory=file_directory(dst))
+        ).rowcount
+        index_photos(conn, column == dst)
+        return moved
+    unindex_photos(conn, subtree_clause(dst))
+    conn.execute(photo_table.delete().where(subtree_clause(dst)))
+    moved = conn.execute(
+        photo_table.update().where(subtree_clause(src))
+        .values(relative_path=literal(dst).concat(func.substr(column, len(src) + 1)),
+                directory=literal(dst).concat(func.substr(photo_table.c.directory, len(src) + 1)))
+    ).rowcount
+    index_photos(conn, subtree_clause(dst))
+    return moved
+
+
+def delete_photos(conn, relative_path, is_directory=False):
+    """Deletes the Photo row of a removed file, or all rows below a removed directory."""
+    column = photo_table.c.relative_path
+    clause = subtree_clause(relative_path) if is_directory else column == relative_path
+    unindex_photos(conn, clause)
+    return conn.execute(photo_table.delete().where(clause)).rowcount
+
+
+def filenames_in_directory(conn, directory):
+    """Returns the file names of the rows stored directly in `directory` ('' at the library root)."""
+    return set(conn.scalars(select(photo_table.c.filename).where(photo_table.c.directory == directory)))
+
+
+def stat_signatures_under(conn, paths):
+    """
+    Maps (filesize, mtime_ns, inode, device) to relative_path for rows at or below the given paths.
+
+    `paths` maps relative_path -> is_directory. Used to recognise renames that
+    were only observed as a delete plus a create.
+    """
+    column = photo_table.c.relative_path
+    signatures = {}
+    for path, is_directory in paths.items():
+        clause = subtree_clause(path) if is_directory else column == path
+        query = select(column, *(photo_table.c[name] for name in STAT_COLUMNS)).where(clause)
+        for row in conn.execute(query):
+            signatures[tuple(row[1:])] = row[0]
+    return signatures
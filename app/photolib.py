@@ -4,19 +4,44 @@ from flask import current_app
 import os
 import logging
 import hashlib
+import posixpath
+import queue
+import threading
+import functools
+import fnmatch
+import io
+import mmap
+import multiprocessing
+import struct
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait
 from datetime import datetime
 from flask import current_app
-from PIL import Image, ExifTags # Import ExifTags for orientation handling
+from sqlalchemy import create_engine, func, select
+from PIL import Image
 import exifread # For EXIF data
 from app import db
-from app.models import Photo
+from app.models import Photo, ScanSession, ScanDirectory, file_extension, file_directory
+from app.imagemeta import read_image_header
+from app.photodb import PhotoBatchWriter, find_content, subtree_clause, CONTENT_COLUMNS
+from app.database import writer_engine
+from app.thumbnails import thumbnail_settings, save_renditions, perceptual_hash, write_atomic, FALLBACK_FORMAT
+from app.duplicates import dhash_bands
+from app.thumbstore import get_thumbnail_store
+from app.metrics import (
+    scan_metrics_path, SCAN_REGISTRY, SCAN_STAGE_SECONDS, SCAN_FILES, SCAN_QUEUE_DEPTH, SCAN_FILES_PER_SECOND, SCAN_ETA_SECONDS,
+    SCAN_RUNNING, SCAN_UPDATED
+)
 
 # Configure logging if not already configured by Flask/app
 # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__) # Use app logger if available
 
-SUPPORTED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff'} # Pillow might need plugins for HEIC/HEIF
-THUMBNAIL_SIZE = (400, 400) # Target thumbnail size (width, height)
+# Thumbnailed from their embedded JPEG previews (see thumbengine.open_raw)
+RAW_EXTENSIONS = {'.dng', '.cr2', '.nef', '.nrw', '.arw', '.srw', '.pef', '.raf'}
+HEIF_EXTENSIONS = {'.heic', '.heif'} # Decoded by libvips or pillow-heif
+SUPPORTED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff'} | RAW_EXTENSIONS | HEIF_EXTENSIONS
 
 # --- Helper Functions ---
 
@@ -35,14 +60,36 @@ def calculate_hash(filepath):
         log.error(f"Error reading file for hashing {filepath}: {e}")
         return None
 
-def get_exif_data(filepath):
-    """Extracts EXIF data using exifread."""
+@contextmanager
+def read_photo_file(filepath):
+    """
+    Reads a file once and yields a seekable, file-like view of its bytes.
+
+    The view is an mmap where possible (a BytesIO for empty files), so the
+    hasher, the header reader and Pillow can all consume the same single
+    read, and readers that only need the header only fault in its pages.
+    """
+    with open(filepath, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty files cannot be mapped
+            buf = io.BytesIO(f.read())
+        try:
+            yield buf
+        finally:
+            buf.close()
+
+def get_exif_data(source):
+    """Extracts EXIF data using exifread from a path or an already-open file object."""
     try:
-        with open(filepath, 'rb') as f:
-            tags = exifread.process_file(f, stop_tag='JPEGThumbnail') # Don't need thumbnail data here
+        if hasattr(source, 'read'):
+            source.seek(0)
+            return exifread.process_file(source, stop_tag='JPEGThumbnail', details=False) # Don't need thumbnail data here
+        with open(source, 'rb') as f:
+            tags = exifread.process_file(f, stop_tag='JPEGThumbnail', details=False)
             return tags
     except Exception as e:
-        log.warning(f"Could not read EXIF data for {filepath}: {e}")
+        log.warning(f"Could not read EXIF data for {source}: {e}")
         return {}
 
 def get_timestamp_from_exif(exif_data):
@@ -58,64 +105,704 @@ def get_timestamp_from_exif(exif_data):
                 log.warning(f"Could not parse timestamp from EXIF tag '{tag}' ({exif_data[tag]}): {e}")
     return None
 
-def generate_thumbnail(source_path, photo_hash):
-    """Generates a thumbnail for the image and saves it."""
-    thumbnail_dir = current_app.config['THUMBNAIL_DIR']
-    # Use hash to create a unique filename, potentially nested
-    # Example: /path/to/thumbnails/ab/cd/abcdef123...jpg
-    hash_prefix = photo_hash[:2]
-    hash_suffix = photo_hash[2:4]
-    thumb_subdir = os.path.join(thumbnail_dir, hash_prefix, hash_suffix)
-    os.makedirs(thumb_subdir, exist_ok=True)
-    thumb_filename = f"{photo_hash}.jpg" # Always save thumbs as JPG?
-    thumb_path = os.path.join(thumb_subdir, thumb_filename)
-
-    if os.path.exists(thumb_path):
-        # log.debug(f"Thumbnail already exists for {photo_hash}")
-        return True # Assume success if it exists
+# exifread tag -> structured Photo column; everything else is kept in Photo.exif_data
+EXIF_TEXT_COLUMNS = {
+    'Image Make': 'camera_make',
+    'Image Model': 'camera_model',
+    'EXIF LensModel': 'lens_model',
+}
+EXIF_NUMBER_COLUMNS = {
+    'EXIF FocalLength': 'focal_length',
+    'EXIF ExposureTime': 'exposure_time',
+    'EXIF FNumber': 'f_number',
+    'EXIF ISOSpeedRatings': 'iso',
+    'Image Orientation': 'orientation',
+}
+EXIF_INTEGER_COLUMNS = {'iso', 'orientation'}
+EXIF_GPS_TAGS = {'GPS GPSLatitude', 'GPS GPSLatitudeRef', 'GPS GPSLongitude', 'GPS GPSLongitudeRef'}
+EXIF_SKIPPED_TAGS = {'JPEGThumbnail', 'Image ExifOffset', 'Image GPSInfo', 'EXIF InteroperabilityOffset'} # IFD pointers
+EXIF_MAX_VALUE_LENGTH = 256 # Longer values (binary blobs, large arrays) are not worth storing
 
+def _exif_number(tag):
+    """Returns the first value of a numeric exifread tag as a float, or None."""
     try:
-        with Image.open(source_path) as img:
-            # Handle image orientation based on EXIF data
-            try:
-                for orientation in ExifTags.TAGS.keys():
-                    if ExifTags.TAGS[orientation] == 'Orientation':
-                        break
-                exif = dict(img._getexif().items())
-
-                if exif[orientation] == 3:
-                    img = img.rotate(180, expand=True)
-                elif exif[orientation] == 6:
-                    img = img.rotate(270, expand=True)
-                elif exif[orientation] == 8:
-                    img = img.rotate(90, expand=True)
-            except (AttributeError, KeyError, IndexError):
-                # Cases: image doesn't have getexif or orientation tag
-                pass
-
-            img.thumbnail(THUMBNAIL_SIZE)
-            # Ensure conversion to RGB before saving as JPEG
-            if img.mode in ("RGBA", "P"):
-                 img = img.convert("RGB")
-            img.save(thumb_path, "JPEG", quality=85) # Save with reasonable quality
-            log.info(f"Generated thumbnail for {photo_hash} at {thumb_path}")
-            return True
+        value = tag.values[0] if isinstance(tag.values, (list, tuple)) else tag.values
+        value = float(value)
+    except (TypeError, ValueError, IndexError, ZeroDivisionError):
+        return None
+    return value if value == value else None # Drop NaN from 0/0 ratios
+
+def _gps_coordinate(exif_data, tag, ref_tag, negative_ref):
+    """Converts an exifread degrees/minutes/seconds GPS tag to signed decimal degrees."""
+    if tag not in exif_data:
+        return None
+    try:
+        degrees, minutes, seconds = (float(v) for v in exif_data[tag].values[:3])
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    value = degrees + minutes / 60 + seconds / 3600
+    if str(exif_data.get(ref_tag, '')).strip().upper() == negative_ref:
+        value = -value
+    return round(value, 7)
+
+def normalize_exif(exif_data):
+    """
+    Splits exifread tags into structured Photo column values and a JSON-ready dict of the rest.
+
+    Returns a dict with the camera/lens/exposure/GPS/orientation columns
+    (None where the tag is missing) and 'exif_data', which maps the remaining
+    tag names to their printable values.
+    """
+    columns = {name: None for name in EXIF_TEXT_COLUMNS.values()}
+    columns.update({name: None for name in EXIF_NUMBER_COLUMNS.values()})
+    rest = {}
+    for name, tag in exif_data.items():
+        if name in EXIF_TEXT_COLUMNS:
+            value = str(tag).strip().strip('\x00').strip()
+            columns[EXIF_TEXT_COLUMNS[name]] = value[:128] or None
+        elif name in EXIF_NUMBER_COLUMNS:
+            value = _exif_number(tag)
+            column = EXIF_NUMBER_COLUMNS[name]
+            columns[column] = int(value) if value is not None and column in EXIF_INTEGER_COLUMNS else value
+        elif name in EXIF_GPS_TAGS or name in EXIF_SKIPPED_TAGS or name.startswith('Thumbnail '):
+            continue
+        else:
+            value = str(tag).strip()
+            if value and len(value) <= EXIF_MAX_VALUE_LENGTH:
+                rest[name] = value
+    columns['gps_latitude'] = _gps_coordinate(exif_data, 'GPS GPSLatitude', 'GPS GPSLatitudeRef', 'S')
+    columns['gps_longitude'] = _gps_coordinate(exif_data, 'GPS GPSLongitude', 'GPS GPSLongitudeRef', 'W')
+    columns['exif_data'] = rest
+    return columns
+
+def extract_metadata(buf, relative_path):
+    """
+    Reads a photo's dimensions and EXIF tags from its bytes; returns (width, height, tags).
+
+    JPEG, PNG, TIFF, TIFF-based RAW, RAF and HEIF are parsed from their
+    headers in one pass (see imagemeta), without Pillow or exifread. Other
+    formats, and headers the fast reader cannot make sense of, fall back to
+    exifread and Pillow.
+    """
+    tags = None
+    try:
+        header = read_image_header(buf)
+        if header is not None:
+            _, width, height, tags = header
+            if width and height:
+                return width, height, tags
+    except (struct.error, ValueError, IndexError) as e:
+        log.debug(f"Fast header read failed for {relative_path}, falling back to exifread/Pillow: {e}")
+    if tags is None:
+        tags = get_exif_data(buf) or {}
+    width, height = None, None
+    try:
+        buf.seek(0)
+        with Image.open(buf) as img: # Only parses the header
+            width, height = img.size
+    except Exception as img_err:
+        log.warning(f"Could not get dimensions for {relative_path} via Pillow: {img_err}")
+    return width, height, tags
+
+def _metadata_columns(buf, st, relative_path):
+    """Returns the metadata column values of a file: dimensions, timestamps and normalized EXIF."""
+    width, height, tags = extract_metadata(buf, relative_path)
+    timestamp = get_timestamp_from_exif(tags) if tags else None
+    columns = normalize_exif(tags)
+    columns.update(width=width, height=height, taken_at=timestamp)
+
+    # Fallback timestamp to file modification time if EXIF fails
+    if not timestamp:
+        try:
+            timestamp = datetime.fromtimestamp(st.st_mtime)
+            log.debug(f"Using file modification time for {relative_path}")
+        except Exception as time_err:
+            log.warning(f"Could not get file modification time for {relative_path}: {time_err}")
+            timestamp = datetime.utcnow() # Fallback to now
+    columns['timestamp'] = timestamp
+    return columns
+
+def generate_thumbnail(source_path, photo_hash, settings=None, source=None):
+    """
+    Generates the base-size thumbnail renditions for the image and saves them.
+
+    If `source` is a file object with the image's bytes, it is decoded instead
+    of opening the file again. Larger and smaller sizes are generated on
+    demand by the thumbnail route.
+
+    Returns the photo's perceptual hash, computed from the downscaled
+    thumbnail (or the stored one if it already exists), or None on failure.
+    """
+    # Scan worker processes have no app context, so they pass the settings in
+    settings = settings or thumbnail_settings(current_app.config)
+    base_size = settings['base_size']
+    store = get_thumbnail_store(settings)
+
+    try:
+        if all(store.exists(photo_hash, base_size, fmt) for fmt in settings['formats']):
+            # log.debug(f"Thumbnail already exists for {photo_hash}")
+            with Image.open(io.BytesIO(store.read(photo_hash, base_size, FALLBACK_FORMAT))) as existing:
+                return perceptual_hash(existing)
+        return save_renditions(source if source is not None else source_path, photo_hash, settings, base_size)
     except Exception as e:
         log.error(f"Failed to generate thumbnail for {source_path} (hash: {photo_hash}): {e}")
-        # Clean up potentially corrupted file?
-        if os.path.exists(thumb_path):
+        return None
+
+# --- Per-File Processing (runs in scan worker processes) ---
+
+def stat_signature(st):
+    """Returns the (size, mtime_ns, inode, device) tuple used to detect unchanged files."""
+    return (st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev)
+
+_content_engines = {} # database URL -> engine, per worker process
+CLAIM_WAIT_SECONDS = 120 # How long a copy waits for the file that claimed its content
+CLAIM_POLL_INTERVAL = 0.01
+
+def _lookup_content(database_url, file_hash):
+    """Looks up already-processed content from a scan worker, over the worker's own read connection."""
+    engine = _content_engines.get(database_url)
+    if engine is None:
+        engine = _content_engines[database_url] = create_engine(database_url)
+    with engine.connect() as conn:
+        return find_content(conn, file_hash)
+
+def _claim_content(claims, file_hash, relative_path):
+    """
+    Claims a content hash for this scan run, or waits for the copy that claimed it first.
+
+    `claims` is the run's shared dict: hash -> relative path of the file
+    being processed for it, replaced by its content row once done. Returns
+    (content row, claimed): the row if another copy has processed the content,
+    else None and whether this file now holds the claim. Without the row the
+    file must be processed: it is the first copy, the first copy failed, or
+    it took longer than CLAIM_WAIT_SECONDS.
+    """
+    deadline = time.monotonic() + CLAIM_WAIT_SECONDS
+    while True:
+        owner = claims.setdefault(file_hash, relative_path)
+        if owner == relative_path:
+            return None, True
+        if isinstance(owner, dict):
+            return owner, False
+        if time.monotonic() > deadline:
+            log.warning(f"Gave up waiting for {owner} to process the content of {relative_path}")
+            return None, False
+        time.sleep(CLAIM_POLL_INTERVAL)
+
+class _StageTimer:
+    """Accumulates the wall time between successive lap() calls under stage names."""
+
+    def __init__(self):
+        self.timings = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - self._last
+        self._last = now
+
+def process_photo_file(full_path, relative_path, thumb_settings, existing_hash=None, refresh_metadata=False,
+                       database_url=None, claims=None):
+    """
+    Hashes a file, extracts its metadata and generates its thumbnail.
+
+    Runs inside scan worker processes, so it must not touch the Flask-SQLAlchemy
+    session or current_app. Returns a dict of Photo column values; 'status' is
+    one of 'new', 'changed', 'unchanged' (same hash, only the stat signature
+    moved) or 'error'. With refresh_metadata, metadata is re-extracted even if
+    the content is unchanged (rows stored before structured EXIF existed).
+
+    If `database_url` is given, the hash is looked up in photo_content right
+    after hashing; for known content the stored metadata is reused and EXIF
+    parsing and thumbnailing are skipped ('duplicate' is set in the result).
+    `claims` (see _claim_content) does the same for copies of content first
+    seen in the current scan; their result carries the content row in
+    'content', since it may reach the writer before the first copy's.
+
+    'timings' maps each stage the file went through (hash, content_lookup,
+    metadata, thumbnail) to its duration in seconds.
+    """
+    result = {'relative_path': relative_path}
+    timer = _StageTimer()
+    result['timings'] = timer.timings
+    claimed = None # Hash this call must publish (or release) in `claims`
+    try:
+        st = os.stat(full_path)
+        result.update(filesize=st.st_size, mtime_ns=st.st_mtime_ns, inode=st.st_ino, device=st.st_dev)
+        if not st.st_size:
+            log.warning(f"Skipping empty file: {relative_path}")
+            result['status'] = 'error'
+            return result
+
+        # Read the file once; the hasher, the metadata reader and Pillow all work from this buffer
+        with read_photo_file(full_path) as buf:
+            # 1. Calculate file hash
+            current_hash = hashlib.sha256(buf).hexdigest()
+            result['file_hash'] = current_hash
+            timer.lap('hash') # Includes reading the file
+
+            # 2. Content unchanged (e.g. touched or restored from backup), only the stat signature needs refreshing
+            if existing_hash == current_hash and not refresh_metadata:
+                result['status'] = 'unchanged'
+                return result
+            result['status'] = 'changed' if existing_hash else 'new'
+            result.update(filename=os.path.basename(full_path), extension=file_extension(relative_path),
+                          directory=file_directory(relative_path))
+
+            # 3. Same bytes already processed at another path: reuse its metadata and thumbnails
+            content = None
+            if database_url and not refresh_metadata:
+                content = _lookup_content(database_url, current_hash)
+                timer.lap('content_lookup')
+            if content is None and claims is not None and not refresh_metadata:
+                content, owns_claim = _claim_content(claims, current_hash, relative_path)
+                if owns_claim:
+                    claimed = current_hash
+                elif content is not None:
+                    result['content'] = content
+                timer.lap('content_claim') # Includes waiting for the first copy
+            if content is not None:
+                result.update(content, duplicate=True, filesize=st.st_size)
+                result.update(dhash_bands(content['dhash']))
+                result['timestamp'] = content['taken_at'] or datetime.fromtimestamp(st.st_mtime)
+                return result
+
+            # 4. Extract metadata from the file header
+            result.update(_metadata_columns(buf, st, relative_path))
+            timer.lap('metadata')
+
+            # 5. Generate Thumbnail from the same buffer
+            buf.seek(0)
+            result['dhash'] = generate_thumbnail(full_path, current_hash, thumb_settings, source=buf)
+            result['thumbnail_generated'] = result['dhash'] is not None
+            result.update(dhash_bands(result['dhash']))
+            timer.lap('thumbnail') # Decoding, downscaling and encoding
+            if claimed:
+                claims[claimed] = {k: result.get(k) for k in CONTENT_COLUMNS}
+                claimed = None
+    except Exception as e:
+        log.error(f"Error processing file {relative_path}: {e}", exc_info=True)
+        result['status'] = 'error'
+    finally:
+        if claimed:
+            claims.pop(claimed, None) # Failed: the next copy claims the content instead
+    return result
+
+def read_photo_metadata(full_path, relative_path, file_hash):
+    """
+    Re-reads the metadata of a file whose content is known (`file_hash`), for metadata-only scans.
+
+    Nothing is hashed or thumbnailed, and for JPEG, PNG and TIFF only the
+    header pages of the file are read. Runs in scan worker processes like
+    process_photo_file; 'status' is 'metadata' or 'error'.
+    """
+    result = {'relative_path': relative_path, 'file_hash': file_hash}
+    timer = _StageTimer()
+    result['timings'] = timer.timings
+    try:
+        st = os.stat(full_path)
+        result.update(filesize=st.st_size, mtime_ns=st.st_mtime_ns, inode=st.st_ino, device=st.st_dev)
+        if not st.st_size:
+            raise ValueError("file is empty")
+        with read_photo_file(full_path) as buf:
+            result.update(_metadata_columns(buf, st, relative_path))
+        result['status'] = 'metadata'
+    except Exception as e:
+        log.error(f"Error reading metadata of {relative_path}: {e}", exc_info=True)
+        result['status'] = 'error'
+    timer.lap('metadata')
+    return result
+
+# --- Scan Pipeline Stages ---
+
+class ScanStats:
+    """Counters shared by the scan pipeline stages."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.added = 0
+        self.updated = 0 # Photos whose content changed, or whose metadata a metadata-only scan re-read
+        self.skipped = 0
+        self.errors = 0
+        self.duplicates = 0 # New paths whose content was already known (counted in added/updated too)
+        self.discovered = 0 # Files the walker produced
+        self.missing = 0 # Stored photos no longer found (or now excluded) in the walked directories
+        self.processed = 0 # Files skipped, failed or received back from a worker
+        self.stage_seconds = {} # Stage name -> total seconds, summed over all workers
+
+    def count(self, **increments):
+        """Adds to counters, e.g. count(skipped=1, processed=1); the dispatcher and writer threads share some."""
+        with self._lock:
+            for name, n in increments.items():
+                setattr(self, name, getattr(self, name) + n)
+
+    def observe_stage(self, stage, seconds):
+        """Records one file's (or batch's) time in a scan stage."""
+        with self._lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        SCAN_STAGE_SECONDS.observe(seconds, stage=stage)
+
+class PathFilter:
+    """
+    Include/exclude glob patterns for library paths (SCAN_INCLUDE, SCAN_EXCLUDE).
+
+    A pattern without a '/' matches file and directory names ('@eaDir',
+    '*.tmp.jpg'); one with a '/' matches paths relative to the library
+    ('2019/raw/*', where '*' also matches '/'). Excluded directories are not
+    descended into. Include patterns only select files; with none, every
+    supported file is included.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = list(include)
+        self.exclude = list(exclude)
+
+    @staticmethod
+    def _matches(patterns, relative_path):
+        name = posixpath.basename(relative_path)
+        return any(fnmatch.fnmatch(relative_path if '/' in pattern else name, pattern) for pattern in patterns)
+
+    def allows_dir(self, relative_dir):
+        return not self._matches(self.exclude, relative_dir)
+
+    def allows_file(self, relative_path):
+        if os.path.splitext(relative_path)[1].lower() not in SUPPORTED_EXTENSIONS:
+            return False
+        if self.include and not self._matches(self.include, relative_path):
+            return False
+        return not self._matches(self.exclude, relative_path)
+
+    def allows_path(self, relative_path):
+        """Checks a file and each of its parent directories, for paths that were not found by walking."""
+        parts = relative_path.split('/')
+        return (all(self.allows_dir('/'.join(parts[:i])) for i in range(1, len(parts)))
+                and self.allows_file(relative_path))
+
+def scan_path_filter(include=None, exclude=None):
+    """Returns the PathFilter of SCAN_INCLUDE/SCAN_EXCLUDE, with either list replaced if given."""
+    config = current_app.config
+    return PathFilter(config.get('SCAN_INCLUDE') or () if include is None else include,
+                      config.get('SCAN_EXCLUDE') or () if exclude is None else exclude)
+
+def _posix_join(directory, name):
+    return f"{directory}/{name}" if directory else name
+
+def _list_directory(photo_library_path, rel_dir, path_filter):
+    """
+    Lists one library directory with os.scandir.
+
+    Returns (files, subdirs): (name, DirEntry) of the included files and the
+    included subdirectory names, both sorted by name. Symlinked directories
+    are not followed, as with os.walk.
+    """
+    files, subdirs = [], []
+    with os.scandir(os.path.join(photo_library_path, rel_dir)) as entries:
+        for entry in entries:
+            relative_path = _posix_join(rel_dir, entry.name)
             try:
-                os.remove(thumb_path)
+                if entry.is_dir(follow_symlinks=False):
+                    if path_filter.allows_dir(relative_path):
+                        subdirs.append(entry.name)
+                elif not entry.is_dir() and path_filter.allows_file(relative_path):
+                    files.append((entry.name, entry))
             except OSError:
-                pass
-        return False
+                continue # Vanished while listing
+    files.sort(key=lambda item: item[0])
+    subdirs.sort()
+    return files, subdirs
+
+def _stored_photos(directory):
+    """Returns the stored rows (see _existing_photo_select) of the photos directly in a directory."""
+    with db.engine.connect() as conn:
+        rows = conn.execute(_existing_photo_select().where(Photo.directory == directory)).all()
+    return sorted(rows, key=lambda row: row.relative_path) # In Python: the DB collation may differ
+
+def _walk_library(app, photo_library_path, path_queue, stats, finished_dirs=frozenset(), start_dir='',
+                  path_filter=None):
+    """
+    Walker stage: feeds the library's files, one directory at a time, into a bounded queue.
+
+    Each directory is listed with os.scandir and merged, in sorted order,
+    with the photos stored for it (an indexed query on Photo.directory), so
+    memory stays proportional to the largest directory rather than the
+    library. Items are (full_path, relative_path, stored, signature):
+    `stored` is (file_hash, stat signature, needs_metadata) for known files,
+    whose current stat signature is read through the DirEntry, else None.
+
+    After the files of each directory it emits (None, relative_dir, None, None)
+    so the dispatcher can checkpoint the directory once all of them are
+    written. Files in `finished_dirs` (from a resumed scan) are skipped;
+    their subdirectories are still walked. Walking starts at `start_dir`.
+    """
+    path_filter = path_filter or PathFilter()
+    try:
+        with app.app_context():
+            stack = [start_dir]
+            while stack:
+                rel_dir = stack.pop()
+                try:
+                    files, subdirs = _list_directory(photo_library_path, rel_dir, path_filter)
+                except OSError as e:
+                    log.error(f"Could not list directory {rel_dir or photo_library_path}: {e}")
+                    continue
+                stack.extend(_posix_join(rel_dir, name) for name in reversed(subdirs)) # Depth first, in name order
+                if rel_dir in finished_dirs:
+                    continue
+                stored = _stored_photos(rel_dir)
+                i = 0
+                for name, entry in files:
+                    relative_path = _posix_join(rel_dir, name)
+                    while i < len(stored) and stored[i].relative_path < relative_path:
+                        stats.missing += 1
+                        i += 1
+                    existing = signature = None
+                    if i < len(stored) and stored[i].relative_path == relative_path:
+                        row = stored[i]
+                        i += 1
+                        existing = (row.file_hash, (row.filesize, row.mtime_ns, row.inode, row.device),
+                                    row.needs_metadata)
+                        try:
+                            signature = stat_signature(entry.stat()) # Cached by the DirEntry
+                        except OSError:
+                            pass # Vanished; the dispatcher reports it
+                    path_queue.put((entry.path, relative_path, existing, signature)) # Blocks while the queue is full
+                stats.missing += len(stored) - i
+                path_queue.put((None, rel_dir, None, None))
+    except Exception as e:
+        log.error(f"Directory walk failed: {e}", exc_info=True)
+    finally:
+        path_queue.put(None) # Sentinel: walk finished
+
+class _DirectoryTracker:
+    """
+    Counts unwritten files per directory and queues a 'dir_done' marker once a walked directory drains.
+
+    A file's result is queued before its count is decremented, so the marker
+    always reaches the writer after every result of its directory. The
+    marker's 'failed' is set if any file of the directory failed, so the
+    directory is not checkpointed and a resumed scan tries it again.
+    """
+
+    def __init__(self, result_queue):
+        self.result_queue = result_queue
+        self.pending = {}
+        self.walked = set()
+        self.failed_dirs = set()
+        self.lock = threading.Lock()
+
+    def submitted(self, rel_dir):
+        with self.lock:
+            self.pending[rel_dir] = self.pending.get(rel_dir, 0) + 1
+
+    def failed(self, rel_dir):
+        """Records a file of the directory that failed before or while being processed."""
+        with self.lock:
+            self.failed_dirs.add(rel_dir)
+
+    def finished(self, rel_dir, failed=False):
+        with self.lock:
+            if failed:
+                self.failed_dirs.add(rel_dir)
+            self.pending[rel_dir] -= 1
+            done = self.pending[rel_dir] == 0 and rel_dir in self.walked
+            if done:
+                del self.pending[rel_dir]
+                self.walked.discard(rel_dir)
+        if done:
+            self._queue_done(rel_dir)
+
+    def walk_finished(self, rel_dir):
+        with self.lock:
+            done = not self.pending.get(rel_dir)
+            if done:
+                self.pending.pop(rel_dir, None)
+            else:
+                self.walked.add(rel_dir)
+        if done:
+            self._queue_done(rel_dir)
+
+    def _queue_done(self, rel_dir):
+        with self.lock:
+            failed = rel_dir in self.failed_dirs
+            self.failed_dirs.discard(rel_dir)
+        self.result_queue.put({'status': 'dir_done', 'relative_path': rel_dir, 'failed': failed})
+
+class _ScanProgress:
+    """
+    Reports the progress of a running pipeline every `interval` seconds.
+
+    Each report updates the scan metrics, writes them to `metrics_file` (for
+    the web app's /metrics endpoint) and passes a snapshot dict to `callback`:
+    elapsed, discovered, processed, total (an estimate until the walk is done,
+    None if unknown), files_per_sec, eta_seconds (None if unknown), the
+    ScanStats counters and 'queues' (files waiting for the dispatcher, being
+    processed by workers, and waiting for the writer).
+    """
+
+    def __init__(self, stats, expected_files, queue_depths, callback=None, metrics_file=None, interval=1.0):
+        self.stats = stats
+        self.expected_files = expected_files
+        self.queue_depths = queue_depths
+        self.callback = callback
+        self.metrics_file = metrics_file
+        self.interval = interval
+        self.walk_finished = False
+        self.started = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='scan-progress', daemon=True)
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread.start()
+
+    def stop(self):
+        """Stops the periodic reports and sends the final one."""
+        self._stop.set()
+        self._thread.join()
+        self.report(running=False)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report(running=True)
+
+    def snapshot(self):
+        stats = self.stats
+        elapsed = time.monotonic() - self.started
+        queues = self.queue_depths()
+        if self.walk_finished:
+            total = stats.discovered
+        elif self.expected_files:
+            total = max(self.expected_files, stats.discovered + queues['paths'])
+        else:
+            total = None # First scan of a library: unknown until the walk finishes
+        rate = stats.processed / elapsed if elapsed > 0 else 0.0
+        eta = max(total - stats.processed, 0) / rate if total is not None and rate > 0 else None
+        return {
+            'elapsed': elapsed,
+            'discovered': stats.discovered,
+            'processed': stats.processed,
+            'total': total,
+            'files_per_sec': rate,
+            'eta_seconds': eta,
+            'added': stats.added,
+            'updated': stats.updated,
+            'skipped': stats.skipped,
+            'errors': stats.errors,
+            'duplicates': stats.duplicates,
+            'queues': queues,
+        }
+
+    def report(self, running=True):
+        snapshot = self.snapshot()
+        for result in ('added', 'updated', 'skipped', 'errors', 'duplicates'):
+            SCAN_FILES.set(snapshot[result], result=result)
+        for name, depth in snapshot['queues'].items():
+            SCAN_QUEUE_DEPTH.set(depth, queue=name)
+        SCAN_FILES_PER_SECOND.set(round(snapshot['files_per_sec'], 3))
+        SCAN_ETA_SECONDS.set(round(snapshot['eta_seconds'], 1) if snapshot['eta_seconds'] is not None else -1)
+        SCAN_RUNNING.set(1 if running else 0)
+        SCAN_UPDATED.set(round(time.time(), 3))
+        if self.metrics_file:
+            try:
+                write_atomic(self.metrics_file, SCAN_REGISTRY.render().encode())
+            except OSError as e:
+                log.warning(f"Could not write scan metrics to {self.metrics_file}: {e}")
+                self.metrics_file = None # Don't repeat the warning every interval
+        if self.callback:
+            try:
+                self.callback(snapshot)
+            except Exception as e:
+                log.error(f"Scan progress callback failed: {e}")
+
+def _write_results(app, result_queue, in_flight, stats, batch_size, scan_session_id=None):
+    """
+    Writer stage: the only thread that touches the database while a scan runs.
+
+    Every file result taken from the queue releases its in_flight slot, and
+    the queue is drained up to the sentinel even after a failed write, so
+    the dispatcher never waits on a dead writer.
+    """
+    with app.app_context():
+        writer = PhotoBatchWriter(writer_engine(), stats, batch_size=batch_size, scan_session_id=scan_session_id)
+        while True:
+            result = result_queue.get()
+            if result is None:
+                break
+            try:
+                if result['status'] == 'dir_done':
+                    if result.get('failed'):
+                        log.info(f"Not checkpointing {result['relative_path'] or 'the library root'}: some files failed")
+                    else:
+                        writer.directory_done(result['relative_path'])
+                    continue
+                in_flight.release() # Let the dispatcher submit another file
+                stats.count(processed=1)
+                for stage, seconds in result.pop('timings', {}).items():
+                    stats.observe_stage(stage, seconds)
+                if result['status'] == 'error':
+                    stats.count(errors=1)
+                    continue
+                writer.add(result)
+            except Exception as e:
+                log.error(f"Writing scan results failed: {e}")
+        try:
+            writer.flush() # Final batch
+        except Exception as e:
+            log.error(f"Writing the final batch of scan results failed: {e}")
+
+def _scan_mp_context():
+    """Multiprocessing context for scan worker processes: a fork server (spawn where there is none, e.g. Windows)."""
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['app.photolib']) # Workers start with the scan code already imported
+    return context
+
+def scan_process_pool(workers):
+    """
+    Returns a process pool for process_photo_file and read_photo_metadata.
+
+    Scans run next to other threads (walker, writer, a job's heartbeat, the
+    library watcher), and a process forked from them can inherit a lock some
+    thread was holding and deadlock. Workers are therefore forked from a
+    clean, single-threaded fork server instead of from this process.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=_scan_mp_context())
 
 # --- Main Scanning Function ---
 
-def scan_photo_library():
+def scan_photo_library(verify=False, workers=None, resume=True, progress=None, metadata_only=False, path=None,
+                       include=None, exclude=None):
     """
     Scans the photo library directory, extracts metadata, generates thumbnails,
     and adds new photos to the database.
+
+    Files whose size, mtime, inode and device match the stored values are
+    skipped without hashing. Pass verify=True to hash every file regardless.
+
+    Progress is checkpointed per directory in a ScanSession. If a previous
+    scan of the same library (and verify mode) was interrupted, it is resumed
+    and directories it already finished are skipped, unless resume=False.
+
+    The scan is a pipeline: a walker thread feeds a bounded queue, a pool of
+    `workers` processes (default SCAN_WORKERS) hashes files, extracts metadata
+    and generates thumbnails, and a single writer thread commits the results.
+    At most SCAN_MAX_IN_FLIGHT files are between the dispatcher and the writer
+    at any time, so memory stays bounded however large the library is.
+
+    `progress`, if given, is called about every SCAN_PROGRESS_INTERVAL seconds
+    (and once at the end) with a snapshot dict; see _ScanProgress. Per-stage
+    timings are summed in the returned stats' stage_seconds.
+
+    With metadata_only=True, unchanged files are not skipped but have their
+    dimensions, timestamps and EXIF re-read from the file header (no hashing
+    or thumbnails), e.g. after the EXIF mapping changed. New and changed
+    files are processed as usual. Such a scan never resumes a checkpoint.
+
+    `path` (relative to the library) limits the scan to one subtree; it has
+    its own checkpoint (ValueError if it is not a library directory).
+    `include` and `exclude` replace the SCAN_INCLUDE and
+    SCAN_EXCLUDE glob lists; see PathFilter.
     """
     # Ensure paths are configured
     photo_library_path = current_app.config.get('PHOTO_LIBRARY_PATH')
@@ -138,146 +825,236 @@ def scan_photo_library():
     # thumbnail_dir base path is checked/created by generate_thumbnail's subdir creation logic
     # os.makedirs(thumbnail_dir, exist_ok=True)
 
-    log.info(f"Starting scan of photo library: {photo_library_path}")
-    added_count = 0
-    updated_count = 0 # Count photos whose metadata might be updated
-    skipped_count = 0
-    error_count = 0
-    commit_batch_size = 100 # Commit after processing this many new photos
+    path = library_subdirectory(path)
+    scan_root = os.path.join(photo_library_path, path) if path else photo_library_path
 
-    # Get existing photos (hash and path) for checking
-    # Consider fetching in batches if the DB is very large
-    existing_photos = {p.relative_path: p.file_hash for p in Photo.query.with_entities(Photo.relative_path, Photo.file_hash).all()}
-    log.info(f"Found {len(existing_photos)} existing photos in database.")
+    log.info(f"Starting scan of photo library: {scan_root}")
+    if verify:
+        log.info("Verify mode: hashing all files regardless of stat signature.")
 
-    processed_in_batch = 0
-    for root, _, files in os.walk(photo_library_path):
-        for filename in files:
-            file_ext = os.path.splitext(filename)[1].lower()
-            if file_ext not in SUPPORTED_EXTENSIONS:
-                continue # Skip unsupported files
+    if metadata_only:
+        log.info("Metadata-only mode: re-reading metadata of unchanged files.")
+        resume = False # A regular scan's checkpoint says nothing about which metadata was re-read
+    scan_session, finished_dirs = _start_scan_session(scan_root, verify, resume)
+    scan_session_id = scan_session.id
 
-            full_path = os.path.join(root, filename)
-            relative_path = os.path.relpath(full_path, photo_library_path).replace('\\', '/')
+    # Estimate for progress reporting: the files we know of outside directories a resumed scan already finished
+    known = db.session.query(func.count(Photo.id)).filter(
+        ~Photo.directory.in_(select(ScanDirectory.path).where(ScanDirectory.session_id == scan_session_id)))
+    if path:
+        known = known.filter(subtree_clause(path))
+    expected_files = known.scalar()
+    log.info(f"Found {expected_files} existing photos to check in database.")
 
-            try:
-                # 1. Calculate file hash
-                current_hash = calculate_hash(full_path)
-                if not current_hash:
-                    error_count += 1
-                    continue # Skip if hashing failed
-
-                # 2. Check if photo exists and if hash matches
-                existing_hash = existing_photos.get(relative_path)
-                if existing_hash:
-                    if existing_hash == current_hash:
-                        # log.debug(f"Skipping unchanged photo: {relative_path}")
-                        skipped_count += 1
-                        continue
-                    else:
-                        log.warning(f"File changed, updating metadata for: {relative_path}")
-                        # Find the existing Photo object to update
-                        photo = Photo.query.filter_by(relative_path=relative_path).first()
-                        if not photo: # Should not happen if existing_hash was found, but check anyway
-                           log.error(f"Consistency error: Hash found for {relative_path} but no DB record.")
-                           error_count += 1
-                           continue
-                        is_update = True
-                        updated_count += 1
-                else:
-                    log.info(f"Found new photo: {relative_path}")
-                    # Check if hash already exists (duplicate file elsewhere?)
-                    # duplicate = Photo.query.filter_by(file_hash=current_hash).first()
-                    # if duplicate:
-                    #     log.warning(f"Duplicate hash found for {relative_path} (matches {duplicate.relative_path}). Skipping add.")
-                    #     skipped_count += 1
-                    #     continue # Or link it somehow? For now, skip.
-                    photo = Photo(relative_path=relative_path)
-                    is_update = False
-                    added_count += 1
-
-                # 3. Extract Metadata
-                filesize = os.path.getsize(full_path)
-                width, height = None, None
-                timestamp = None
-                exif_text = ""
+    # Stored photos are loaded one directory at a time by the walker, never all at once
+    walk = functools.partial(_walk_library, current_app._get_current_object(), photo_library_path,
+                             finished_dirs=finished_dirs, start_dir=path,
+                             path_filter=scan_path_filter(include, exclude))
+    stats = _run_pipeline(walk, verify, workers, scan_session_id=scan_session_id,
+                          progress=progress, expected_files=expected_files, metadata_only=metadata_only)
 
-                try:
-                    with Image.open(full_path) as img:
-                        width, height = img.size
-                        # Try getting EXIF via Pillow first (might be faster/simpler for basic tags)
-                        exif_pillow = img.getexif()
-                        exif_data_dict = {ExifTags.TAGS[k]: v for k, v in exif_pillow.items() if k in ExifTags.TAGS}
-                        exif_text = str(exif_data_dict) # Simple string representation for now
-                        # Try getting timestamp from Pillow's EXIF interpretation
-                        # Example: timestamp = exif_data_dict.get('DateTimeOriginal') or exif_data_dict.get('DateTime')
-                        # If not found, fall back to exifread
-                except Exception as img_err:
-                     log.warning(f"Could not get dimensions/basic EXIF for {relative_path} via Pillow: {img_err}")
-
-                # Use exifread for more robust EXIF parsing, especially timestamp
-                exif_data_exifread = get_exif_data(full_path)
-                if exif_data_exifread:
-                    timestamp = get_timestamp_from_exif(exif_data_exifread)
-                    # Optionally merge/override exif_text
-                    # exif_text = str(exif_data_exifread) # Or a more structured format
-
-                # Fallback timestamp to file modification time if EXIF fails
-                if not timestamp:
-                    try:
-                        mtime = os.path.getmtime(full_path)
-                        timestamp = datetime.fromtimestamp(mtime)
-                        log.debug(f"Using file modification time for {relative_path}")
-                    except Exception as time_err:
-                        log.warning(f"Could not get file modification time for {relative_path}: {time_err}")
-                        timestamp = datetime.utcnow() # Fallback to now
-
-                # 4. Update Photo Object
-                photo.filename = filename
-                photo.file_hash = current_hash
-                photo.timestamp = timestamp
-                photo.width = width
-                photo.height = height
-                photo.filesize = filesize
-                photo.exif_data = exif_text # Store extracted EXIF
-                photo.thumbnail_generated = False # Reset on update, regenerate below
-
-                # 5. Generate Thumbnail
-                thumb_success = generate_thumbnail(full_path, current_hash)
-                if thumb_success:
-                    photo.thumbnail_generated = True
-
-                # 6. Add to session if new
-                if not is_update:
-                    db.session.add(photo)
-                    processed_in_batch += 1
-
-                # 7. Commit periodically
-                if processed_in_batch >= commit_batch_size:
-                    try:
-                        db.session.commit()
-                        log.info(f"Committed batch of {processed_in_batch} photos.")
-                        processed_in_batch = 0 # Reset batch counter
-                    except Exception as commit_err:
-                        log.error(f"Batch commit failed: {commit_err}")
-                        db.session.rollback()
-                        # Potentially stop the scan or handle differently
-                        error_count += processed_in_batch # Count these as errors for now
-                        processed_in_batch = 0
+    # Completed: the checkpoint is no longer needed
+    ScanDirectory.query.filter_by(session_id=scan_session_id).delete()
+    ScanSession.query.filter_by(id=scan_session_id).update({'status': 'completed', 'finished_at': datetime.utcnow()})
+    db.session.commit()
+    log.info(f"Scan complete. Added: {stats.added} ({stats.duplicates} duplicates), Updated: {stats.updated}, Skipped (Unchanged): {stats.skipped}, Errors: {stats.errors}")
+    if stats.missing:
+        log.info(f"{stats.missing} photos in the database were not found in the scanned directories.")
+    if stats.stage_seconds:
+        log.info("Time per stage (summed over workers): " +
+                 ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in stats.stage_seconds.items()))
+    return stats
 
-            except Exception as e:
-                log.error(f"Error processing file {relative_path}: {e}", exc_info=True) # Log traceback
-                error_count += 1
-                db.session.rollback() # Rollback potential partial add/update
+def library_subdirectory(path):
+    """Normalizes a directory path relative to the library ('' for the root); ValueError if there is no such directory."""
+    normalized = posixpath.normpath((path or '').replace('\\', '/')).strip('/')
+    normalized = '' if normalized == '.' else normalized
+    if (normalized == '..' or normalized.startswith('../')
+            or not os.path.isdir(os.path.join(current_app.config['PHOTO_LIBRARY_PATH'], normalized))):
+        raise ValueError(f"not a directory in the photo library: {path}")
+    return normalized
+
+def _start_scan_session(photo_library_path, verify, resume):
+    """Returns (session, finished directory set), resuming an interrupted session when possible."""
+    scan_session = None
+    if resume:
+        scan_session = ScanSession.query.filter_by(
+            library_path=photo_library_path, verify=verify, status='running'
+        ).order_by(ScanSession.id.desc()).first()
+    if scan_session is None:
+        scan_session = ScanSession(library_path=photo_library_path, verify=verify)
+        db.session.add(scan_session)
+        db.session.commit()
+        return scan_session, frozenset()
+
+    finished_dirs = frozenset(
+        d.path for d in ScanDirectory.query.with_entities(ScanDirectory.path).filter_by(session_id=scan_session.id)
+    )
+    log.info(f"Resuming interrupted scan {scan_session.id} from {scan_session.started_at}: "
+             f"{len(finished_dirs)} directories already finished.")
+    return scan_session, finished_dirs
+
+def _existing_photo_select():
+    """Selects what the dispatcher needs to decide whether a stored photo must be processed again."""
+    return select(
+        Photo.relative_path, Photo.file_hash, Photo.filesize,
+        Photo.mtime_ns, Photo.inode, Photo.device,
+        # Stored before structured EXIF or perceptual hashes existed
+        (Photo.exif_data.is_(None) | (Photo.dhash.is_(None) & Photo.thumbnail_generated)).label('needs_metadata'),
+    )
+
+def ingest_paths(relative_paths, workers=None, executor=None, progress=None):
+    """
+    Runs specific library files (paths relative to PHOTO_LIBRARY_PATH) through the scan pipeline.
+
+    Used by the library watcher so changed files get exactly the same treatment
+    as in scan_photo_library without walking the whole tree. Unsupported,
+    excluded (SCAN_INCLUDE/SCAN_EXCLUDE) or vanished files are ignored.
+    `progress` is called as in scan_photo_library.
+    """
+    photo_library_path = current_app.config['PHOTO_LIBRARY_PATH']
+    path_filter = scan_path_filter()
+    relative_paths = sorted({
+        p for p in relative_paths
+        if path_filter.allows_path(p) and os.path.isfile(os.path.join(photo_library_path, p))
+    })
+    existing_photos = {}
+    for i in range(0, len(relative_paths), 500):
+        chunk = relative_paths[i:i + 500]
+        for p in db.session.execute(_existing_photo_select().where(Photo.relative_path.in_(chunk))):
+            existing_photos[p.relative_path] = (p.file_hash, (p.filesize, p.mtime_ns, p.inode, p.device),
+                                                p.needs_metadata)
+
+    def feed(path_queue, stats):
+        for relative_path in relative_paths:
+            path_queue.put((os.path.join(photo_library_path, relative_path), relative_path,
+                            existing_photos.get(relative_path), None))
+        path_queue.put(None)
+
+    return _run_pipeline(feed, False, workers, executor, progress=progress, expected_files=len(relative_paths))
+
+def _run_pipeline(feed, verify, workers=None, executor=None, scan_session_id=None,
+                  progress=None, expected_files=0, metadata_only=False):
+    """
+    Runs the dispatcher and writer stages for files produced by `feed`.
+
+    `feed(path_queue, stats)` runs in its own thread, puts (full_path,
+    relative_path, stored, signature) items and finally None. `stored` is
+    (file_hash, stat signature, needs_metadata) for files already in the
+    database, else None; `signature` is the file's current stat signature if
+    the feed already has it. (None, relative_dir, None, None) marks the end
+    of a directory and is checkpointed under `scan_session_id`. If no
+    `executor` is passed, a process pool of `workers` is created for this
+    run. `progress` and `expected_files` (a total estimate)
+    drive progress reports and the scan metrics; see _ScanProgress. With
+    `metadata_only`, files with an unchanged stat signature are sent to
+    read_photo_metadata instead of being skipped.
+    """
+    thumb_settings = thumbnail_settings(current_app.config)
+    # Workers look up known content themselves; the resolved URL, since Flask-SQLAlchemy may rewrite relative paths
+    database_url = db.engine.url.render_as_string(hide_password=False)
+    workers = workers or current_app.config.get('SCAN_WORKERS') or os.cpu_count() or 1
+    max_in_flight = current_app.config.get('SCAN_MAX_IN_FLIGHT') or workers * 4
+    batch_size = current_app.config.get('SCAN_BATCH_SIZE') or 500 # Rows per upsert transaction
+    stats = ScanStats()
+    SCAN_REGISTRY.clear() # The scan metrics describe the current (or last) run
+    metrics_file = scan_metrics_path(current_app.config)
+    progress_interval = current_app.config.get('SCAN_PROGRESS_INTERVAL') or 1.0
+    # Release the reader's connection; from here on only the writer thread uses the database
+    db.session.remove()
+
+    path_queue = queue.Queue(maxsize=max_in_flight)
+    result_queue = queue.Queue()
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    # Content hashes claimed by workers in this run (see _claim_content), so copies are processed once
+    manager = _scan_mp_context().Manager()
+    claims = manager.dict()
+    own_executor = executor is None
+    if own_executor:
+        executor = scan_process_pool(workers)
+
+    walker = threading.Thread(target=feed, args=(path_queue, stats), name='scan-walker', daemon=True)
+    writer = threading.Thread(target=_write_results,
+                              args=(current_app._get_current_object(), result_queue, in_flight, stats, batch_size,
+                                    scan_session_id),
+                              name='scan-writer', daemon=True)
+    walker.start()
+    writer.start()
+
+    pending = set()
+    pending_lock = threading.Lock()
+    directories = _DirectoryTracker(result_queue) if scan_session_id else None
+
+    def queue_depths():
+        return {'paths': path_queue.qsize(), 'in_flight': len(pending), 'results': result_queue.qsize()}
+
+    reporter = _ScanProgress(stats, expected_files, queue_depths, progress, metrics_file, progress_interval)
+    reporter.start()
+
+    def on_done(future, relative_path):
+        try:
+            result = future.result()
+        except Exception as e:
+            log.error(f"Worker failed on {relative_path}: {e}")
+            result = {'relative_path': relative_path, 'status': 'error'}
+        result_queue.put(result)
+        if directories:
+            directories.finished(posixpath.dirname(relative_path), failed=result['status'] == 'error')
+        with pending_lock:
+            pending.discard(future)
 
-    # Final commit for any remaining items in the last batch
     try:
-        if processed_in_batch > 0:
-            db.session.commit()
-            log.info(f"Committed final batch of {processed_in_batch} photos.")
-    except Exception as e:
-        log.error(f"Final commit failed: {e}")
-        db.session.rollback()
-        error_count += processed_in_batch
+        while True:
+            item = path_queue.get()
+            if item is None:
+                reporter.walk_finished = True
+                break
+            full_path, relative_path, stored, signature = item
+            if full_path is None: # End of a directory
+                if directories:
+                    directories.walk_finished(relative_path)
+                continue
+            stats.discovered += 1
+            task = None
+            try:
+                existing_hash, existing_signature, needs_metadata = stored or (None, None, False)
+                if existing_hash and not verify and not needs_metadata:
+                    if signature is None: # Not read by the feed (or the file vanished since)
+                        start = time.perf_counter()
+                        signature = stat_signature(os.stat(full_path))
+                        stats.observe_stage('stat', time.perf_counter() - start)
+                    if existing_signature == signature:
+                        if not metadata_only:
+                            stats.count(skipped=1, processed=1)
+                            continue
+                        task = (read_photo_metadata, full_path, relative_path, existing_hash)
+            except OSError as e:
+                log.error(f"Could not stat {relative_path}: {e}")
+                stats.count(errors=1, processed=1)
+                if directories:
+                    directories.failed(posixpath.dirname(relative_path))
+                continue
 
-    log.info(f"Scan complete. Added: {added_count}, Updated: {updated_count}, Skipped (Unchanged): {skipped_count}, Errors: {error_count}")
+            in_flight.acquire() # Backpressure: wait until the writer has caught up
+            if directories:
+                directories.submitted(posixpath.dirname(relative_path))
+            if task is None:
+                task = (process_photo_file, full_path, relative_path, thumb_settings, existing_hash,
+                        needs_metadata, database_url, claims)
+            future = executor.submit(*task)
+            with pending_lock:
+                pending.add(future)
+            future.add_done_callback(functools.partial(on_done, relative_path=relative_path))
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+        else:
+            with pending_lock:
+                outstanding = list(pending)
+            wait(outstanding)
+        # Every result is now queued ahead of the sentinel
+        result_queue.put(None)
+        writer.join()
+        reporter.stop()
+        manager.shutdown()
+    return stats
@@ -0,0 +1,134 @@
+from datetime import datetime, date, timedelta
+from sqlalchemy import extract, func
+from app import db
+from app.models import Photo
+from app.photodb import subtree_clause
+from app.fulltext import match_clause
+
+# Facets returned by /api/search, each an aggregate query over a covering index
+FACETS = ('year', 'month', 'camera', 'extension')
+FACET_LIMIT = 50 # Most frequent values returned for camera/extension facets
+# Filters that JSON bodies (POST /export) may pass as a list of strings, or as integers
+LIST_FILTERS = {'ext'}
+INTEGER_FILTERS = {'min_width', 'max_width', 'min_height', 'max_height'}
+
+# Which facet a filter belongs to. A facet's counts ignore its own filters, so
+# a client can offer the other values of a facet that is already selected.
+FILTER_FACETS = {
+    'date': ('year', 'month'),
+    'camera': ('camera',),
+    'extension': ('extension',),
+}
+
+
+def _parse_datetime(value, end=False):
+    """Parses an ISO date or datetime; a bare end date includes that whole day."""
+    if len(value) == 10:
+        day = date.fromisoformat(value)
+        return datetime.combine(day + timedelta(days=1) if end else day, datetime.min.time())
+    return datetime.fromisoformat(value)
+
+
+def parse_search_filters(args):
+    """
+    Builds SQL filter clauses from search query parameters, grouped by filter name.
+
+    Supported parameters: q (words matched as prefixes against the full-text
+    index), start/end (ISO date or datetime, end exclusive unless a bare
+    date), camera_make, camera_model, ext (comma separated, e.g. "jpg,png"),
+    min_width/max_width/min_height/max_height and path (a directory
+    relative to the library). `args` may also be a parsed JSON object, where
+    ext can be a list of strings and the dimensions integers. Raises
+    ValueError on bad input, including values of other types.
+    """
+    filters = {}
+
+    def add(name, clause):
+        filters.setdefault(name, []).append(clause)
+
+    def value(name):
+        raw = args.get(name)
+        if raw is None or isinstance(raw, str):
+            return raw
+        if name in LIST_FILTERS and isinstance(raw, list) and all(isinstance(v, str) for v in raw):
+            return ','.join(raw)
+        if name in INTEGER_FILTERS and isinstance(raw, int) and not isinstance(raw, bool):
+            return str(raw)
+        raise ValueError(f"{name} must be a string")
+
+    if value('q'):
+        add('text', match_clause(db.engine.dialect.name, value('q')))
+    if value('start'):
+        add('date', Photo.timestamp >= _parse_datetime(value('start')))
+    if value('end'):
+        add('date', Photo.timestamp < _parse_datetime(value('end'), end=True))
+    if value('camera_make'):
+        add('camera', Photo.camera_make == value('camera_make'))
+    if value('camera_model'):
+        add('camera', Photo.camera_model == value('camera_model'))
+    if value('ext'):
+        extensions = {e.strip().lower().lstrip('.') for e in value('ext').split(',') if e.strip()}
+        add('extension', Photo.extension.in_(sorted(extensions)))
+    for param, clause in (
+        ('min_width', lambda v: Photo.width >= v),
+        ('max_width', lambda v: Photo.width <= v),
+        ('min_height', lambda v: Photo.height >= v),
+        ('max_height', lambda v: Photo.height <= v),
+    ):
+        if value(param):
+            add('dimensions', clause(int(value(param))))
+    if value('path'):
+        directory = value('path').replace('\\', '/').strip('/')
+        if directory:
+            add('path', subtree_clause(directory))
+    return filters
+
+
+def filter_clauses(filters, facet=None):
+    """Flattens parsed filters into a clause list, leaving out the filters of `facet`."""
+    return [
+        clause
+        for name, clauses in filters.items()
+        if facet is None or facet not in FILTER_FACETS.get(name, ())
+        for clause in clauses
+    ]
+
+
+def _base_query(filters, facet, *columns):
+    # The scanner always sets a timestamp; rows without one never appear in results either
+    return db.session.query(*columns).filter(Photo.timestamp.isnot(None), *filter_clauses(filters, facet))
+
+
+def get_facets(filters, names=FACETS):
+    """
+    Returns facet counts for the photos matching `filters`.
+
+    Year and month come from one GROUP BY over the timestamp index (the year
+    counts are summed from the months); camera and extension are grouped over
+    their own indexes and limited to the FACET_LIMIT most frequent values.
+    """
+    facets = {}
+    if 'year' in names or 'month' in names:
+        year = extract('year', Photo.timestamp).label('year')
+        month = extract('month', Photo.timestamp).label('month')
+        rows = _base_query(filters, 'month', year, month, func.count().label('count')) \
+            .group_by(year, month).order_by(year.desc(), month.desc()).all()
+        if 'month' in names:
+            facets['month'] = [{'year': int(r.year), 'month': int(r.month), 'count': r.count} for r in rows]
+        if 'year' in names:
+            years = {}
+            for r in rows:
+                years[int(r.year)] = years.get(int(r.year), 0) + r.count
+            facets['year'] = [{'value': y, 'count': c} for y, c in years.items()]
+    if 'camera' in names:
+        count = func.count().label('count')
+        rows = _base_query(filters, 'camera', Photo.camera_make, Photo.camera_model, count) \
+            .filter(Photo.camera_model.isnot(None)) \
+            .group_by(Photo.camera_make, Photo.camera_model).order_by(count.desc()).limit(FACET_LIMIT).all()
+        facets['camera'] = [{'make': r.camera_make, 'model': r.camera_model, 'count': r.count} for r in rows]
+    if 'extension' in names:
+        count = func.count().label('count')
+        rows = _base_query(filters, 'extension', Photo.extension, count) \
+            .group_by(Photo.extension).order_by(count.desc()).limit(FACET_LIMIT).all()
+        facets['extension'] = [{'value': r.extension, 'count': r.count} for r in rows]
+    return facets
@@ -0,0 +1,298 @@
+"""
+Thumbnail engines: decode a source image, downscale it and encode renditions.
+
+THUMBNAIL_BACKEND picks the engine: 'pillow', 'vips' (needs the optional
+pyvips package and libvips) or 'auto', which uses vips when it is installed.
+Both shrink JPEGs while decoding and apply the EXIF orientation to the
+downscaled image, so a large photo is never decoded or rotated at full size.
+
+RAW files are thumbnailed from the JPEG preview the camera embedded in them
+and HEIF files from their embedded thumbnail item when one is large enough.
+Only without such a preview is a RAW demosaiced (needs the optional rawpy)
+or a HEIF's full-size image decoded (libvips, or the optional pillow-heif).
+"""
+import io
+import os
+import mmap
+import struct
+import logging
+import threading
+from contextlib import contextmanager
+from PIL import Image, ExifTags
+
+from app.imagemeta import HEIF_BRANDS, raw_orientation, raw_previews
+
+try:
+    import pyvips
+except (ImportError, OSError): # Optional dependency; OSError when libvips itself is missing
+    pyvips = None
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener() # Image.open can then read HEIC too (e.g. the metadata fallback)
+except ImportError: # Optional dependency
+    pillow_heif = None
+
+try:
+    import rawpy
+except ImportError: # Optional dependency
+    rawpy = None
+
+log = logging.getLogger(__name__)
+
+# EXIF orientation -> transpose that displays the image upright (orientation 1 needs none)
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+RESAMPLE_FILTERS = ('nearest', 'box', 'bilinear', 'hamming', 'bicubic', 'lanczos') # THUMBNAIL_RESAMPLE values
+
+# Pillow image mode for a vips image with this many bands
+VIPS_BAND_MODES = {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}
+
+
+def prepare_image(img, size, resample='bicubic', orientation=None):
+    """
+    Downscales an opened (not yet loaded) image to fit `size` and applies its EXIF orientation.
+
+    Pass `orientation` if the image's own EXIF doesn't have the right one (1: leave as is).
+    """
+    # Let the JPEG decoder downscale in the DCT domain (1/2, 1/4 or 1/8) instead of decoding full size
+    img.draft('RGB', (size, size))
+    if orientation is None and img.format == 'TIFF':
+        orientation = 1 # Pillow 11+ transposes TIFFs when opening them (and reports the upright size)
+    elif orientation is None:
+        orientation = img.getexif().get(ExifTags.Base.Orientation) # Only parses IFD0
+    img.thumbnail((size, size), Image.Resampling[resample.upper()]) # The bounding box is square, so fit before rotating
+    transpose = ORIENTATION_TRANSPOSE.get(orientation)
+    return img.transpose(transpose) if transpose is not None else img
+
+
+def encode_image(img, fmt, quality=85):
+    """Encodes a prepared Pillow image in the given output format and returns the bytes."""
+    from app.thumbnails import THUMBNAIL_FORMATS # Imported here; app.thumbnails imports this module
+    pil_format = THUMBNAIL_FORMATS[fmt][0]
+    if fmt == 'jpeg' and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB') # Ensure conversion to RGB before saving as JPEG
+    elif img.mode not in ('RGB', 'RGBA', 'L'):
+        img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+    out = io.BytesIO()
+    img.save(out, pil_format, quality=quality)
+    return out.getvalue()
+
+
+@contextmanager
+def _source_data(source):
+    """The bytes of a source (path or file object) as a buffer; files are mapped, not read."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b'' # Can't mmap an empty file
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield data
+    elif isinstance(source, mmap.mmap):
+        yield source
+    elif isinstance(source, io.BytesIO):
+        with source.getbuffer() as data:
+            yield data
+    else:
+        source.seek(0)
+        yield source.read()
+
+
+def is_heif(source):
+    """Whether a source (path or file object) is a HEIF image (HEIC and similar)."""
+    with _source_data(source) as data:
+        return bytes(data[4:8]) == b'ftyp' and bytes(data[8:12]) in HEIF_BRANDS
+
+
+def decode_raw(source):
+    """Demosaics a RAW file at half resolution with rawpy (LibRaw); the result is oriented upright."""
+    if isinstance(source, (str, os.PathLike)):
+        raw = rawpy.imread(os.fspath(source))
+    else:
+        source.seek(0)
+        raw = rawpy.imread(io.BytesIO(source.read()))
+    with raw:
+        return Image.fromarray(raw.postprocess(half_size=True, use_camera_wb=True, output_bps=8))
+
+
+def open_raw(source, size):
+    """
+    Opens what to thumbnail a RAW file from; returns None if `source` isn't a RAW file.
+
+    Otherwise returns (image, orientation to apply). The image is the
+    smallest embedded JPEG preview that covers `size`, opened but not yet
+    decoded. Only if there is none is the RAW demosaiced, when rawpy is
+    installed and supports it; failing that, the largest preview is used.
+    """
+    with _source_data(source) as data:
+        try:
+            previews = raw_previews(data)
+        except (struct.error, ValueError) as e:
+            log.debug(f"Unreadable TIFF structure ({e}), decoding as a plain image")
+            previews = None
+        if previews is None:
+            return None
+        usable = [preview for preview in previews if max(preview[2], preview[3]) >= size]
+        if not usable and rawpy is not None:
+            try:
+                return decode_raw(source), 1
+            except rawpy.LibRawError as e:
+                log.debug(f"rawpy can't decode RAW file ({e}), using its largest preview")
+        if not previews:
+            return None # Let the engine try it as a plain TIFF
+        offset, length, _, _ = usable[0] if usable else previews[-1]
+        # Previews are stored unrotated, with the RAW's orientation. A copy: the mapping gets closed
+        return Image.open(io.BytesIO(bytes(data[offset:offset + length]))), raw_orientation(data)
+
+
+def heif_image(source, size):
+    """
+    Decodes a HEIF file's smallest embedded thumbnail that covers `size`, or else its primary image.
+
+    Needs pillow-heif. libheif applies the image's rotation and mirroring, so
+    the result is upright.
+    """
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+    heif = pillow_heif.open_heif(source, convert_hdr_to_8bit=True)
+    image = heif[heif.primary_index]
+    thumbnails = [(box, index) for index, box in enumerate(image.info.get('thumbnails', ())) if box >= size]
+    if thumbnails:
+        return image.get_thumbnail(min(thumbnails)[1]).to_pillow()
+    return image.to_pillow()
+
+
+class PillowThumbnailer:
+    """Decodes and resizes with Pillow; JPEGs are reduced by the decoder through Image.draft."""
+
+    kind = 'pillow'
+
+    def __init__(self, settings):
+        self.resample = settings.get('resample', 'bicubic')
+
+    def thumbnail(self, source, size):
+        """Returns `source` (a path or file object) downscaled to fit `size` and oriented upright."""
+        raw = open_raw(source, size)
+        if raw is not None:
+            img, orientation = raw
+        elif pillow_heif is not None and is_heif(source):
+            img, orientation = heif_image(source, size), 1
+        else:
+            img, orientation = Image.open(source), None # Orientation from the image's EXIF
+        with img:
+            prepared = prepare_image(img, size, self.resample, orientation)
+            return prepared.copy() if prepared is img else prepared # Closing `img` discards its pixels
+
+    def encode(self, image, fmt, quality):
+        return encode_image(image, fmt, quality)
+
+    def to_pillow(self, image):
+        return image
+
+
+class VipsThumbnailer:
+    """
+    Decodes and resizes with libvips, which streams the source instead of
+    decoding it whole and shrinks JPEG, WebP and HEIF while loading (HEIF
+    from an embedded thumbnail when it is large enough).
+
+    libvips always resamples with lanczos3 (THUMBNAIL_RESAMPLE is ignored).
+    Formats this libvips build can't write are encoded with Pillow.
+    """
+
+    kind = 'vips'
+    SUFFIXES = {'jpeg': '.jpg', 'webp': '.webp', 'avif': '.avif'}
+
+    def __init__(self, settings):
+        if pyvips is None:
+            raise ValueError("THUMBNAIL_BACKEND 'vips' needs the pyvips package and libvips")
+        # Don't copy EXIF and other metadata into thumbnails ('strip' became 'keep' in libvips 8.15)
+        self.save_options = {'keep': 'none'} if pyvips.at_least_libvips(8, 15) else {'strip': True}
+        # AVIF at Pillow's default encoder speed (6); libvips' default effort is several times slower
+        self.format_options = {'avif': {'effort': 3}} if pyvips.at_least_libvips(8, 12) else {}
+
+    def thumbnail(self, source, size):
+        raw = open_raw(source, size)
+        if raw is not None: # A JPEG preview, drafted by Pillow, or a demosaiced RAW
+            img, orientation = raw
+            with img:
+                return self.from_pillow(prepare_image(img, size, 'lanczos', orientation))
+        try:
+            # size='down': never enlarge, like Pillow's thumbnail(); the EXIF orientation is applied automatically
+            if isinstance(source, (str, os.PathLike)):
+                image = pyvips.Image.thumbnail(os.fspath(source), size, height=size, size='down')
+            else:
+                source.seek(0)
+                # A copy: vips must not hold an export of the caller's mmap, which is closed after the scan
+                image = pyvips.Image.thumbnail_buffer(source.read(), size, height=size, size='down')
+            # The source is read sequentially, so render the small result once for all encoders
+            return image.copy_memory()
+        except pyvips.Error as e:
+            if pillow_heif is None or not is_heif(source):
+                raise
+            # libvips builds without an HEVC decoder (libde265) only read AVIF
+            log.debug(f"libvips can't decode HEIF file ({e}), decoding with pillow-heif")
+            return self.from_pillow(prepare_image(heif_image(source, size), size, 'lanczos', orientation=1))
+
+    def encode(self, image, fmt, quality):
+        try:
+            return image.write_to_buffer(self.SUFFIXES[fmt], Q=quality, **self.save_options,
+                                         **self.format_options.get(fmt, {}))
+        except pyvips.Error as e:
+            log.debug(f"libvips can't write {fmt} ({e}), encoding with Pillow")
+            return encode_image(self.to_pillow(image), fmt, quality)
+
+    def from_pillow(self, image):
+        """Copies a (small) Pillow image into a vips image."""
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        return pyvips.Image.new_from_memory(image.tobytes(), image.width, image.height, len(image.getbands()), 'uchar')
+
+    def to_pillow(self, image):
+        """Copies a (small) vips image into a Pillow image, e.g. for the perceptual hash."""
+        if image.format != 'uchar': # 16-bit or float sources
+            image = image.colourspace('b-w' if image.bands < 3 else 'srgb').cast('uchar')
+        if image.bands > 4: # e.g. CMYK with alpha
+            image = image.extract_band(0, n=4 if image.hasalpha() else 3)
+        return Image.frombytes(VIPS_BAND_MODES[image.bands], (image.width, image.height), image.write_to_memory())
+
+
+THUMBNAIL_BACKENDS = {
+    PillowThumbnailer.kind: PillowThumbnailer,
+    VipsThumbnailer.kind: VipsThumbnailer,
+}
+_thumbnailers = {}
+_thumbnailers_lock = threading.Lock()
+
+
+def available_backends():
+    """Names of the thumbnail engines that can run in this environment."""
+    return [kind for kind in THUMBNAIL_BACKENDS if kind != VipsThumbnailer.kind or pyvips is not None]
+
+
+def backend_kind(name):
+    """Resolves a THUMBNAIL_BACKEND setting ('auto' -> 'vips' if pyvips is installed, else 'pillow')."""
+    if name == 'auto':
+        return VipsThumbnailer.kind if pyvips is not None else PillowThumbnailer.kind
+    if name not in available_backends():
+        raise ValueError(f"Unknown or unavailable THUMBNAIL_BACKEND: {name} (available: {', '.join(available_backends())})")
+    return name
+
+
+def get_thumbnailer(settings):
+    """Returns the per-process thumbnail engine for the configured THUMBNAIL_BACKEND."""
+    kind = backend_kind(settings.get('backend', PillowThumbnailer.kind))
+    cache_key = (kind, settings.get('resample'), os.getpid())
+    with _thumbnailers_lock:
+        thumbnailer = _thumbnailers.get(cache_key)
+        if thumbnailer is None:
+            thumbnailer = _thumbnailers[cache_key] = THUMBNAIL_BACKENDS[kind](settings)
+        return thumbnailer
@@ -0,0 +1,148 @@
+import os
+import io
+import logging
+import tempfile
+from PIL import Image, features
+from app.thumbstore import get_thumbnail_store
+from app.thumbengine import get_thumbnailer, backend_kind, RESAMPLE_FILTERS
+
+log = logging.getLogger(__name__)
+
+# Output formats: name -> (Pillow format, file extension, mimetype)
+THUMBNAIL_FORMATS = {
+    'avif': ('AVIF', 'avif', 'image/avif'),
+    'webp': ('WEBP', 'webp', 'image/webp'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+}
+FALLBACK_FORMAT = 'jpeg' # Always generated so every client can display a thumbnail
+
+
+def thumbnail_settings(config):
+    """
+    Collects the thumbnail options from an app config into a plain, picklable dict.
+
+    Scan worker processes have no app context, so they receive these settings
+    as an argument instead of reading current_app.config.
+    """
+    formats = [f for f in config.get('THUMBNAIL_FORMATS', ['webp']) if format_supported(f)]
+    if FALLBACK_FORMAT not in formats:
+        formats.append(FALLBACK_FORMAT)
+    base_size = config.get('THUMBNAIL_BASE_SIZE', 400)
+    sizes = sorted(set(config.get('THUMBNAIL_SIZES', [base_size])) | {base_size})
+    resample = config.get('THUMBNAIL_RESAMPLE', 'bicubic').lower()
+    if resample not in RESAMPLE_FILTERS:
+        raise ValueError(f"Unknown THUMBNAIL_RESAMPLE: {resample} (expected one of {', '.join(RESAMPLE_FILTERS)})")
+    return {
+        'dir': config['THUMBNAIL_DIR'],
+        'base_size': base_size,
+        'sizes': sizes,
+        'formats': formats,
+        'quality': config.get('THUMBNAIL_QUALITY', 85),
+        'store': config.get('THUMBNAIL_STORE', 'hashdir'),
+        'backend': backend_kind(config.get('THUMBNAIL_BACKEND', 'pillow')), # Resolved here, so all processes agree
+        'resample': resample,
+    }
+
+
+def format_supported(fmt):
+    """Checks whether this Pillow build can encode the given output format."""
+    if fmt not in THUMBNAIL_FORMATS:
+        return False
+    if fmt == 'jpeg':
+        return True
+    return features.check(fmt)
+
+
+def rendition_path(thumbnail_dir, photo_hash, size, fmt, base_size=400):
+    """
+    Returns the path of one rendition of a photo.
+
+    Example: /path/to/thumbnails/ab/cd/abcdef123..._1024.webp
+    The base-size JPEG keeps the original <hash>.jpg name so existing thumbnails stay valid.
+    """
+    ext = THUMBNAIL_FORMATS[fmt][1]
+    if size == base_size and fmt == FALLBACK_FORMAT:
+        filename = f"{photo_hash}.{ext}"
+    else:
+        filename = f"{photo_hash}_{size}.{ext}"
+    return os.path.join(thumbnail_dir, photo_hash[:2], photo_hash[2:4], filename)
+
+
+def write_atomic(path, data):
+    """Writes bytes to a temp file next to `path` and renames it into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def perceptual_hash(img):
+    """
+    Computes the 64-bit difference hash (dHash) of an image.
+
+    The image is reduced to 9x8 grey pixels and each bit records whether a
+    pixel is brighter than its right neighbour, so resized or re-encoded
+    copies of a photo differ in only a few bits. Pass an already downscaled
+    image (e.g. a thumbnail); the result does not depend on the input size.
+    Returned as a signed 64-bit integer so it fits a BigInteger column.
+    """
+    pixels = img.convert('L').resize((9, 8), Image.BILINEAR).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def save_renditions(source, photo_hash, settings, size, formats=None):
+    """
+    Downscales `source` (a path or file object) once for `size` and stores it in each requested format.
+
+    Returns the perceptual hash of the prepared image, which is cheap to
+    compute from the already downscaled pixels.
+    """
+    formats = formats or settings['formats']
+    store = get_thumbnail_store(settings)
+    thumbnailer = get_thumbnailer(settings)
+    img = thumbnailer.thumbnail(source, size)
+    for fmt in formats:
+        store.put(photo_hash, size, fmt, thumbnailer.encode(img, fmt, settings['quality']))
+        log.info(f"Generated {size}px {fmt} thumbnail for {photo_hash} ({thumbnailer.kind}, {store.kind} store)")
+    return perceptual_hash(thumbnailer.to_pillow(img))
+
+
+def generate_rendition(source_path, photo_hash, size, fmt, settings):
+    """
+    Lazily generates one rendition on first request.
+
+    Sizes below the base size are derived from the base JPEG thumbnail when it
+    exists, larger ones from the original.
+    """
+    store = get_thumbnail_store(settings)
+    if store.exists(photo_hash, size, fmt):
+        return
+    base = store.read(photo_hash, settings['base_size'], FALLBACK_FORMAT) if size < settings['base_size'] else None
+    save_renditions(io.BytesIO(base) if base is not None else source_path, photo_hash, settings, size, [fmt])
+
+
+def pick_size(requested, settings):
+    """Returns the smallest configured size that is at least `requested` (or the largest one)."""
+    for size in settings['sizes']:
+        if size >= requested:
+            return size
+    return settings['sizes'][-1]
+
+
+def negotiate_format(accept_mimetypes, settings):
+    """Picks the best configured output format the client accepts, falling back to JPEG."""
+    offered = {THUMBNAIL_FORMATS[f][2]: f for f in settings['formats']}
+    best = accept_mimetypes.best_match(list(offered), default=THUMBNAIL_FORMATS[FALLBACK_FORMAT][2])
+    return offered.get(best, FALLBACK_FORMAT)
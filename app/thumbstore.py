@@ -0,0 +1,284 @@
+import os
+import mmap
+import sqlite3
+import logging
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError: # Windows: packs in use are only recognised by their mtime
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+def _try_lock(f, exclusive):
+    """Takes an advisory lock on an open pack file; False if another open file holds a conflicting one."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def rendition_key(photo_hash, size, fmt):
+    """Identifies one rendition inside a store; also used as its HTTP ETag."""
+    return f"{photo_hash}-{size}-{fmt}"
+
+
+class HashDirThumbnailStore:
+    """One file per rendition under THUMBNAIL_DIR/ab/cd/<hash>[_<size>].<ext>."""
+
+    kind = 'hashdir'
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def path(self, photo_hash, size, fmt):
+        """Returns the filesystem path of a rendition, so it can be served with send_file."""
+        from app.thumbnails import rendition_path # Imported here; app.thumbnails imports this module
+        return rendition_path(self.settings['dir'], photo_hash, size, fmt, self.settings['base_size'])
+
+    def exists(self, photo_hash, size, fmt):
+        return os.path.exists(self.path(photo_hash, size, fmt))
+
+    def read(self, photo_hash, size, fmt):
+        try:
+            with open(self.path(photo_hash, size, fmt), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, photo_hash, size, fmt, data):
+        from app.thumbnails import write_atomic # Imported here; app.thumbnails imports this module
+        write_atomic(self.path(photo_hash, size, fmt), data)
+
+
+class PackedThumbnailStore:
+    """
+    Append-only pack files plus an index of key -> (pack, offset, length).
+
+    Avoids one inode per rendition for multi-million photo libraries. Every
+    process appends to its own pack, so scan workers never contend on a file;
+    the SQLite index (WAL mode) is the only shared state. Data is written and
+    flushed before its index row, so a crash leaves at most unreferenced bytes
+    for compact() to reclaim. Readers map packs with mmap. A process holds a
+    shared lock on the pack it appends to, so compact() leaves it alone.
+    """
+
+    kind = 'packed'
+    PACK_MAX_SIZE = 256 * 1024 * 1024 # Start a new pack after this many bytes
+    SMALL_PACK_SIZE = 32 * 1024 * 1024 # compact() merges packs below this size
+    PACK_MIN_AGE = 600 # Seconds since a pack's last write before compact() touches it
+    MAX_OPEN_PACKS = 256
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.pack_dir = os.path.join(settings['dir'], 'packs')
+        os.makedirs(self.pack_dir, exist_ok=True)
+        self.index_path = os.path.join(self.pack_dir, 'index.db')
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._pack_file = None
+        self._pack_name = None
+        self._maps = {} # pack name -> mmap
+        self._maps_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                         'key TEXT PRIMARY KEY, pack TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_entries_pack ON entries (pack)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _conn(self):
+        """One index connection per thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def path(self, photo_hash, size, fmt):
+        return None # Renditions are not individual files
+
+    def _lookup(self, key):
+        return self._conn().execute('SELECT pack, offset, length FROM entries WHERE key = ?', (key,)).fetchone()
+
+    def exists(self, photo_hash, size, fmt):
+        return self._lookup(rendition_key(photo_hash, size, fmt)) is not None
+
+    def read(self, photo_hash, size, fmt):
+        entry = self._lookup(rendition_key(photo_hash, size, fmt))
+        if entry is None:
+            return None
+        pack, offset, length = entry
+        # The slice is copied under the lock: another thread may close this map (remap or eviction)
+        with self._maps_lock:
+            try:
+                mapped = self._map(pack, offset + length)
+            except FileNotFoundError:
+                log.warning(f"Thumbnail pack missing: {pack}")
+                return None
+            return mapped[offset:offset + length]
+
+    def _map(self, pack, min_size):
+        """Returns a cached mmap of a pack, remapping it if the pack has grown since. Call with _maps_lock held."""
+        mapped = self._maps.get(pack)
+        if mapped is None or len(mapped) < min_size:
+            if mapped is not None:
+                self._maps.pop(pack).close() # Not left cached closed if the pack can't be reopened
+            elif len(self._maps) >= self.MAX_OPEN_PACKS:
+                for old in self._maps.values():
+                    old.close()
+                self._maps.clear()
+            with open(os.path.join(self.pack_dir, pack), 'rb') as f:
+                mapped = self._maps[pack] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    def _open_pack(self):
+        """Opens this process's current pack for appending, starting a new one when it is full."""
+        if self._pack_file is not None:
+            if self._pack_file.tell() < self.PACK_MAX_SIZE:
+                return
+            self._pack_file.close()
+        # Unique per store instance, and get_thumbnail_store() keeps one instance per process,
+        # so appends from different scan workers never interleave
+        self._pack_name = f"pack-{os.getpid()}-{uuid.uuid4().hex[:12]}.pack"
+        self._pack_file = open(os.path.join(self.pack_dir, self._pack_name), 'ab')
+        _try_lock(self._pack_file, exclusive=False) # Held until the pack is closed; a new file has no other lock
+
+    def put(self, photo_hash, size, fmt, data):
+        with self._write_lock:
+            self._open_pack()
+            offset = self._pack_file.tell()
+            self._pack_file.write(data)
+            self._pack_file.flush()
+            pack = self._pack_name
+        conn = self._conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO entries (key, pack, offset, length) VALUES (?, ?, ?, ?)',
+                         (rendition_key(photo_hash, size, fmt), pack, offset, len(data)))
+
+    def compact(self, live_hashes, min_garbage_ratio=0.2, batch_size=1000):
+        """
+        Rewrites packs whose unreferenced bytes exceed min_garbage_ratio, merges small packs, and deletes them.
+
+        `live_hashes(hashes)` must return the subset of the given photo hashes
+        that still exist; entries for other hashes are dropped as garbage.
+        Packs below SMALL_PACK_SIZE (every process leaves one behind) are
+        merged even without garbage, as long as there are at least two.
+        Packs another process is appending to (locked, or written in the last
+        PACK_MIN_AGE seconds) are skipped. Returns (packs_rewritten, bytes_reclaimed).
+        """
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        # 1. Drop index entries of photos that no longer exist, in batches
+        last_key = ''
+        while True:
+            rows = conn.execute('SELECT key FROM entries WHERE key > ? ORDER BY key LIMIT ?',
+                                (last_key, batch_size)).fetchall()
+            if not rows:
+                break
+            last_key = rows[-1]['key']
+            by_hash = {}
+            for row in rows:
+                by_hash.setdefault(row['key'].split('-', 1)[0], []).append(row['key'])
+            alive = live_hashes(list(by_hash))
+            dead = [key for h, keys in by_hash.items() if h not in alive for key in keys]
+            if dead:
+                with conn:
+                    conn.executemany('DELETE FROM entries WHERE key = ?', [(k,) for k in dead])
+
+        # 2. Pick the packs with too much garbage, and the small ones to merge
+        live_bytes = dict(conn.execute('SELECT pack, SUM(length) FROM entries GROUP BY pack').fetchall())
+        garbage, small = [], []
+        now = time.time()
+        for pack in sorted(os.listdir(self.pack_dir)):
+            if not pack.endswith('.pack') or pack == self._pack_name:
+                continue
+            try:
+                st = os.stat(os.path.join(self.pack_dir, pack))
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime < self.PACK_MIN_AGE:
+                continue # May still be appended to (or not yet locked) by its process
+            used = live_bytes.get(pack, 0)
+            if st.st_size == 0 or (st.st_size - used) / st.st_size >= min_garbage_ratio:
+                garbage.append((pack, st.st_size, used))
+            elif st.st_size < self.SMALL_PACK_SIZE:
+                small.append((pack, st.st_size, used))
+        if len(small) < 2:
+            small = [] # Rewriting a lone small pack would only move it
+
+        # 3. Copy their live entries into fresh packs
+        packs_rewritten = 0
+        bytes_reclaimed = 0
+        dst, dst_name = None, None
+        for pack, pack_size, used in garbage + small:
+            pack_path = os.path.join(self.pack_dir, pack)
+            try:
+                src = open(pack_path, 'rb')
+            except FileNotFoundError:
+                continue # Compacted by another process meanwhile
+            with src:
+                if not _try_lock(src, exclusive=True):
+                    log.info(f"Skipping thumbnail pack {pack}: in use by another process")
+                    continue
+                entries = conn.execute('SELECT key, offset, length FROM entries WHERE pack = ? ORDER BY offset',
+                                       (pack,)).fetchall()
+                if entries:
+                    if dst is None or dst.tell() >= self.PACK_MAX_SIZE:
+                        if dst is not None:
+                            dst.close()
+                        dst_name = f"pack-{os.getpid()}-{uuid.uuid4().hex[:12]}.pack"
+                        dst = open(os.path.join(self.pack_dir, dst_name), 'wb')
+                        _try_lock(dst, exclusive=False) # Not compacted by another process while written
+                    moved = []
+                    for entry in entries:
+                        src.seek(entry['offset'])
+                        moved.append((dst_name, dst.tell(), entry['key']))
+                        dst.write(src.read(entry['length']))
+                    dst.flush()
+                    os.fsync(dst.fileno()) # The copy must be durable before the index points at it
+                    with conn:
+                        conn.executemany('UPDATE entries SET pack = ?, offset = ? WHERE key = ?', moved)
+                try:
+                    os.remove(pack_path)
+                except OSError as e: # e.g. still mapped by a server process on Windows
+                    log.warning(f"Could not remove compacted pack {pack}: {e}")
+                    continue
+            packs_rewritten += 1
+            bytes_reclaimed += pack_size - used
+            log.info(f"Compacted thumbnail pack {pack}: reclaimed {pack_size - used} bytes")
+        if dst is not None:
+            dst.close()
+        conn.close()
+        return packs_rewritten, bytes_reclaimed
+
+
+THUMBNAIL_STORES = {
+    HashDirThumbnailStore.kind: HashDirThumbnailStore,
+    PackedThumbnailStore.kind: PackedThumbnailStore,
+}
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_thumbnail_store(settings):
+    """Returns the per-process store instance for the configured THUMBNAIL_STORE backend."""
+    kind = settings.get('store', HashDirThumbnailStore.kind)
+    cache_key = (kind, settings['dir'], os.getpid())
+    with _stores_lock:
+        store = _stores.get(cache_key)
+        if store is None:
+            if kind not in THUMBNAIL_STORES:
+                raise ValueError(f"Unknown THUMBNAIL_STORE: {kind}")
+            store = _stores[cache_key] = THUMBNAIL_STORES[kind](settings)
+        return store
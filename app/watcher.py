@@ -0,0 +1,295 @@
+import os
+import time
+import hashlib
+import queue
+import logging
+import threading
+from flask import current_app
+from app import db
+from app.photodb import move_photos, delete_photos, filenames_in_directory, stat_signatures_under
+from app.photolib import ingest_paths, scan_process_pool, stat_signature, SUPPORTED_EXTENSIONS
+
+try:
+    from watchdog.observers import Observer # inotify on Linux, FSEvents/ReadDirectoryChangesW elsewhere
+    from watchdog.events import FileSystemEventHandler
+except ImportError: # Optional dependency; the watcher falls back to polling
+    Observer = None
+    FileSystemEventHandler = object
+
+log = logging.getLogger(__name__)
+
+
+def _is_supported(path):
+    return os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+def _under(path, directory):
+    return path.startswith(directory + '/')
+
+
+class ChangeSet:
+    """
+    Debounced library changes, keyed by path relative to PHOTO_LIBRARY_PATH.
+
+    Later events for a path supersede earlier ones, so a file that is created,
+    written several times and renamed within the debounce window is ingested once.
+    """
+
+    def __init__(self):
+        self.changed = set() # Files to (re)ingest
+        self.deleted = {} # relative_path -> is_directory
+        self.moves = [] # (src, dst, is_directory), applied in arrival order
+        self.first_event = None
+        self.last_event = None
+
+    def __bool__(self):
+        return bool(self.changed or self.deleted or self.moves)
+
+    def record(self, kind, path, is_directory=False, dest=None):
+        now = time.monotonic()
+        self.first_event = self.first_event or now
+        self.last_event = now
+        if kind == 'changed':
+            if is_directory:
+                return # Files inside a new directory report their own events
+            if _is_supported(path):
+                self.deleted.pop(path, None)
+                self.changed.add(path)
+        elif kind == 'deleted':
+            if is_directory:
+                self.changed = {p for p in self.changed if not _under(p, path)}
+            elif not _is_supported(path):
+                return
+            self.changed.discard(path)
+            self.deleted[path] = is_directory
+        elif kind == 'moved':
+            if is_directory:
+                self.moves.append((path, dest, True))
+                self.changed = {dest + p[len(path):] if _under(p, path) else p for p in self.changed}
+            elif any(d and _under(path, s) and dest == d + path[len(s):] for s, d, d_is_dir in self.moves if d_is_dir):
+                return # Sub-event of a directory move that is already recorded
+            elif _is_supported(path) and _is_supported(dest):
+                self.moves.append((path, dest, False))
+                if path in self.changed:
+                    self.changed.discard(path)
+                    self.changed.add(dest)
+            elif _is_supported(dest): # e.g. an upload renamed from x.jpg.part to x.jpg
+                self.changed.add(dest)
+            elif _is_supported(path):
+                self.changed.discard(path)
+                self.deleted[path] = False
+                return
+            self.deleted.pop(dest, None)
+
+    def ready(self, debounce, max_delay):
+        """True once events have been quiet for `debounce` seconds, or pending for `max_delay`."""
+        if not self:
+            return False
+        now = time.monotonic()
+        return now - self.last_event >= debounce or now - self.first_event >= max_delay
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Translates watchdog events into (kind, relative_path, is_directory, dest) tuples."""
+
+    def __init__(self, root, events):
+        self.root = root
+        self.events = events
+
+    def _relative(self, path):
+        if isinstance(path, bytes):
+            path = os.fsdecode(path)
+        return os.path.relpath(path, self.root).replace('\\', '/')
+
+    def on_any_event(self, event):
+        if event.event_type in ('created', 'modified', 'closed'):
+            kind = 'changed'
+        elif event.event_type in ('deleted', 'moved'):
+            kind = event.event_type
+        else:
+            return # opened, closed_no_write
+        dest = self._relative(event.dest_path) if kind == 'moved' else None
+        self.events.put((kind, self._relative(event.src_path), event.is_directory, dest))
+
+
+class LibraryPoller(threading.Thread):
+    """
+    Polling fallback for when inotify is unavailable (no watchdog, network shares, watch limits).
+
+    Only directories whose mtime changed are listed again, so a poll costs one
+    stat per directory rather than one per file. Per directory only a digest
+    of the listing is kept, not the file names: when it changes, the listing
+    is diffed against the Photo rows of that directory. Files rewritten in
+    place without a rename don't change their directory's mtime; the next
+    'flask scan-library' picks those up.
+    """
+
+    def __init__(self, root, events, interval, engine):
+        super().__init__(name='library-poller', daemon=True)
+        self.root = root
+        self.events = events
+        self.interval = interval
+        self.engine = engine # The poller runs outside the app context
+        self.stop_event = threading.Event()
+        self._dirs = {} # relative dir -> (mtime_ns, digest of supported file names, subdirectory names)
+
+    def run(self):
+        self._poll(emit=False) # Baseline; the library is assumed to be scanned already
+        while not self.stop_event.wait(self.interval):
+            try:
+                self._poll(emit=True)
+            except Exception as e:
+                log.error(f"Library poll failed: {e}", exc_info=True)
+
+    def _poll(self, emit):
+        seen = set()
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            full_dir = os.path.join(self.root, rel_dir)
+            try:
+                mtime_ns = os.stat(full_dir).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(rel_dir)
+            previous = self._dirs.get(rel_dir)
+            if previous is None or previous[0] != mtime_ns:
+                files, subdirs = set(), set()
+                try:
+                    with os.scandir(full_dir) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.add(entry.name)
+                            elif _is_supported(entry.name):
+                                files.add(entry.name)
+                except OSError as e:
+                    log.warning(f"Could not list {full_dir}: {e}")
+                    continue
+                digest = listing_digest(files)
+                if emit:
+                    old_digest, old_subdirs = (previous[1], previous[2]) if previous else (None, set())
+                    if digest != old_digest:
+                        with self.engine.connect() as conn:
+                            stored = filenames_in_directory(conn, rel_dir)
+                        for name in files - stored:
+                            self.events.put(('changed', posix_join(rel_dir, name), False, None))
+                        for name in stored - files:
+                            self.events.put(('deleted', posix_join(rel_dir, name), False, None))
+                    for name in old_subdirs - subdirs:
+                        self.events.put(('deleted', posix_join(rel_dir, name), True, None))
+                previous = self._dirs[rel_dir] = (mtime_ns, digest, subdirs)
+            stack.extend(posix_join(rel_dir, name) for name in previous[2])
+        for rel_dir in set(self._dirs) - seen:
+            del self._dirs[rel_dir]
+
+
+def listing_digest(names):
+    """Order-independent digest of a directory's file names."""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(names):
+        digest.update(os.fsencode(name) + b'\0')
+    return digest.digest()
+
+
+def posix_join(directory, name):
+    return f"{directory}/{name}" if directory else name
+
+
+def _pair_renames(conn, changes, root):
+    """
+    Turns delete + create pairs of the same file (same size, mtime, inode, device) into moves.
+
+    The polling fallback, and inotify for moves across watch boundaries, only
+    see a rename as a delete and a create; pairing them avoids re-hashing.
+    """
+    if not changes.deleted or not changes.changed:
+        return
+    signatures = stat_signatures_under(conn, changes.deleted)
+    for path in sorted(changes.changed):
+        try:
+            st = os.stat(os.path.join(root, path))
+        except OSError:
+            continue
+        src = signatures.pop(stat_signature(st), None)
+        if src is not None and src != path:
+            changes.moves.append((src, path, False))
+            changes.changed.discard(path)
+            if not changes.deleted.get(src, True):
+                del changes.deleted[src]
+
+
+def apply_changes(changes, executor, workers):
+    """Applies one debounced ChangeSet: moves and deletes in SQL, then ingest of changed files."""
+    if changes.moves or changes.deleted:
+        with db.engine.begin() as conn:
+            _pair_renames(conn, changes, current_app.config['PHOTO_LIBRARY_PATH'])
+            for src, dst, is_directory in changes.moves:
+                moved = move_photos(conn, src, dst, is_directory)
+                if moved:
+                    log.info(f"Moved {moved} photo(s): {src} -> {dst}")
+            for path, is_directory in changes.deleted.items():
+                deleted = delete_photos(conn, path, is_directory)
+                if deleted:
+                    log.info(f"Removed {deleted} photo(s) at {path}")
+    if changes.changed:
+        stats = ingest_paths(changes.changed, workers=workers, executor=executor)
+        log.info(f"Ingested changes. Added: {stats.added}, Updated: {stats.updated}, "
+                 f"Skipped (Unchanged): {stats.skipped}, Errors: {stats.errors}")
+
+
+def watch_library(debounce=None, max_delay=None, poll_interval=None, force_polling=False,
+                  workers=None, stop_event=None):
+    """
+    Watches PHOTO_LIBRARY_PATH and ingests changes as they happen, until stop_event is set.
+
+    Uses inotify (through the optional watchdog package) and falls back to
+    polling every `poll_interval` seconds. Events are debounced for `debounce`
+    seconds (at most `max_delay`) and then applied: moves only rewrite
+    relative_path, deletes remove rows, and created/modified files go through
+    the same pipeline as scan_photo_library.
+    """
+    config = current_app.config
+    root = config['PHOTO_LIBRARY_PATH']
+    debounce = debounce if debounce is not None else config.get('WATCH_DEBOUNCE', 2.0)
+    max_delay = max_delay if max_delay is not None else config.get('WATCH_MAX_DELAY', 30.0)
+    poll_interval = poll_interval or config.get('WATCH_POLL_INTERVAL', 60)
+    workers = workers or config.get('WATCH_WORKERS', 2)
+    stop_event = stop_event or threading.Event()
+    os.makedirs(root, exist_ok=True)
+
+    events = queue.Queue()
+    observer = poller = None
+    if Observer is not None and not force_polling:
+        try:
+            observer = Observer()
+            observer.schedule(_EventHandler(root, events), root, recursive=True)
+            observer.start()
+            log.info(f"Watching {root} for changes (inotify)")
+        except OSError as e: # e.g. fs.inotify.max_user_watches exhausted
+            log.warning(f"Could not start inotify watcher ({e}); falling back to polling")
+            observer = None
+    if observer is None:
+        poller = LibraryPoller(root, events, poll_interval, db.engine)
+        poller.start()
+        log.info(f"Watching {root} for changes (polling every {poll_interval}s)")
+
+    changes = ChangeSet()
+    try:
+        with scan_process_pool(workers) as executor:
+            while not stop_event.is_set():
+                try:
+                    changes.record(*events.get(timeout=0.5))
+                except queue.Empty:
+                    pass
+                if changes.ready(debounce, max_delay):
+                    pending, changes = changes, ChangeSet()
+                    try:
+                        apply_changes(pending, executor, workers)
+                    except Exception as e:
+                        log.error(f"Failed to apply library changes: {e}", exc_info=True)
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        if poller is not None:
+            poller.stop_event.set()
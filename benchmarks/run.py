@@ -0,0 +1,344 @@
+"""
+Benchmarks for the scan, thumbnail, timeline and export paths on a synthetic library.
+
+Usage (from the project root):
+
+    python -m benchmarks.run --count 500 --formats jpeg,png --output results.json
+
+Everything runs in a temporary directory with its own SQLite database, so the
+configured library and database are never touched. Results are printed (or
+written to --output) as JSON, one entry per benchmark, for comparing commits.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+import subprocess
+from datetime import datetime
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BASE_DIR)
+
+import PIL
+from flask_migrate import upgrade
+from app import create_app, db
+from app.config import Config
+from app.models import Photo, User
+from app.photolib import scan_photo_library, generate_thumbnail
+from app.thumbnails import thumbnail_settings, format_supported, THUMBNAIL_FORMATS
+from app.thumbengine import available_backends
+from benchmarks.synthetic import generate_library, LIBRARY_FORMATS
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process and of its (finished) worker processes, in MB."""
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024 # ru_maxrss is bytes on macOS, KB elsewhere
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def _latencies(samples):
+    """Summarizes per-operation latencies (seconds) as milliseconds."""
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {'count': len(ordered), 'p50_ms': percentile(50), 'p99_ms': percentile(99),
+            'max_ms': round(ordered[-1] * 1000, 3)}
+
+
+def _throughput(seconds, files, total_bytes):
+    return {
+        'seconds': round(seconds, 3),
+        'files_per_sec': round(files / seconds, 1) if seconds else None,
+        'mb_per_sec': round(total_bytes / (1024 * 1024) / seconds, 2) if seconds else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _make_config(workdir, library_path):
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, 'benchmark.db')
+        PHOTO_LIBRARY_PATH = library_path
+        DATA_STORAGE_PATH = os.path.join(workdir, 'data')
+        THUMBNAIL_DIR = os.path.join(workdir, 'data', 'thumbnails')
+        SCAN_METRICS_FILE = None # Under DATA_STORAGE_PATH
+        WTF_CSRF_ENABLED = False
+    return BenchmarkConfig
+
+
+def bench_scan(app, files, total_bytes, workers):
+    """
+    Cold scan of the whole library, then a warm rescan where every file is
+    unchanged, then a metadata-only rescan of every file.
+    """
+    results = {}
+    for name in ('scan_cold', 'scan_warm', 'scan_metadata_only'):
+        with app.app_context():
+            start = time.perf_counter()
+            stats = scan_photo_library(workers=workers, resume=False, metadata_only=name == 'scan_metadata_only')
+            elapsed = time.perf_counter() - start
+        results[name] = dict(_throughput(elapsed, files, total_bytes), stats=vars(stats), peak_rss_mb=_peak_rss_mb())
+    return results
+
+
+def bench_thumbnails(app, library_path, sample):
+    """
+    Base-size thumbnail generation per engine, output format and source format.
+
+    Runs in a single process, into a fresh store per engine and output format,
+    on up to `sample` photos of each source extension. The vips engine is
+    only measured when pyvips is installed.
+    """
+    with app.app_context():
+        extensions = [row.extension for row in Photo.query.with_entities(Photo.extension).distinct()]
+        sources = {
+            ext: [os.path.join(library_path, p.relative_path) for p in Photo.query.filter_by(extension=ext).limit(sample)]
+            for ext in sorted(extensions)
+        }
+        base_settings = thumbnail_settings(app.config)
+    results = {}
+    for backend in available_backends():
+        results[backend] = {}
+        for fmt in THUMBNAIL_FORMATS:
+            if not format_supported(fmt):
+                results[backend][fmt] = {'skipped': 'not supported by this Pillow build'}
+                continue
+            settings = dict(base_settings, backend=backend, formats=[fmt],
+                            dir=os.path.join(base_settings['dir'], f'bench-{backend}-{fmt}'))
+            results[backend][fmt] = {}
+            for n, (ext, paths) in enumerate(sources.items()):
+                samples = []
+                total_bytes = 0
+                for i, path in enumerate(paths):
+                    total_bytes += os.path.getsize(path)
+                    start = time.perf_counter()
+                    generate_thumbnail(path, f"{n:032x}{i:032x}", settings) # Any unique hash-shaped key
+                    samples.append(time.perf_counter() - start)
+                results[backend][fmt][ext] = dict(_throughput(sum(samples), len(paths), total_bytes),
+                                                  latency=_latencies(samples))
+    return results
+
+
+def _logged_in_client(app):
+    """A test client logged in as a benchmark user (created on first use)."""
+    with app.app_context():
+        if User.query.filter_by(username='bench').first() is None:
+            user = User(username='bench', email='bench@example.com')
+            user.set_password('bench')
+            db.session.add(user)
+            db.session.commit()
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'bench', 'password': 'bench'})
+    return client
+
+
+def _timed_gets(client, urls, **kwargs):
+    samples = []
+    for url in urls:
+        start = time.perf_counter()
+        response = client.get(url, **kwargs)
+        response.get_data()
+        samples.append(time.perf_counter() - start)
+        if response.status_code not in (200, 304):
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return _latencies(samples)
+
+
+def bench_routes(app, requests):
+    """Timeline and thumbnail routes through the Flask test client, logged in (and with signed URLs)."""
+    client = _logged_in_client(app)
+    with app.app_context():
+        hashes = [row.file_hash for row in Photo.query.with_entities(Photo.file_hash)
+                  .filter(Photo.thumbnail_generated.is_(True)).limit(requests)]
+
+    def timed(urls, **kwargs):
+        return _timed_gets(client, urls, **kwargs)
+
+    thumbnail_urls = [f'/thumbnail/{h}' for h in hashes]
+    # Signed URLs as the photo API hands them out, fetched without a session
+    signed_urls = [p['thumbnail_url'] for p in client.get(f'/api/photos?limit={requests}').get_json()['photos']
+                   if p['thumbnail_url']]
+    large_urls = [f'/thumbnail/{h}?size={max(app.config["THUMBNAIL_SIZES"])}' for h in hashes]
+    webp = {'Accept': 'image/webp,*/*'}
+    etags = {url: client.get(url, headers=webp).headers.get('ETag') for url in thumbnail_urls}
+    return {
+        'index': timed(['/'] * requests),
+        'api_photos': timed(['/api/photos'] * requests),
+        'thumbnail_base': timed(thumbnail_urls, headers=webp),
+        'thumbnail_signed': _timed_gets(app.test_client(), signed_urls, headers=webp),
+        'thumbnail_large_first_request': timed(large_urls, headers=webp), # Generated on demand
+        'thumbnail_large_cached': timed(large_urls, headers=webp),
+        'thumbnail_304': timed(thumbnail_urls[:1] * requests,
+                               headers=dict(webp, **{'If-None-Match': etags.get(thumbnail_urls[0], '')}))
+        if thumbnail_urls else None,
+    }
+
+
+def _scan_loop(app, workers, stop, scans):
+    app.config['SCAN_BATCH_SIZE'] = 20
+    with app.app_context():
+        db.engine.dispose(close=False) # Forked: don't share the parent's connections
+        while not stop.is_set():
+            start = time.perf_counter()
+            scan_photo_library(workers=workers, resume=False, metadata_only=True)
+            scans.put(time.perf_counter() - start)
+
+
+def bench_concurrent(app, workers, requests):
+    """
+    Timeline requests while another process keeps running metadata-only
+    scans (many small write transactions), against an idle database.
+
+    Run once more with SQLITE_JOURNAL_MODE=DELETE to see the lock waits
+    (and "database is locked" errors) that WAL mode avoids.
+    """
+    client = _logged_in_client(app)
+    urls = ['/', '/api/photos']
+    idle = _timed_gets(client, urls * requests)
+
+    context = multiprocessing.get_context('fork') # Like `flask scan-library` next to the web server
+    stop = context.Event()
+    scans = context.Queue()
+    scanner = context.Process(target=_scan_loop, args=(app, workers, stop, scans), name='bench-scan')
+    samples, errors = [], 0
+    scanner.start()
+    try:
+        while len(samples) + errors < 2 * requests or scans.empty():
+            for url in urls:
+                start = time.perf_counter()
+                try:
+                    response = client.get(url)
+                    response.get_data()
+                    failed = response.status_code != 200
+                except Exception:
+                    failed = True
+                if failed:
+                    errors += 1
+                else:
+                    samples.append(time.perf_counter() - start)
+    finally:
+        stop.set()
+        scanner.join()
+    scan_seconds = []
+    while not scans.empty():
+        scan_seconds.append(scans.get())
+    return {
+        'journal_mode': app.config.get('SQLITE_JOURNAL_MODE'),
+        'idle': idle,
+        'during_scan': _latencies(samples) if samples else None,
+        'errors_during_scan': errors,
+        'scans': len(scan_seconds),
+        'scan_seconds': round(sum(scan_seconds) / len(scan_seconds), 3),
+    }
+
+
+def bench_export(app, files, total_bytes):
+    """Streams a ZIP export of the whole library through /export, consuming it chunk by chunk."""
+    client = _logged_in_client(app)
+    with app.app_context():
+        ids = [photo_id for (photo_id,) in Photo.query.with_entities(Photo.id)]
+    start = time.perf_counter()
+    response = client.post('/export', json={'ids': ids}, buffered=False)
+    if response.status_code != 200:
+        raise RuntimeError(f"POST /export returned {response.status_code}")
+    first_byte, archive_bytes = None, 0
+    for chunk in response.response:
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        archive_bytes += len(chunk)
+    response.close()
+    elapsed = time.perf_counter() - start
+    return dict(_throughput(elapsed, files, total_bytes), archive_bytes=archive_bytes,
+                first_byte_ms=round(first_byte * 1000, 3), peak_rss_mb=_peak_rss_mb())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=200, help='Number of synthetic photos.')
+    parser.add_argument('--formats', default='jpeg', help=f"Comma separated: {', '.join(LIBRARY_FORMATS)}.")
+    parser.add_argument('--width', type=int, default=2000)
+    parser.add_argument('--height', type=int, default=1500)
+    parser.add_argument('--exif-ratio', type=float, default=0.8, help='Fraction of photos with EXIF.')
+    parser.add_argument('--depth', type=int, default=2, help='Directory depth of the library.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='Scan worker processes.')
+    parser.add_argument('--thumbnail-sample', type=int, default=50, help='Photos per thumbnail format benchmark.')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per route benchmark.')
+    parser.add_argument('--only', default='scan,thumbnails,routes,concurrent,export',
+                        help='Benchmarks to run (scan always runs first).')
+    parser.add_argument('--workdir', help='Keep the library and database here instead of a temporary directory.')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout.')
+    args = parser.parse_args(argv)
+
+    formats = [f for f in args.formats.split(',') if f]
+    unknown = set(formats) - set(LIBRARY_FORMATS)
+    if unknown:
+        parser.error(f"unknown formats: {', '.join(sorted(unknown))}")
+    only = set(args.only.split(','))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ohmyphoto-bench-')
+    library_path = os.path.join(workdir, 'library')
+    try:
+        start = time.perf_counter()
+        total_bytes = generate_library(library_path, args.count, formats, args.width, args.height,
+                                       args.exif_ratio, args.depth, seed=args.seed)
+        generate_seconds = time.perf_counter() - start
+
+        app = create_app(_make_config(workdir, library_path))
+        with app.app_context():
+            upgrade(directory=os.path.join(BASE_DIR, 'migrations'))
+
+        results = {
+            'meta': {
+                'commit': _git_commit(),
+                'started_at': datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'pillow': PIL.__version__,
+                'thumbnail_backend': app.config['THUMBNAIL_BACKEND'], # Used by the scan benchmarks
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'params': vars(args),
+                'library_bytes': total_bytes,
+                'library_generate_seconds': round(generate_seconds, 3),
+            },
+        }
+        results.update(bench_scan(app, args.count, total_bytes, args.workers)) # Also populates the database
+        if 'thumbnails' in only:
+            results['thumbnails'] = bench_thumbnails(app, library_path, args.thumbnail_sample)
+        if 'routes' in only:
+            results['routes'] = bench_routes(app, args.requests)
+        if 'concurrent' in only:
+            results['concurrent'] = bench_concurrent(app, args.workers, args.requests)
+        if 'export' in only:
+            results['export'] = bench_export(app, args.count, total_bytes)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+import random
+from datetime import datetime, timedelta
+from PIL import Image, ImageDraw, ImageFilter
+
+# Output formats: name -> (Pillow format, file extension, save options)
+LIBRARY_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 90}),
+    'png': ('PNG', 'png', {}),
+    'tiff': ('TIFF', 'tiff', {'compression': 'tiff_lzw'}),
+}
+ORIENTATIONS = [1, 6, 1, 8, 3] # EXIF orientation: normal, 90° CW, 90° CCW, 180°
+CAMERAS = [('Canon', 'EOS R5'), ('NIKON CORPORATION', 'NIKON Z 6'), ('SONY', 'ILCE-7M3'), ('Apple', 'iPhone 13')]
+
+
+def _synthetic_image(rng, width, height):
+    """Draws a blurred random scene, so encoders and hashes see photo-like (not flat) content."""
+    img = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 2 + 1), y0 + rng.randrange(height // 2 + 1)
+        draw.ellipse((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+    return img.filter(ImageFilter.GaussianBlur(max(1, width // 200)))
+
+
+def _synthetic_exif(rng, index):
+    exif = Image.Exif()
+    make, model = rng.choice(CAMERAS)
+    taken = datetime(2015, 1, 1) + timedelta(minutes=37 * index + rng.randrange(30))
+    exif[0x010f] = make
+    exif[0x0110] = model
+    exif[0x0112] = ORIENTATIONS[index % len(ORIENTATIONS)] # Portrait phone shots are stored rotated
+    exif[0x0132] = taken.strftime('%Y:%m:%d %H:%M:%S') # DateTime
+    exif.get_ifd(0x8769)[0x9003] = taken.strftime('%Y:%m:%d %H:%M:%S') # DateTimeOriginal
+    exif.get_ifd(0x8769)[0x8827] = rng.choice([100, 200, 400, 800, 1600]) # ISO
+    return exif
+
+
+def generate_library(root, count=200, formats=('jpeg',), width=2000, height=1500, exif_ratio=0.8,
+                     depth=2, fanout=4, seed=0):
+    """
+    Writes `count` synthetic photos under `root` and returns their total size in bytes.
+
+    Files are spread over a directory tree `depth` levels deep with `fanout`
+    subdirectories per level, cycle through `formats` (jpeg, png, tiff) and
+    carry EXIF (camera, capture time, ISO) with probability `exif_ratio`.
+    The same seed always produces the same library.
+    """
+    rng = random.Random(seed)
+    total_bytes = 0
+    for index in range(count):
+        parts = [f"dir{rng.randrange(fanout)}" for _ in range(depth)]
+        directory = os.path.join(root, *parts)
+        os.makedirs(directory, exist_ok=True)
+        fmt = formats[index % len(formats)]
+        pil_format, ext, options = LIBRARY_FORMATS[fmt]
+        path = os.path.join(directory, f"IMG_{index:06d}.{ext}")
+        img = _synthetic_image(rng, width, height)
+        if rng.random() < exif_ratio:
+            options = dict(options, exif=_synthetic_exif(rng, index))
+        img.save(path, pil_format, **options)
+        total_bytes += os.path.getsize(path)
+    return total_bytes
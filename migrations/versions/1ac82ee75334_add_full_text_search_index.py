@@ -0,0 +1,65 @@
+"""Add full-text search index
+
+Revision ID: 1ac82ee75334
+Revises: 99328230c53d
+Create Date: 2026-10-17 12:36:56.001232
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1ac82ee75334'
+down_revision = '99328230c53d'
+branch_labels = None
+depends_on = None
+
+
+# Free-text EXIF tags indexed as notes (see app.fulltext.NOTE_TAGS)
+NOTE_TAGS = (
+    'Image ImageDescription', 'Image Artist', 'Image Copyright', 'Image XPTitle',
+    'Image XPComment', 'Image XPKeywords', 'Image XPSubject', 'EXIF UserComment',
+)
+
+
+def _notes_sql(dialect_name):
+    if dialect_name == 'sqlite':
+        parts = [f"""coalesce(json_extract(exif_data, '$."{tag}"'), '')""" for tag in NOTE_TAGS]
+    else:
+        parts = [f"coalesce(exif_data ->> '{tag}', '')" for tag in NOTE_TAGS]
+    return " || ' ' || ".join(parts)
+
+
+CAMERA_SQL = "coalesce(camera_make, '') || ' ' || coalesce(camera_model, '') || ' ' || coalesce(lens_model, '')"
+
+
+def upgrade():
+    dialect_name = op.get_bind().dialect.name
+    if dialect_name == 'sqlite':
+        # rowid = photo.id; prefix indexes make 2-3 character prefix queries cheap
+        op.execute("CREATE VIRTUAL TABLE photo_fts USING fts5("
+                   "filename, path, camera, notes, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+        op.execute("INSERT INTO photo_fts (rowid, filename, path, camera, notes) "
+                   "SELECT id, filename, rtrim(relative_path, replace(relative_path, '/', '')), "
+                   f"{CAMERA_SQL}, {_notes_sql(dialect_name)} FROM photo")
+    elif dialect_name == 'postgresql':
+        op.execute("CREATE TABLE photo_search ("
+                   "photo_id INTEGER PRIMARY KEY REFERENCES photo (id) ON DELETE CASCADE, "
+                   "document TSVECTOR NOT NULL)")
+        op.execute("CREATE INDEX ix_photo_search_document ON photo_search USING GIN (document)")
+
+        def vector(expr, weight):
+            return f"setweight(to_tsvector('simple', translate({expr}, '/._-', '    ')), '{weight}')"
+
+        op.execute("INSERT INTO photo_search (photo_id, document) SELECT id, "
+                   f"{vector('filename', 'A')} || {vector('relative_path', 'B')} || "
+                   f"{vector(CAMERA_SQL, 'C')} || {vector(_notes_sql(dialect_name), 'D')} FROM photo")
+
+
+def downgrade():
+    dialect_name = op.get_bind().dialect.name
+    if dialect_name == 'sqlite':
+        op.execute("DROP TABLE photo_fts")
+    elif dialect_name == 'postgresql':
+        op.execute("DROP TABLE photo_search")
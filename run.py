@@ -1,21 +1,198 @@
+import sys
+import functools
+import multiprocessing
 import click
 from app import create_app, db # Import db if needed by commands
-from app.photolib import scan_photo_library
+from app.photolib import scan_photo_library, library_subdirectory
+from app.thumbnails import thumbnail_settings
+from app.thumbstore import get_thumbnail_store
+from app.watcher import watch_library
+from app.fulltext import rebuild_index
+from app.duplicates import find_duplicate_clusters
+from app.search import parse_search_filters, filter_clauses
+from app.export import parse_photo_ids, export_paths, zip_stream
+from app.jobs import run_worker, enqueue_missing_thumbnails
 # Import models if needed by commands
-# from app.models import User, Photo
+from app.models import Photo
 
 app = create_app()
 
 # --- CLI Commands ---
 
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+def _print_scan_progress(snapshot, interactive):
+    """Prints a scan progress snapshot; on a terminal the line is redrawn in place."""
+    total = snapshot['total']
+    done = f"{snapshot['processed']}/{total}" if total else f"{snapshot['processed']}"
+    percent = f" ({100 * snapshot['processed'] / total:.0f}%)" if total else ""
+    eta = _format_duration(snapshot['eta_seconds']) if snapshot['eta_seconds'] is not None else "?"
+    queues = snapshot['queues']
+    line = (f"{done} files{percent} | {snapshot['files_per_sec']:.1f} files/s | ETA {eta} | "
+            f"added {snapshot['added']}, updated {snapshot['updated']}, skipped {snapshot['skipped']}, "
+            f"errors {snapshot['errors']} | queued {queues['paths']}, in workers {queues['in_flight']}, "
+            f"to write {queues['results']}")
+    if interactive:
+        click.echo(f"\r\033[K{line}", nl=False, err=True)
+    else:
+        click.echo(line, err=True)
+
 @app.cli.command("scan-library")
-def scan_library_command():
+@click.option('--verify', is_flag=True, help='Hash every file, even if its size/mtime/inode are unchanged.')
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help='Number of worker processes (defaults to SCAN_WORKERS or the CPU count).')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted scan and start over.')
+@click.option('--progress/--no-progress', default=True, show_default=True,
+              help='Show files/sec, ETA and queue depths while scanning.')
+@click.option('--metadata-only', is_flag=True,
+              help='Re-read dimensions, dates and EXIF of unchanged files from their headers (no hashing or thumbnails).')
+@click.option('--path', 'path', default=None, help='Only scan this directory (relative to the library).')
+@click.option('--include', multiple=True,
+              help='Only scan files matching this glob (repeatable; replaces SCAN_INCLUDE).')
+@click.option('--exclude', multiple=True,
+              help='Skip files and directories matching this glob (repeatable; replaces SCAN_EXCLUDE).')
+def scan_library_command(verify, workers, restart, progress, metadata_only, path, include, exclude):
     """Scans the photo library for new images."""
+    if verify and metadata_only:
+        raise click.UsageError("--verify and --metadata-only cannot be combined.")
+    if path:
+        try:
+            path = library_subdirectory(path)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--path')
     click.echo("Starting photo library scan...")
+    interactive = sys.stderr.isatty()
+    report = functools.partial(_print_scan_progress, interactive=interactive) if progress else None
     # The scan function uses app context implicitly via current_app
-    scan_photo_library()
+    stats = scan_photo_library(verify=verify, workers=workers, resume=not restart, progress=report,
+                               metadata_only=metadata_only, path=path, include=include or None,
+                               exclude=exclude or None)
+    if progress and interactive:
+        click.echo(err=True) # End the progress line
+    if stats and stats.stage_seconds:
+        click.echo("Time per stage (summed over workers): " +
+                   ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in stats.stage_seconds.items()))
+    if stats:
+        queued = enqueue_missing_thumbnails()
+        if queued:
+            click.echo(f"Queued {queued} thumbnail retries; run `flask run-jobs` to process them.")
     click.echo("Photo library scan finished.")
 
+@app.cli.command("watch-library")
+@click.option('--debounce', type=float, default=None, help='Seconds of quiet before changes are ingested (WATCH_DEBOUNCE).')
+@click.option('--poll-interval', type=int, default=None, help='Polling interval when inotify is unavailable (WATCH_POLL_INTERVAL).')
+@click.option('--polling', is_flag=True, help='Always poll instead of using inotify (e.g. for network shares).')
+@click.option('--workers', type=click.IntRange(min=1), default=None, help='Number of worker processes (WATCH_WORKERS).')
+def watch_library_command(debounce, poll_interval, polling, workers):
+    """Watches the photo library and ingests new, changed, moved and deleted photos."""
+    click.echo("Watching photo library, press Ctrl+C to stop...")
+    try:
+        watch_library(debounce=debounce, poll_interval=poll_interval, force_polling=polling, workers=workers)
+    except KeyboardInterrupt:
+        pass
+    click.echo("Stopped watching photo library.")
+
+def _job_worker_process(burst):
+    # Forked worker: don't share the parent's pooled database connections
+    with app.app_context():
+        db.engine.dispose(close=False)
+        run_worker(burst=burst)
+
+@app.cli.command("run-jobs")
+@click.option('--processes', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Number of worker processes claiming jobs in parallel.')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty instead of waiting for new jobs.')
+def run_jobs_command(processes, burst):
+    """Runs queued background jobs (scans, thumbnails, metadata) until interrupted."""
+    click.echo(f"Running jobs with {processes} worker process(es), press Ctrl+C to stop...")
+    try:
+        if processes == 1:
+            count = run_worker(burst=burst)
+            click.echo(f"Ran {count} jobs.")
+            return
+        workers = [multiprocessing.Process(target=_job_worker_process, args=(burst,), name=f'job-worker-{i}')
+                   for i in range(processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass # Interrupted jobs are requeued once their heartbeat goes stale
+    click.echo("Stopped running jobs.")
+
+@app.cli.command("compact-thumbnails")
+@click.option('--min-garbage', type=click.FloatRange(0, 1), default=0.2, show_default=True,
+              help='Only rewrite packs with at least this fraction of unreferenced bytes.')
+def compact_thumbnails_command(min_garbage):
+    """Reclaims space in the packed thumbnail store; packs other processes are writing are skipped."""
+    settings = thumbnail_settings(app.config)
+    store = get_thumbnail_store(settings)
+    if not hasattr(store, 'compact'):
+        click.echo(f"THUMBNAIL_STORE is '{store.kind}'; nothing to compact.")
+        return
+
+    def live_hashes(hashes):
+        rows = Photo.query.with_entities(Photo.file_hash).filter(Photo.file_hash.in_(hashes)).all()
+        return {row.file_hash for row in rows}
+
+    packs, reclaimed = store.compact(live_hashes, min_garbage_ratio=min_garbage)
+    click.echo(f"Compacted {packs} packs, reclaimed {reclaimed / (1024 * 1024):.1f} MB.")
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Rebuilds the full-text search index from the photo table."""
+    with db.engine.begin() as conn:
+        indexed = rebuild_index(conn)
+    click.echo(f"Indexed {indexed} photos.")
+
+@app.cli.command("find-duplicates")
+@click.option('--distance', type=click.IntRange(0, 64), default=3, show_default=True,
+              help='Maximum Hamming distance between perceptual hashes.')
+@click.option('--limit', type=int, default=50, show_default=True, help='Number of clusters to print.')
+def find_duplicates_command(distance, limit):
+    """Lists clusters of near-duplicate photos (resized, re-encoded or lightly edited copies)."""
+    with db.engine.connect() as conn:
+        clusters = find_duplicate_clusters(conn, distance)
+    click.echo(f"Found {len(clusters)} clusters of near-duplicates.")
+    paths = dict(Photo.query.with_entities(Photo.id, Photo.relative_path)
+                 .filter(Photo.id.in_([i for ids in clusters[:limit] for i in ids])).all())
+    for ids in clusters[:limit]:
+        click.echo('')
+        for photo_id in ids:
+            click.echo(f"  {paths.get(photo_id, photo_id)}")
+
+@app.cli.command("export")
+@click.argument('output', type=click.File('wb'))
+@click.option('--ids', multiple=True, help='Photo ids to export (comma separated, repeatable).')
+@click.option('--start', default=None, help='Photos taken on or after this ISO date/datetime.')
+@click.option('--end', default=None, help='Photos taken before this datetime, or on or before this date.')
+@click.option('--path', 'path', default=None, help='Only photos in this directory (relative to the library).')
+def export_command(output, ids, start, end, path):
+    """Writes a ZIP archive of original photos to OUTPUT ('-' for stdout); without options, the whole library."""
+    try:
+        filters = parse_search_filters({'start': start, 'end': end, 'path': path})
+        photo_ids = parse_photo_ids(ids)
+    except ValueError as e:
+        raise click.UsageError(f"Invalid export filter: {e}")
+    exported = 0
+
+    def counted(paths):
+        nonlocal exported
+        for relative_path in paths:
+            exported += 1
+            yield relative_path
+
+    selected = counted(export_paths(filter_clauses(filters), photo_ids))
+    written = 0
+    for chunk in zip_stream(app.config['PHOTO_LIBRARY_PATH'], selected,
+                            app.config['EXPORT_CHUNK_SIZE'], app.config['EXPORT_READ_AHEAD']):
+        output.write(chunk)
+        written += len(chunk)
+    click.echo(f"Exported {exported} photos ({written / (1024 * 1024):.1f} MB).", err=True)
+
 # Add other CLI commands here if needed
 # e.g., flask create-user, flask reset-db
 
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+from flask_migrate import upgrade
+
+from app import create_app, db
+from app.config import Config
+from app.models import User
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An app with its own migrated SQLite database and an empty library under tmp_path."""
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'test.db')
+        PHOTO_LIBRARY_PATH = str(tmp_path / 'library')
+        DATA_STORAGE_PATH = str(tmp_path / 'data')
+        THUMBNAIL_DIR = str(tmp_path / 'data' / 'thumbnails')
+        SCAN_METRICS_FILE = None
+        WTF_CSRF_ENABLED = False
+    os.makedirs(TestConfig.PHOTO_LIBRARY_PATH)
+    app = create_app(TestConfig)
+    with app.app_context():
+        upgrade(directory=os.path.join(BASE_DIR, 'migrations'))
+    return app
+
+
+@pytest.fixture
+def client(app):
+    """A test client logged in as user 'test'."""
+    with app.app_context():
+        user = User(username='test', email='test@example.com')
+        user.set_password('test')
+        db.session.add(user)
+        db.session.commit()
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    return client
@@ -0,0 +1,94 @@
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from app import db
+from app.auth import signing
+from app.auth.signing import signed_url_for
+from app.models import User, _user_cache, _user_cache_marker
+
+
+@pytest.fixture
+def library(app):
+    for name in ('a.jpg', 'b.jpg'):
+        Image.new('RGB', (8, 8), 'red').save(os.path.join(app.config['PHOTO_LIBRARY_PATH'], name), 'JPEG')
+    return app.config['PHOTO_LIBRARY_PATH']
+
+
+def _signed(app, relative_path):
+    with app.test_request_context():
+        return signed_url_for('main.get_image', relative_path=relative_path)
+
+
+def test_signed_url_serves_without_login(app, library):
+    assert app.test_client().get(_signed(app, 'a.jpg')).status_code == 200
+
+
+def test_unsigned_url_needs_login(app, library):
+    response = app.test_client().get('/image/a.jpg')
+    assert response.status_code == 302 and '/auth/login' in response.location
+
+
+def test_expired_signature_is_rejected(app, library, monkeypatch):
+    ttl = app.config['SIGNED_URL_TTL']
+    signed_at = time.time() - 3 * ttl # Valid for at most two TTLs
+    monkeypatch.setattr(signing.time, 'time', lambda: signed_at)
+    url = _signed(app, 'a.jpg')
+    monkeypatch.undo()
+    assert app.test_client().get(url).status_code == 302
+
+
+def test_tampered_signature_is_rejected(app, library):
+    url = _signed(app, 'a.jpg')
+    tampered = url[:-1] + ('A' if url[-1] != 'A' else 'B')
+    assert app.test_client().get(tampered).status_code == 302
+    later = url.replace('exp=', 'exp=9') # Extending the expiry invalidates the signature
+    assert app.test_client().get(later).status_code == 302
+
+
+def test_signature_is_bound_to_its_view_args(app, library):
+    query = _signed(app, 'a.jpg').split('?', 1)[1]
+    assert app.test_client().get(f'/image/b.jpg?{query}').status_code == 302
+    with app.test_request_context():
+        thumbnail_query = signed_url_for('main.get_thumbnail', photo_hash='a' * 64).split('?', 1)[1]
+    assert app.test_client().get(f"/thumbnail/{'b' * 64}?{thumbnail_query}").status_code == 302
+
+
+def test_password_change_ends_sessions(app, client):
+    assert client.get('/api/photos').status_code == 200
+    with app.app_context():
+        user = User.query.filter_by(username='test').one()
+        user.set_password('changed')
+        db.session.commit()
+    assert client.get('/api/photos').status_code == 302
+
+
+def test_deleted_user_is_not_served_from_cache(app, client):
+    assert client.get('/api/photos').status_code == 200 # Caches the user
+    with app.app_context():
+        db.session.delete(User.query.filter_by(username='test').one())
+        db.session.commit()
+    assert client.get('/api/photos').status_code == 302
+
+
+def test_logout_evicts_cached_user(app, client):
+    assert client.get('/api/photos').status_code == 200
+    assert _user_cache
+    client.get('/auth/logout')
+    assert not _user_cache
+
+
+def test_changes_in_other_processes_clear_the_cache(app, client):
+    assert client.get('/api/photos').status_code == 200
+    with app.app_context():
+        # Another process deleting the user: no ORM event here, only its marker file
+        db.session.execute(db.delete(User))
+        db.session.commit()
+        marker = _user_cache_marker()
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    with open(marker, 'a'):
+        pass
+    os.utime(marker, ns=(time.time_ns() + 10**9,) * 2)
+    assert client.get('/api/photos').status_code == 302
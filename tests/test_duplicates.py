@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from app import db
+from app.duplicates import cached_duplicate_clusters, dhash_bands, find_similar, hamming
+from app.models import Photo
+
+
+def _flip(dhash, bits):
+    for bit in bits:
+        dhash ^= 1 << bit
+    return dhash - (1 << 64) if dhash >= 1 << 63 else dhash # Stored signed, like Photo.dhash
+
+
+@pytest.fixture
+def hashes(app):
+    """200 random hashes plus near copies of the first one at distances 1-12, stored as photos."""
+    rng = random.Random(0)
+    base = rng.getrandbits(64)
+    values = [_flip(base, [])] + [_flip(base, rng.sample(range(64), d)) for d in range(1, 13)]
+    values += [_flip(rng.getrandbits(64), []) for _ in range(200)]
+    with app.app_context():
+        for i, dhash in enumerate(values):
+            db.session.add(Photo(filename=f'{i}.jpg', relative_path=f'{i}.jpg', file_hash=f'{i:064x}',
+                                 dhash=dhash, **dhash_bands(dhash)))
+        db.session.commit()
+        yield {photo.id: photo.dhash for photo in Photo.query}
+
+
+@pytest.mark.parametrize('distance', [0, 3, 4, 6, 8, 11, 12, 20])
+def test_find_similar_matches_brute_force(app, hashes, distance):
+    query_id = min(hashes)
+    expected = sorted((hamming(hashes[query_id], other), photo_id) for photo_id, other in hashes.items()
+                      if photo_id != query_id and hamming(hashes[query_id], other) <= distance)
+    with app.app_context():
+        assert find_similar(db.session.connection(), hashes[query_id], distance, exclude_id=query_id) == expected
+
+
+def test_duplicate_clusters_cached_until_hashes_change(app, hashes, monkeypatch):
+    import app.duplicates as duplicates
+    calls = []
+    compute = duplicates.find_duplicate_clusters
+    monkeypatch.setattr(duplicates, 'find_duplicate_clusters', lambda *args: calls.append(args) or compute(*args))
+    with app.app_context():
+        conn = db.session.connection()
+        first = cached_duplicate_clusters(conn, 3)
+        assert cached_duplicate_clusters(conn, 3) == first and len(calls) == 1
+        photo = db.session.get(Photo, max(hashes))
+        photo.dhash = min(hashes.values())
+        photo.dhash_band0 = dhash_bands(photo.dhash)['dhash_band0']
+        db.session.commit()
+        cached_duplicate_clusters(db.session.connection(), 3)
+        assert len(calls) == 2
@@ -0,0 +1,78 @@
+import io
+import os
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.export import export_paths, zip_stream
+from app.models import Photo
+
+
+def _add_photos(app, timestamps):
+    """Stores a photo (and its file) per timestamp; returns the paths in export order."""
+    library = app.config['PHOTO_LIBRARY_PATH']
+    with app.app_context():
+        for i, timestamp in enumerate(timestamps):
+            path = f'p{i:02d}.jpg'
+            with open(os.path.join(library, path), 'wb') as f:
+                f.write(os.urandom(1000 + i))
+            db.session.add(Photo(relative_path=path, filename=path, timestamp=timestamp))
+        db.session.commit()
+        return [p for (p,) in db.session.query(Photo.relative_path).order_by(Photo.timestamp, Photo.id)]
+
+
+def test_export_paths_batches_cover_every_photo_once(app):
+    tied = datetime(2024, 5, 1, 12, 0)
+    expected = _add_photos(app, [tied, None, tied, datetime(2023, 1, 1), tied, None, datetime(2025, 1, 1)])
+    with app.app_context():
+        paths = export_paths(batch_size=2)
+        assert not isinstance(paths, list)
+        assert list(paths) == expected # Photos without a timestamp first, then oldest first; ties by id
+        assert list(export_paths([Photo.timestamp == tied], batch_size=2)) == ['p00.jpg', 'p02.jpg', 'p04.jpg']
+
+
+def _archive(library, paths, **kwargs):
+    return b''.join(zip_stream(library, paths, chunk_size=256, read_ahead=1024, **kwargs))
+
+
+def test_zip_stream_produces_a_valid_archive(app):
+    paths = _add_photos(app, [datetime(2024, 1, d) for d in range(1, 4)])
+    library = app.config['PHOTO_LIBRARY_PATH']
+    with zipfile.ZipFile(io.BytesIO(_archive(library, iter(paths + ['missing.jpg'])))) as archive:
+        assert archive.testzip() is None # Every CRC verifies
+        assert archive.namelist() == paths # Unreadable files are skipped
+        for path in paths:
+            with open(os.path.join(library, path), 'rb') as f:
+                assert archive.read(path) == f.read()
+
+
+def test_zip_stream_zip64_archive_opens(app, monkeypatch):
+    paths = _add_photos(app, [datetime(2024, 1, d) for d in range(1, 4)])
+    # Archives over 4 GiB would be too slow to test; lower the limits that switch zipfile to ZIP64 instead
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 1500)
+    monkeypatch.setattr(zipfile, 'ZIP_FILECOUNT_LIMIT', 2)
+    data = _archive(app.config['PHOTO_LIBRARY_PATH'], paths)
+    monkeypatch.undo()
+    assert b'PK\x06\x06' in data # ZIP64 end of central directory record
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert [info.file_size for info in archive.infolist()] == [1000, 1001, 1002]
+
+
+def test_zip_stream_raises_when_the_path_iterator_fails(app):
+    def paths():
+        yield from _add_photos(app, [datetime(2024, 1, 1)])
+        raise RuntimeError('query failed')
+    with pytest.raises(RuntimeError, match='query failed'): # Not a hang waiting for the reader
+        _archive(app.config['PHOTO_LIBRARY_PATH'], paths())
+
+
+def test_export_route_streams_a_zip(app, client):
+    paths = _add_photos(app, [datetime(2024, 1, d) for d in range(1, 4)])
+    response = client.post('/export', json={'start': '2024-01-02'})
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == paths[1:]
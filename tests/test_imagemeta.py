@@ -0,0 +1,49 @@
+import io
+import struct
+
+import pytest
+from PIL import Image
+
+from app.fulltext import NOTE_TAGS
+from app.imagemeta import read_image_header, read_tiff_tags
+from app.photolib import normalize_exif
+
+
+def _tiff_with_user_comment(endian, comment):
+    """A TIFF header whose IFD0 points to an EXIF IFD holding only UserComment."""
+    order = b'II' if endian == '<' else b'MM'
+    exif_ifd = 8 + 2 + 12 + 4
+    comment_offset = exif_ifd + 2 + 12 + 4
+    return (order + struct.pack(f'{endian}HI', 42, 8)
+            + struct.pack(f'{endian}HHHII I', 1, 0x8769, 4, 1, exif_ifd, 0) # ExifOffset
+            + struct.pack(f'{endian}HHHII I', 1, 0x9286, 7, len(comment), comment_offset, 0) # UNDEFINED
+            + comment)
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+@pytest.mark.parametrize('comment, expected', [
+    (b'ASCII\x00\x00\x00Sunset at the pier\x00\x00', 'Sunset at the pier'),
+    (b'\x00' * 8 + 'Café'.encode(), 'Café'), # Undefined code, UTF-8 text
+    (b'UNICODE\x00\xff\xfe' + 'Café'.encode('utf-16-le'), 'Café'), # Byte order mark wins
+    (b'\x00' * 8 + b'   ', None), # Blank comments (a common camera default) are dropped
+    (b'EBCDIC\x00\x00abc', None),
+])
+def test_user_comment_is_decoded(endian, comment, expected):
+    tags = read_tiff_tags(_tiff_with_user_comment(endian, comment))
+    assert (str(tags['EXIF UserComment']) if 'EXIF UserComment' in tags else None) == expected
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_unicode_user_comment_follows_file_byte_order(endian):
+    text = 'Café'.encode('utf-16-le' if endian == '<' else 'utf-16-be')
+    tags = read_tiff_tags(_tiff_with_user_comment(endian, b'UNICODE\x00' + text))
+    assert str(tags['EXIF UserComment']) == 'Café'
+
+
+def test_jpeg_user_comment_reaches_notes():
+    exif = b'Exif\x00\x00' + _tiff_with_user_comment('>', b'ASCII\x00\x00\x00Sunset')
+    out = io.BytesIO()
+    Image.new('RGB', (64, 48), 'white').save(out, 'JPEG', exif=exif)
+    _, _, _, tags = read_image_header(out.getvalue())
+    exif_data = normalize_exif(tags)['exif_data']
+    assert [exif_data[tag] for tag in NOTE_TAGS if tag in exif_data] == ['Sunset']
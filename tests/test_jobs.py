@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import db
+from app.jobs import (
+    PRIORITY_BACKGROUND, PRIORITY_VIEWING, claim_job, enqueue, prioritize_thumbnails, thumbnail_job_key,
+)
+from app.models import Job
+
+
+def _writes(app):
+    """Collects the SQL write statements run through the app's engine."""
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    return statements
+
+
+def test_prioritize_without_queued_jobs_does_not_write(app):
+    with app.app_context():
+        writes = _writes(app)
+        assert prioritize_thumbnails(['a' * 64, 'b' * 64]) == 0
+        assert writes == []
+
+
+def test_prioritize_bumps_queued_jobs(app):
+    with app.app_context():
+        job = enqueue('thumbnail', {'hash': 'a' * 64}, priority=PRIORITY_BACKGROUND, dedupe_key=thumbnail_job_key('a' * 64))
+        assert prioritize_thumbnails(['a' * 64, 'b' * 64]) == 1
+        assert db.session.get(Job, job.id).priority == PRIORITY_VIEWING
+        assert prioritize_thumbnails(['a' * 64]) == 0 # Already at the front
+
+
+def test_poll_without_stale_or_queued_jobs_does_not_write(app):
+    with app.app_context():
+        job = enqueue('thumbnail', {'hash': 'a' * 64})
+        job.status, job.heartbeat_at = 'running', datetime.utcnow() # Alive
+        db.session.commit()
+        writes = _writes(app)
+        assert claim_job('worker') is None
+        assert writes == []
+
+
+def test_poll_requeues_stale_jobs(app):
+    with app.app_context():
+        job = enqueue('thumbnail', {'hash': 'a' * 64})
+        job.status, job.attempts = 'running', 1
+        job.heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+        claimed = claim_job('worker') # Requeued, then claimed again
+        assert (claimed.id, claimed.status, claimed.attempts) == (job.id, 'running', 2)
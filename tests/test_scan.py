@@ -0,0 +1,138 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from app import db
+from app.models import Photo, PhotoContent, ScanDirectory, ScanSession
+from app.photodb import PhotoBatchWriter
+from app.photolib import ScanStats, _run_pipeline, process_photo_file, scan_photo_library
+from app.thumbnails import thumbnail_settings
+
+
+def _library_file(app, relative_path, color='red'):
+    path = os.path.join(app.config['PHOTO_LIBRARY_PATH'], relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new('RGB', (64, 48), color).save(path, 'JPEG')
+    return path
+
+
+def test_copies_in_one_scan_are_processed_once(app):
+    original = _library_file(app, 'a.jpg')
+    os.makedirs(os.path.join(app.config['PHOTO_LIBRARY_PATH'], 'b'))
+    shutil.copy(original, os.path.join(app.config['PHOTO_LIBRARY_PATH'], 'b', 'a_copy.jpg'))
+    with app.app_context():
+        stats = scan_photo_library(workers=2)
+        assert (stats.added, stats.duplicates, stats.errors) == (2, 1, 0)
+        assert db.session.query(PhotoContent).count() == 1
+        photos = db.session.query(Photo).order_by(Photo.relative_path).all()
+        assert [p.relative_path for p in photos] == ['a.jpg', 'b/a_copy.jpg']
+        assert photos[0].file_hash == photos[1].file_hash and photos[0].width == photos[1].width == 64
+        assert all(p.thumbnail_generated and p.dhash is not None for p in photos)
+
+
+def test_claimed_content_skips_metadata_and_thumbnail(app):
+    original = _library_file(app, 'a.jpg')
+    copy = os.path.join(app.config['PHOTO_LIBRARY_PATH'], 'a_copy.jpg')
+    shutil.copy(original, copy)
+    with app.app_context():
+        settings = thumbnail_settings(app.config)
+    claims = {} # Stands in for the run's shared dict
+    first = process_photo_file(original, 'a.jpg', settings, claims=claims)
+    second = process_photo_file(copy, 'a_copy.jpg', settings, claims=claims)
+    assert 'thumbnail' in first['timings'] and not first.get('duplicate')
+    assert claims[first['file_hash']]['file_hash'] == first['file_hash']
+    assert second['duplicate'] and second['content'] == claims[first['file_hash']]
+    assert 'metadata' not in second['timings'] and 'thumbnail' not in second['timings']
+    assert (second['width'], second['dhash']) == (first['width'], first['dhash'])
+
+
+def test_directories_with_failed_files_are_not_checkpointed(app):
+    library = app.config['PHOTO_LIBRARY_PATH']
+    _library_file(app, 'good/a.jpg')
+    _library_file(app, 'bad/a.jpg')
+    open(os.path.join(library, 'bad', 'empty.jpg'), 'wb').close() # Fails in the worker
+    with app.app_context():
+        scan_session = ScanSession(library_path=library, verify=False)
+        db.session.add(scan_session)
+        db.session.commit()
+        session_id = scan_session.id
+
+        def feed(path_queue, stats):
+            for directory, names in (('good', ['a.jpg']), ('bad', ['a.jpg', 'empty.jpg'])):
+                for name in names:
+                    path_queue.put((os.path.join(library, directory, name), f'{directory}/{name}', None, None))
+                path_queue.put((None, directory, None, None))
+            path_queue.put(None)
+
+        stats = _run_pipeline(feed, False, workers=1, scan_session_id=session_id)
+        assert (stats.added, stats.errors) == (2, 1)
+        checkpointed = [d.path for d in ScanDirectory.query.filter_by(session_id=session_id)]
+        assert checkpointed == ['good']
+
+
+def test_directories_with_unwritable_rows_are_not_checkpointed(app):
+    with app.app_context():
+        scan_session = ScanSession(library_path=app.config['PHOTO_LIBRARY_PATH'], verify=False)
+        db.session.add(scan_session)
+        db.session.commit()
+        writer = PhotoBatchWriter(db.engine, ScanStats(), scan_session_id=scan_session.id)
+        writer.add({'status': 'new', 'relative_path': 'bad/a.jpg', 'filename': None}) # NOT NULL violation
+        writer.directory_done('bad')
+        writer.flush()
+        writer.directory_done('bad') # A marker arriving in a later batch
+        writer.flush()
+        assert ScanDirectory.query.count() == 0
+
+
+class _RecordingPool(ThreadPoolExecutor):
+    """An in-process pool that records the relative path of every file sent to a worker."""
+
+    submitted = []
+
+    def submit(self, fn, full_path, relative_path, *args):
+        self.submitted.append(relative_path)
+        return super().submit(fn, full_path, relative_path, *args)
+
+
+def _scan_recording(app, monkeypatch, **kwargs):
+    _RecordingPool.submitted = []
+    monkeypatch.setattr('app.photolib.scan_process_pool', _RecordingPool)
+    with app.app_context():
+        stats = scan_photo_library(workers=2, **kwargs)
+    return stats, sorted(_RecordingPool.submitted)
+
+
+def test_unchanged_files_are_not_rehashed(app, monkeypatch):
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        _library_file(app, name)
+    stats, submitted = _scan_recording(app, monkeypatch)
+    assert stats.added == 3 and submitted == ['a.jpg', 'b.jpg', 'c.jpg']
+
+    touched = os.path.join(app.config['PHOTO_LIBRARY_PATH'], 'b.jpg')
+    st = os.stat(touched)
+    os.utime(touched, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9)) # Same content, new stat signature
+    _library_file(app, 'c.jpg', color='blue')
+    stats, submitted = _scan_recording(app, monkeypatch)
+    assert submitted == ['b.jpg', 'c.jpg'] # a.jpg is skipped on its stat signature alone
+    assert (stats.skipped, stats.updated, stats.errors) == (2, 1, 0)
+
+    stats, submitted = _scan_recording(app, monkeypatch)
+    assert submitted == [] and stats.skipped == 3 # b.jpg's new signature was stored
+    stats, submitted = _scan_recording(app, monkeypatch, verify=True)
+    assert submitted == ['a.jpg', 'b.jpg', 'c.jpg']
+
+
+def test_files_deleted_or_added_mid_directory_are_detected(app, monkeypatch):
+    library = app.config['PHOTO_LIBRARY_PATH']
+    for name in ('a.jpg', 'c.jpg', 'e.jpg', 'sub/f.jpg'):
+        _library_file(app, name)
+    _scan_recording(app, monkeypatch)
+    os.remove(os.path.join(library, 'c.jpg'))
+    _library_file(app, 'b.jpg', color='green')
+    _library_file(app, 'd.jpg', color='blue')
+    _library_file(app, 'sub/0.jpg', color='white') # Sorts before the only stored file
+    stats, submitted = _scan_recording(app, monkeypatch)
+    assert submitted == ['b.jpg', 'd.jpg', 'sub/0.jpg']
+    assert (stats.added, stats.skipped, stats.missing) == (3, 3, 1)
@@ -0,0 +1,63 @@
+import queue
+import threading
+
+from app import db
+from app.models import Photo
+from app.photodb import PhotoBatchWriter
+from app.photolib import ScanStats, _write_results
+
+
+class _BrokenEngine:
+    """An engine whose every transaction fails, e.g. a database that stays locked."""
+
+    def begin(self):
+        raise RuntimeError("database is locked")
+
+
+def _unchanged(path):
+    return {'status': 'unchanged', 'relative_path': path, 'filesize': 1, 'mtime_ns': 1, 'inode': 1, 'device': 1}
+
+
+def test_failed_batch_and_checkpoint_do_not_raise():
+    stats = ScanStats()
+    writer = PhotoBatchWriter(_BrokenEngine(), stats, scan_session_id=1)
+    writer.add(_unchanged('a.jpg'))
+    writer.directory_done('')
+    writer.flush()
+    assert stats.errors == 1
+
+
+def test_writer_releases_in_flight_after_write_errors(app, monkeypatch):
+    def fail(self, result):
+        raise RuntimeError("write failed")
+    monkeypatch.setattr(PhotoBatchWriter, 'add', fail)
+    results = queue.Queue()
+    in_flight = threading.BoundedSemaphore(3)
+    for i in range(3):
+        in_flight.acquire()
+        results.put(_unchanged(f'{i}.jpg'))
+    results.put({'status': 'dir_done', 'relative_path': ''})
+    results.put(None)
+    stats = ScanStats()
+    writer = threading.Thread(target=_write_results, args=(app, results, in_flight, stats, 500, None))
+    writer.start()
+    writer.join(timeout=10)
+    assert not writer.is_alive()
+    assert stats.processed == 3
+    assert all(in_flight.acquire(blocking=False) for _ in range(3))
+
+
+def _new(path):
+    return {'status': 'new', 'relative_path': path, 'filename': path, 'directory': '', 'file_hash': None}
+
+
+def test_bad_row_does_not_lose_the_rest_of_its_batch(app):
+    with app.app_context():
+        stats = ScanStats()
+        writer = PhotoBatchWriter(db.engine, stats, batch_size=10)
+        for result in (_new('a.jpg'), _new('b.jpg'), {**_new('bad.jpg'), 'filename': None}, _new('c.jpg')):
+            writer.add(result) # The NOT NULL violation fails the batch, then the rows are retried one by one
+        writer.flush()
+        assert (stats.added, stats.errors) == (3, 1)
+        assert [p for (p,) in db.session.query(Photo.relative_path).order_by(Photo.relative_path)] == \
+            ['a.jpg', 'b.jpg', 'c.jpg']
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models import Photo
+from app.search import parse_search_filters
+
+
+def test_json_filter_values():
+    filters = parse_search_filters({'ext': ['jpg', 'PNG'], 'min_width': 100, 'path': 'Trips'})
+    assert set(filters) == {'extension', 'dimensions', 'path'}
+
+
+@pytest.mark.parametrize('args', [
+    {'ext': [1]}, {'path': 5}, {'start': ['2024-01-01']}, {'camera_make': {'a': 1}}, {'min_width': True},
+])
+def test_non_string_filter_values_rejected(args):
+    with pytest.raises(ValueError):
+        parse_search_filters(args)
+
+
+@pytest.mark.parametrize('body', [{'ext': ['jpg'], 'path': 5}, {'path': 5}, {'q': ['x']}, {'ids': [{}]}])
+def test_export_rejects_bad_json_filters(client, body):
+    assert client.post('/export', json=body).status_code == 400
+
+
+def test_export_accepts_json_list_filter(client):
+    assert client.post('/export', json={'ext': ['jpg']}).status_code == 404 # Valid, but the library is empty
+
+
+def test_timeline_cursor_pages_neither_overlap_nor_skip_tied_timestamps(app, client):
+    tied, older = datetime(2024, 5, 1, 12, 0), datetime(2023, 1, 1)
+    with app.app_context():
+        for i, timestamp in enumerate([tied, older, tied, tied, None, older, tied, datetime(2025, 1, 1)]):
+            db.session.add(Photo(relative_path=f'p{i}.jpg', filename=f'p{i}.jpg', timestamp=timestamp))
+        db.session.commit()
+        expected = [photo_id for (photo_id,) in db.session.query(Photo.id).filter(Photo.timestamp.isnot(None))
+                    .order_by(Photo.timestamp.desc(), Photo.id.desc())]
+    seen, cursor = [], None
+    while True:
+        response = client.get('/api/photos', query_string={'limit': 2, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.get_json()
+        seen += [photo['id'] for photo in page['photos']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert seen == expected # Newest first, ties by id; every page boundary falls inside a run of ties
+
+
+def test_timeline_rejects_malformed_cursor(client):
+    assert client.get('/api/photos', query_string={'cursor': 'not-a-cursor'}).status_code == 400
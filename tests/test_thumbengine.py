@@ -0,0 +1,31 @@
+import io
+
+import pytest
+from PIL import Image
+
+from app.thumbengine import PillowThumbnailer, available_backends, get_thumbnailer
+
+ROTATED_ORIENTATIONS = (5, 6, 7, 8) # Width and height swap
+
+
+def _encoded(fmt, orientation, size=(300, 100)):
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    out = io.BytesIO()
+    Image.new('RGB', size, 'white').save(out, fmt, exif=exif)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('orientation', range(1, 9))
+def test_pillow_tiff_orientation_applied_once(orientation):
+    thumbnailer = PillowThumbnailer({'resample': 'bicubic'})
+    thumb = thumbnailer.thumbnail(io.BytesIO(_encoded('TIFF', orientation)), 128)
+    assert thumb.size == ((43, 128) if orientation in ROTATED_ORIENTATIONS else (128, 43))
+
+
+@pytest.mark.parametrize('backend', available_backends())
+@pytest.mark.parametrize('fmt', ['JPEG', 'TIFF'])
+def test_backends_agree_on_orientation(backend, fmt):
+    thumbnailer = get_thumbnailer({'backend': backend, 'resample': 'bicubic'})
+    thumb = thumbnailer.to_pillow(thumbnailer.thumbnail(io.BytesIO(_encoded(fmt, 6)), 128))
+    assert thumb.size == (43, 128)
@@ -0,0 +1,70 @@
+import time
+import threading
+
+from app.thumbstore import PackedThumbnailStore
+
+
+def test_packed_reads_survive_concurrent_eviction(tmp_path):
+    store = PackedThumbnailStore({'dir': str(tmp_path)})
+    store.MAX_OPEN_PACKS = 1 # Mapping one pack evicts the other's map
+    renditions = {}
+    for i in range(2):
+        store.PACK_MAX_SIZE = 0 # Each put starts a new pack
+        data = bytes([i]) * 65536
+        store.put(f'hash{i}', 256, 'jpg', data)
+        renditions[f'hash{i}'] = data
+
+    map_pack = store._map
+
+    def slow_map(pack, min_size):
+        mapped = map_pack(pack, min_size)
+        time.sleep(0.001) # Widens the window between looking a map up and reading from it
+        return mapped
+
+    store._map = slow_map
+    errors = []
+
+    def read(photo_hash):
+        try:
+            for _ in range(50):
+                assert store.read(photo_hash, 256, 'jpg') == renditions[photo_hash]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read, args=(h,)) for h in renditions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_compact_merges_small_packs_but_not_one_in_use(tmp_path):
+    writer = PackedThumbnailStore({'dir': str(tmp_path)}) # Stands in for another running process
+    writer.PACK_MAX_SIZE = 0 # Each put starts a new pack
+    renditions = {f'hash{i}': bytes([i]) * 1000 for i in range(3)}
+    for photo_hash, data in renditions.items():
+        writer.put(photo_hash, 256, 'jpg', data)
+    pack_dir = tmp_path / 'packs'
+    packs_before = {p.name for p in pack_dir.glob('*.pack')}
+    assert len(packs_before) == 3
+
+    compactor = PackedThumbnailStore({'dir': str(tmp_path)})
+    compactor.PACK_MIN_AGE = 0
+    assert compactor.compact(lambda hashes: set(hashes)) == (2, 0) # Fully live: nothing reclaimed
+    packs_after = {p.name for p in pack_dir.glob('*.pack')}
+    assert writer._pack_name in packs_after # Still being appended to
+    assert len(packs_after) == 2 # The writer's pack and the merged one
+    for photo_hash, data in renditions.items():
+        assert writer.read(photo_hash, 256, 'jpg') == data
+    writer.put('hash3', 256, 'jpg', b'more')
+    assert compactor.read('hash3', 256, 'jpg') == b'more'
+
+
+def test_compact_skips_recently_written_packs(tmp_path):
+    store = PackedThumbnailStore({'dir': str(tmp_path)})
+    store.PACK_MAX_SIZE = 0
+    for i in range(3):
+        store.put(f'hash{i}', 256, 'jpg', b'x' * 100)
+    compactor = PackedThumbnailStore({'dir': str(tmp_path)})
+    assert compactor.compact(lambda hashes: set()) == (0, 0) # Everything is garbage, but was just written
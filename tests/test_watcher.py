@@ -0,0 +1,134 @@
+import os
+import queue
+
+from app import db
+from app.models import Photo, file_directory
+from app.photolib import stat_signature
+from app.watcher import ChangeSet, LibraryPoller, _pair_renames
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_changeset_waits_for_quiet_period_or_max_delay(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr('app.watcher.time.monotonic', clock)
+    changes = ChangeSet()
+    assert not changes.ready(2, 10) # Nothing recorded
+    changes.record('changed', 'a.jpg')
+    clock.now += 1
+    assert not changes.ready(2, 10)
+    clock.now += 2
+    assert changes.ready(2, 10) # Quiet for 2s
+
+    busy, first = ChangeSet(), clock.now
+    for _ in range(12): # An event every second never leaves a quiet period...
+        busy.record('changed', 'b.jpg')
+        clock.now += 1
+        assert busy.ready(2, 10) == (clock.now - first >= 10) # ...but max_delay flushes it
+
+
+def test_changeset_later_events_supersede_earlier_ones():
+    changes = ChangeSet()
+    changes.record('changed', 'a.jpg.part')
+    changes.record('changed', 'notes.txt')
+    changes.record('moved', 'a.jpg.part', dest='a.jpg') # Upload finished
+    changes.record('changed', 'a.jpg')
+    changes.record('changed', 'b.jpg')
+    changes.record('deleted', 'b.jpg')
+    changes.record('changed', 'c.jpg')
+    changes.record('moved', 'c.jpg', dest='d.jpg')
+    assert changes.changed == {'a.jpg', 'd.jpg'}
+    assert changes.deleted == {'b.jpg': False}
+    assert changes.moves == [('c.jpg', 'd.jpg', False)]
+
+
+def test_changeset_directory_events():
+    changes = ChangeSet()
+    changes.record('changed', 'trip/a.jpg')
+    changes.record('moved', 'trip', is_directory=True, dest='2024/trip')
+    changes.record('moved', 'trip/b.jpg', dest='2024/trip/b.jpg') # Sub-event of the directory move
+    changes.record('changed', 'old/c.jpg')
+    changes.record('deleted', 'old', is_directory=True)
+    assert changes.changed == {'2024/trip/a.jpg'}
+    assert changes.moves == [('trip', '2024/trip', True)]
+    assert changes.deleted == {'old': True}
+
+
+def _stored_file(app, relative_path):
+    """Writes a file and stores its Photo row with the file's stat signature."""
+    path = os.path.join(app.config['PHOTO_LIBRARY_PATH'], relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(relative_path.encode())
+    size, mtime_ns, inode, device = stat_signature(os.stat(path))
+    db.session.add(Photo(relative_path=relative_path, filename=os.path.basename(relative_path),
+                         directory=file_directory(relative_path), filesize=size, mtime_ns=mtime_ns,
+                         inode=inode, device=device))
+    db.session.commit()
+    return path
+
+
+def test_pair_renames_turns_delete_and_create_into_a_move(app):
+    library = app.config['PHOTO_LIBRARY_PATH']
+    with app.app_context():
+        moved = _stored_file(app, 'a.jpg')
+        _stored_file(app, 'album/b.jpg')
+        gone = _stored_file(app, 'c.jpg')
+        os.makedirs(os.path.join(library, 'new'))
+        os.rename(moved, os.path.join(library, 'new', 'a.jpg'))
+        os.remove(gone)
+        with open(os.path.join(library, 'fresh.jpg'), 'wb') as f:
+            f.write(b'new file')
+
+        changes = ChangeSet()
+        for kind, path in [('deleted', 'a.jpg'), ('deleted', 'c.jpg'),
+                           ('changed', 'new/a.jpg'), ('changed', 'fresh.jpg')]:
+            changes.record(kind, path)
+        with db.engine.connect() as conn:
+            _pair_renames(conn, changes, library)
+        assert changes.moves == [('a.jpg', 'new/a.jpg', False)] # Not re-hashed
+        assert changes.changed == {'fresh.jpg'}
+        assert changes.deleted == {'c.jpg': False}
+
+
+def _drain(events):
+    drained = set()
+    while True:
+        try:
+            kind, path, is_directory, _ = events.get_nowait()
+        except queue.Empty:
+            return drained
+        drained.add((kind, path, is_directory))
+
+
+def test_poller_diffs_changed_directories_against_the_database(app):
+    library = app.config['PHOTO_LIBRARY_PATH']
+    with app.app_context():
+        _stored_file(app, 'a.jpg')
+        removed = _stored_file(app, 'album/b.jpg')
+        _stored_file(app, 'old/c.jpg')
+        events = queue.Queue()
+        poller = LibraryPoller(library, events, 60, db.engine)
+        poller._poll(emit=False)
+        assert all(isinstance(digest, bytes) for _, digest, _ in poller._dirs.values()) # No file names kept
+
+        os.remove(removed)
+        os.remove(os.path.join(library, 'old', 'c.jpg'))
+        os.rmdir(os.path.join(library, 'old'))
+        with open(os.path.join(library, 'album', 'd.jpg'), 'wb') as f:
+            f.write(b'new')
+        open(os.path.join(library, 'notes.txt'), 'w').close() # Unsupported; only bumps the root mtime
+        poller._poll(emit=True)
+        assert _drain(events) == {('changed', 'album/d.jpg', False), ('deleted', 'album/b.jpg', False),
+                                  ('deleted', 'old', True)}
+
+        os.remove(os.path.join(library, 'notes.txt'))
+        poller.engine = None # Same listing digest, so the database must not be consulted
+        poller._poll(emit=True)
+        assert _drain(events) == set()